@@ -1,7 +1,7 @@
 # accounts/admin.py
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User
+from .models import EmailCampaign, EmailCampaignFailure, EmailOutbox, User, UserLocation
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -16,4 +16,38 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
     
-    readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(UserLocation)
+class UserLocationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'latitude', 'longitude', 'accuracy', 'speed', 'updated_at',
+                    'accepted_fixes', 'suppressed_fixes')
+    search_fields = ('user__username', 'user__email')
+    list_select_related = ('user',)
+    ordering = ('-updated_at',)
+    readonly_fields = ('updated_at', 'accepted_fixes', 'suppressed_fixes')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'kind', 'subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('to_email', 'subject')
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
+
+@admin.register(EmailCampaign)
+class EmailCampaignAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'sent_count', 'failed_count', 'last_user_id', 'started_at', 'completed_at')
+    list_filter = ('status',)
+    search_fields = ('name', 'subject_template')
+    ordering = ('-created_at',)
+    readonly_fields = ('status', 'last_user_id', 'sent_count', 'failed_count', 'created_at', 'started_at', 'completed_at')
+
+
+@admin.register(EmailCampaignFailure)
+class EmailCampaignFailureAdmin(admin.ModelAdmin):
+    list_display = ('campaign', 'user', 'error', 'failed_at')
+    list_filter = ('campaign',)
+    search_fields = ('user__email',)
+    list_select_related = ('campaign', 'user')
+    readonly_fields = ('campaign', 'user', 'error', 'failed_at')
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "accounts"
+
+    def ready(self):
+        from location_reminder.caches import check_shared_cache
+        from . import signals  # noqa: F401
+
+        # トークン認証キャッシュの破棄を全ワーカーに届けるため
+        checks.register(check_shared_cache, checks.Tags.caches)
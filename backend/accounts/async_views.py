@@ -0,0 +1,170 @@
+# accounts/async_views.py
+"""
+ログイン・新規登録のASGI向け非同期版。
+
+パスワードのハッシュ計算（PBKDF2）はイベントループではなく上限付きの専用スレッドプールで行い
+（accounts/backends.py）、DBアクセスは非同期ORMを使う。
+同じクライアントIPからの同時リクエスト数には上限を設ける。
+DRFのビューは非同期に対応していないため、素のDjangoビューとして実装している。
+"""
+import json
+import threading
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aauthenticate, alogin
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authtoken.models import Token
+
+from .backends import run_hashing
+from .serializers import LoginCredentialsSerializer, UserRegistrationSerializer, UserSerializer
+from .utils import send_verification_email
+
+
+class IpConcurrencyLimiter:
+    """IPアドレスごとの同時実行数の上限（超えた分は待たせずに拒否する）"""
+
+    def __init__(self, limit=None):
+        self._limit = limit
+        self._active = {}
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        if self._limit is None:
+            return settings.AUTH_MAX_CONCURRENT_PER_IP
+        return self._limit
+
+    def acquire(self, ip):
+        with self._lock:
+            count = self._active.get(ip, 0)
+            if count >= self.limit:
+                return False
+            self._active[ip] = count + 1
+            return True
+
+    def release(self, ip):
+        with self._lock:
+            count = self._active.get(ip, 0) - 1
+            if count > 0:
+                self._active[ip] = count
+            else:
+                self._active.pop(ip, None)
+
+
+auth_limiter = IpConcurrencyLimiter()
+
+
+def client_ip(request):
+    """
+    同時実行数の上限に使うクライアントIP。
+    AUTH_TRUSTED_PROXY_COUNT段のプロキシの後ろでは、X-Forwarded-Forの右からその段数目
+    （最も外側の信頼できるプロキシが見た接続元）を使う。クライアントが偽装できる左側の値は使わない
+    """
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    count = settings.AUTH_TRUSTED_PROXY_COUNT
+    if count <= 0:
+        return remote_addr
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if len(forwarded) < count:
+        # 信頼できるプロキシを経由していない
+        return remote_addr
+    return forwarded[-count]
+
+
+def limit_per_ip(view):
+    """同じクライアントIPからの同時リクエストがAUTH_MAX_CONCURRENT_PER_IPを超えたら429を返す"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        ip = client_ip(request)
+        if not auth_limiter.acquire(ip):
+            return JsonResponse({
+                'error': 'リクエストが集中しています。しばらく後でお試しください。'
+            }, status=429)
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            auth_limiter.release(ip)
+    return wrapper
+
+
+def _parse_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@csrf_exempt
+@require_POST
+@limit_per_ip
+async def async_login(request):
+    """login_viewの非同期版"""
+    data = _parse_body(request)
+    if data is None:
+        return JsonResponse({'error': 'JSON形式のリクエストが必要です。'}, status=400)
+
+    serializer = LoginCredentialsSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+
+    # AUTHENTICATION_BACKENDSを通す（失敗時はuser_login_failedシグナルも送られる）。
+    # PooledHashingModelBackendはハッシュ計算だけを専用スレッドプールで行う
+    user = await aauthenticate(request, username=email, password=password)
+    if user is None:
+        return JsonResponse({'non_field_errors': ['認証情報が正しくありません']}, status=400)
+
+    # メール認証チェック
+    if not user.is_email_verified:
+        return JsonResponse({
+            'error': 'メールアドレスが認証されていません。メールをご確認いただき、認証リンクをクリックしてください。',
+            'requires_verification': True,
+            'email': user.email
+        }, status=400)
+
+    await alogin(request, user)
+    token, created = await Token.objects.aget_or_create(user=user)
+    return JsonResponse({
+        'token': token.key,
+        'user': UserSerializer(user).data
+    })
+
+
+def _register(serializer, password_hash, request):
+    """registerと同じく、ユーザー作成と認証メールの登録を1トランザクションで行う（同期）"""
+    with transaction.atomic():
+        user = serializer.save(password_hash=password_hash)
+        send_verification_email(user, request)
+    return user
+
+
+@csrf_exempt
+@require_POST
+@limit_per_ip
+async def async_register(request):
+    """registerの非同期版"""
+    data = _parse_body(request)
+    if data is None:
+        return JsonResponse({'error': 'JSON形式のリクエストが必要です。'}, status=400)
+
+    # 一意性チェックなどDBを使う検証は同期ORMのためスレッドで実行
+    serializer = UserRegistrationSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=400)
+
+    password_hash = await run_hashing(make_password, serializer.validated_data['password'])
+    user = await sync_to_async(_register)(serializer, password_hash, request)
+
+    return JsonResponse({
+        'message': 'アカウントが作成されました。メールに送信された認証リンクをクリックして、メールアドレスを認証してください。',
+        'email': user.email,
+        'requires_verification': True
+    }, status=201)
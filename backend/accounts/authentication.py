@@ -0,0 +1,113 @@
+# accounts/authentication.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from location_reminder.caches import is_shared_cache
+
+# 以前のpickle済みユーザーのエントリを読まないよう、キー名を変えている
+_CACHE_KEY = 'accounts:auth_snapshot:{digest}'
+
+# キャッシュに載せるユーザーのフィールド（主キーと権限判定に使うフラグだけ）。
+# パスワードハッシュ・iCloud認証情報・外部サービスのIDなどはキャッシュに置かない
+SNAPSHOT_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _digest(key):
+    # トークンそのものはキャッシュキーに使わない
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class _LocalTokenCache:
+    """プロセス内のTTL付きLRU（トークンのダイジェスト -> ユーザーのスナップショット）"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return payload
+
+    def set(self, digest, payload):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + settings.TOKEN_AUTH_LOCAL_TTL, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > settings.TOKEN_AUTH_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_token_cache = _LocalTokenCache()
+
+
+def invalidate_token(key):
+    """トークン1件のキャッシュを破棄"""
+    digest = _digest(key)
+    local_token_cache.delete(digest)
+    cache.delete(_CACHE_KEY.format(digest=digest))
+
+
+def invalidate_user_tokens(user_id):
+    """ユーザーの全トークンのキャッシュを破棄（ログアウト・パスワード変更・無効化時）"""
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthenticationの置き換え。
+    トークン→ユーザーのスナップショット（SNAPSHOT_FIELDSの値だけ）をプロセス内LRUとDjangoキャッシュに持ち、
+    キャッシュに当たればToken+Userの結合クエリを発行しない。
+    request.userはスナップショット以外のフィールドを遅延読み込みにしたインスタンスなので、
+    他のフィールドを読むビューや書き込むビューはDBから読み直すこと。
+    ログアウト・パスワード変更・無効化時の破棄は共有キャッシュからすぐに消えるが、
+    他プロセスのLRUに残ったエントリは消せないため、破棄したトークンも他のワーカーでは
+    最大TOKEN_AUTH_LOCAL_TTL秒の間は認証に通る。
+    そのためDjangoキャッシュは全ワーカーで共有されるもの（LocMemCache以外）でなければならない。
+    """
+
+    def authenticate_credentials(self, key):
+        if not is_shared_cache():
+            # プロセス内キャッシュでは破棄が他のワーカーに届かず、TOKEN_AUTH_CACHE_TTL秒の間ログアウト済みの
+            # トークンが通ってしまう
+            raise ImproperlyConfigured(
+                'CachedTokenAuthenticationには全ワーカーで共有されるキャッシュ（Redis・DatabaseCache等）が必要です'
+            )
+        digest = _digest(key)
+        snapshot = local_token_cache.get(digest)
+        if snapshot is None:
+            snapshot = cache.get(_CACHE_KEY.format(digest=digest))
+            if snapshot is None:
+                user, _ = super().authenticate_credentials(key)
+                snapshot = (user._state.db, tuple(getattr(user, field) for field in SNAPSHOT_FIELDS))
+                cache.set(_CACHE_KEY.format(digest=digest), snapshot, settings.TOKEN_AUTH_CACHE_TTL)
+            local_token_cache.set(digest, snapshot)
+
+        # リクエストごとに別インスタンスを作り、スナップショットを書き換えさせない
+        db, values = snapshot
+        user = get_user_model().from_db(db, SNAPSHOT_FIELDS, values)
+        return (user, Token(key=key, user=user))
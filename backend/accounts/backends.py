@@ -0,0 +1,59 @@
+# accounts/backends.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password, verify_password
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                _hash_pool = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash'
+                )
+    return _hash_pool
+
+
+async def run_hashing(func, *args):
+    """ハッシュ計算を専用スレッドプールで実行（同時実行数はPASSWORD_HASH_WORKERSまで）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), func, *args)
+
+
+class PooledHashingModelBackend(ModelBackend):
+    """
+    ModelBackendと同じ認証。
+    Django標準のaauthenticateはハッシュ計算（PBKDF2）をイベントループ上で行うため、
+    非同期版ではハッシュ計算だけを専用スレッドプールで行い、DBアクセスは非同期ORMを使う。
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # ユーザーの有無で応答時間が変わらないよう、存在しない場合もハッシュ計算を行う
+            await run_hashing(make_password, password)
+            return None
+
+        is_correct, must_update = await run_hashing(verify_password, password, user.password)
+        if not is_correct:
+            return None
+        if must_update:
+            # ハッシュのパラメータが古ければ再計算して保存（authenticateと同じ挙動）
+            user.password = await run_hashing(make_password, password)
+            await user.asave(update_fields=['password'])
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,299 @@
+# accounts/campaigns.py
+"""
+お知らせメールの一斉送信。
+
+- 宛先はユーザーIDの昇順に .iterator() で流し読みする（全件をメモリに載せない）
+- 件名・本文のテンプレートは送信開始時に1回だけコンパイルする
+- 少数のワーカースレッドがそれぞれ持続的なSMTP接続を持ち、まとめて送信する
+- 全ワーカー共通のトークンバケットで毎秒の送信数を制限する
+- 先頭から連続して送り終えたバッチの最後のユーザーIDをチェックポイントとして保存する
+  （中断後は続きから再開。中断時に送信中だったバッチは再送されることがある）
+- 宛先ごとの拒否は EmailCampaignFailure に記録してチェックポイントを進める（retry_failed で再送）
+- SMTP接続そのものの障害は待って再試行し、続くようならチェックポイントを進めずに中断する
+"""
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template import Context, Engine
+from django.utils import timezone
+
+from .models import EmailCampaignFailure, User
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignConnectionError(Exception):
+    """SMTP接続の障害が続き、送信を中断した（チェックポイントは送り終えたバッチまで）"""
+
+
+def is_connection_error(error):
+    """宛先・本文ごとの拒否ではなく、SMTP接続そのものの障害か"""
+    # SMTPExceptionはOSErrorのサブクラスなので、宛先・本文の拒否を先に除く
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+        return False
+    return isinstance(error, OSError)
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット（rate件/秒、最大burst件まで貯まる）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CompiledCampaign:
+    """キャンペーンのテンプレートをコンパイル済みで保持し、ユーザーごとのメールを組み立てる"""
+
+    def __init__(self, campaign):
+        engine = Engine.get_default()
+        self.subject = engine.from_string(campaign.subject_template)
+        self.body = engine.from_string(campaign.body_template)
+        self.html = engine.from_string(campaign.html_template) if campaign.html_template else None
+
+    def render(self, user):
+        values = {'user': user, 'frontend_url': settings.FRONTEND_URL}
+        plain = Context(values, autoescape=False)
+        subject = ' '.join(self.subject.render(plain).split())
+        message = EmailMultiAlternatives(
+            subject=subject,
+            body=self.body.render(plain),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+        if self.html is not None:
+            message.attach_alternative(self.html.render(Context(values)), 'text/html')
+        return message
+
+
+class _SenderPool:
+    """ワーカースレッドごとに1本のSMTP接続を持ち回すスレッドプール"""
+
+    def __init__(self, workers, bucket):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='campaign-smtp')
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._bucket = bucket
+        # どれかのワーカーが接続障害で中断したら、他のワーカーも送信をやめる
+        self._stopped = threading.Event()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection(fail_silently=False)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        # 開いたままなら何もしない
+        connection.open()
+        return connection
+
+    def _close_connection(self):
+        # 接続が壊れている可能性があるので次のメールで開き直す
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+
+    def _send_one(self, message):
+        """1通送る。接続障害は待って再試行し、続くようならCampaignConnectionErrorで中断する"""
+        delay = settings.EMAIL_CAMPAIGN_RETRY_DELAY
+        for attempt in range(settings.EMAIL_CAMPAIGN_CONNECTION_RETRIES + 1):
+            if self._stopped.is_set():
+                raise CampaignConnectionError('他のワーカーがSMTP接続の障害で中断しました')
+            try:
+                self._connection().send_messages([message])
+                return
+            except Exception as e:
+                self._close_connection()
+                if not is_connection_error(e):
+                    raise
+                if attempt == settings.EMAIL_CAMPAIGN_CONNECTION_RETRIES:
+                    self._stopped.set()
+                    raise CampaignConnectionError(f'SMTP接続の障害が続くため送信を中断しました: {e}') from e
+                logger.warning(f'SMTP接続に失敗しました（{delay}秒後に再試行）: {e}')
+                time.sleep(delay)
+                delay *= 2
+
+    def _send(self, recipients):
+        """(ユーザーID, メール) を順に送り、(送信できたユーザーID, [(ユーザーID, エラー)]) を返す"""
+        sent, failures = [], []
+        for user_id, message in recipients:
+            self._bucket.acquire()
+            try:
+                self._send_one(message)
+            except CampaignConnectionError:
+                raise
+            except Exception as e:
+                logger.warning(f'お知らせメールの送信に失敗しました: {message.to}: {e}')
+                failures.append((user_id, str(e)))
+            else:
+                sent.append(user_id)
+        return sent, failures
+
+    def submit(self, recipients):
+        return self._executor.submit(self._send, recipients)
+
+    def shutdown(self, cancel=False):
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+        for connection in self._connections:
+            connection.close()
+
+
+def campaign_recipients(after_user_id, chunk_size=500, failed_in=None):
+    """
+    送信対象（有効かつメール認証済み）のユーザーをID順に流し読みする。
+    failed_in を渡すとそのキャンペーンで送れなかった宛先だけにする。
+    """
+    users = User.objects.filter(is_active=True, is_email_verified=True, pk__gt=after_user_id)
+    if failed_in is not None:
+        users = users.filter(pk__in=EmailCampaignFailure.objects.filter(campaign=failed_in).values('user_id'))
+    return (
+        users
+        .exclude(email='')
+        .order_by('pk')
+        .only('id', 'username', 'email', 'first_name', 'last_name')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _record_failures(campaign, failures):
+    """送れなかった宛先を記録（再送でも失敗した場合はエラーを更新）"""
+    EmailCampaignFailure.objects.bulk_create(
+        [EmailCampaignFailure(campaign=campaign, user_id=user_id, error=error) for user_id, error in failures],
+        update_conflicts=True, unique_fields=['campaign', 'user'], update_fields=['error', 'failed_at'],
+    )
+
+
+def _deliver(campaign, recipients, workers, rate, batch_size, save_batches):
+    """
+    宛先をバッチにしてワーカーに渡し、先頭から連続して完了したバッチの結果を
+    save_batches([(最後のユーザーID, 送信できたユーザーID, 失敗)]) に渡す。
+    接続障害で中断したバッチ以降は渡さずにCampaignConnectionErrorを送出する。
+    """
+    compiled = CompiledCampaign(campaign)
+    pool = _SenderPool(workers, TokenBucket(rate))
+    # 送信順に並んだ (最後のユーザーID, future)。先頭から完了したものだけチェックポイントに反映する
+    in_flight = deque()
+
+    def checkpoint(block, raise_errors=True):
+        done, error = [], None
+        while in_flight and (block or in_flight[0][1].done()):
+            future = in_flight[0][1]
+            if future.cancelled():
+                break
+            error = future.exception()
+            if error is not None:
+                break
+            last_user_id, _ = in_flight.popleft()
+            sent, failures = future.result()
+            done.append((last_user_id, sent, failures))
+            block = False
+        if done:
+            save_batches(done)
+        if error is not None and raise_errors:
+            raise error
+
+    try:
+        batch = []
+        for user in recipients:
+            batch.append((user.pk, compiled.render(user)))
+            if len(batch) < batch_size:
+                continue
+            in_flight.append((user.pk, pool.submit(batch)))
+            batch = []
+            checkpoint(block=False)
+            # 送信待ちのバッチが溜まりすぎないように先頭の完了を待つ
+            if len(in_flight) >= workers * 2:
+                checkpoint(block=True)
+        if batch:
+            in_flight.append((batch[-1][0], pool.submit(batch)))
+        while in_flight:
+            checkpoint(block=True)
+    except BaseException:
+        # 中断時は未着手のバッチを取り消し、送り終えた分までをチェックポイントに残す
+        pool.shutdown(cancel=True)
+        checkpoint(block=False, raise_errors=False)
+        raise
+    pool.shutdown()
+
+
+def send_campaign(campaign, workers=None, rate=None, batch_size=50, progress=None):
+    """
+    キャンペーンをチェックポイントの続きから送信する。
+    progress(campaign) はチェックポイント保存のたびに呼ばれる。
+    SMTP接続の障害が続いた場合はCampaignConnectionErrorを送出し、状態は送信中のまま残す
+    （同じコマンドを再実行すれば続きから送る）。
+    """
+    workers = workers or settings.EMAIL_CAMPAIGN_CONNECTIONS
+    rate = settings.EMAIL_CAMPAIGN_RATE if rate is None else rate
+
+    if campaign.status != 'sending':
+        campaign.status = 'sending'
+        campaign.started_at = campaign.started_at or timezone.now()
+        campaign.save(update_fields=['status', 'started_at'])
+
+    def save_batches(batches):
+        failures = [failure for _, _, batch_failures in batches for failure in batch_failures]
+        campaign.last_user_id = batches[-1][0]
+        campaign.sent_count += sum(len(sent) for _, sent, _ in batches)
+        campaign.failed_count += len(failures)
+        with transaction.atomic():
+            _record_failures(campaign, failures)
+            campaign.save(update_fields=['last_user_id', 'sent_count', 'failed_count'])
+        if progress:
+            progress(campaign)
+
+    _deliver(campaign, campaign_recipients(campaign.last_user_id), workers, rate, batch_size, save_batches)
+
+    campaign.status = 'completed'
+    campaign.completed_at = timezone.now()
+    campaign.save(update_fields=['status', 'completed_at'])
+    return campaign
+
+
+def retry_failed(campaign, workers=None, rate=None, batch_size=50, progress=None):
+    """
+    EmailCampaignFailureに記録された宛先へ送り直す（チェックポイントは動かさない）。
+    送れた宛先の記録は削除し、failed_countは残った記録の件数にする。
+    """
+    workers = workers or settings.EMAIL_CAMPAIGN_CONNECTIONS
+    rate = settings.EMAIL_CAMPAIGN_RATE if rate is None else rate
+
+    def save_batches(batches):
+        sent = [user_id for _, batch_sent, _ in batches for user_id in batch_sent]
+        with transaction.atomic():
+            EmailCampaignFailure.objects.filter(campaign=campaign, user_id__in=sent).delete()
+            _record_failures(campaign, [failure for _, _, batch_failures in batches for failure in batch_failures])
+            campaign.sent_count += len(sent)
+            campaign.failed_count = EmailCampaignFailure.objects.filter(campaign=campaign).count()
+            campaign.save(update_fields=['sent_count', 'failed_count'])
+        if progress:
+            progress(campaign)
+
+    _deliver(campaign, campaign_recipients(0, failed_in=campaign), workers, rate, batch_size, save_batches)
+    return campaign
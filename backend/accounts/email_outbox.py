@@ -0,0 +1,127 @@
+# accounts/email_outbox.py
+"""
+メール送信のアウトボックス。
+
+リクエスト側は enqueue_email() で EmailOutbox に1行積むだけ（SMTPには接続しない）。
+送信は send_queued_emails コマンドが行う。
+- バッチごとに1本のSMTP接続を開いて使い回す
+- 失敗したメールは指数バックオフで再試行し、上限回数で failed にする
+- 拾ったメールは next_attempt_at をリース期間だけ先送りするので、
+  複数ワーカーで同じメールを二重送信せず、ワーカーが落ちてもリース後に再送される
+- 送信結果は1通ごとに記録するので、バッチの途中でワーカーが落ちても送信済みのメールは再送されない
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(kind, to_email, subject, body, html_body='', user=None):
+    """送信待ちメールを登録（呼び出し側のトランザクションがコミットされたときだけ送られる）"""
+    return EmailOutbox.objects.create(
+        user=user,
+        kind=kind,
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        html_body=html_body,
+    )
+
+
+def retry_delay(attempts):
+    """attempts回目の失敗後の待ち時間（指数バックオフ＋ジッター）"""
+    delay = min(settings.EMAIL_OUTBOX_RETRY_BASE * (2 ** (attempts - 1)), settings.EMAIL_OUTBOX_RETRY_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(batch_size, now=None):
+    """送信対象をロックして取り出し、リース期間だけ他のワーカーから見えなくする"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        emails = list(
+            EmailOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if emails:
+            EmailOutbox.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS)
+            )
+    return emails
+
+
+_RESULT_FIELDS = ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+
+
+def _save_result(email):
+    EmailOutbox.objects.filter(pk=email.pk).update(**{field: getattr(email, field) for field in _RESULT_FIELDS})
+
+
+def _record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+
+
+def deliver_batch(emails, connection=None):
+    """
+    1本のSMTP接続でまとめて送信し、1通ごとに結果をDBに記録する。
+    (送信数, 失敗数) を返す。
+    """
+    if not emails:
+        return 0, 0
+
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # 接続自体に失敗した場合はバッチ全体を再試行に回す
+        logger.warning(f'SMTP接続に失敗しました: {e}')
+        now = timezone.now()
+        for email in emails:
+            _record_failure(email, e, now)
+        EmailOutbox.objects.bulk_update(emails, _RESULT_FIELDS)
+        failed = len(emails)
+    else:
+        try:
+            for email in emails:
+                message = EmailMultiAlternatives(
+                    subject=email.subject,
+                    body=email.body,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=[email.to_email],
+                    connection=connection,
+                )
+                if email.html_body:
+                    message.attach_alternative(email.html_body, 'text/html')
+                try:
+                    message.send()
+                except Exception as e:
+                    logger.warning(f'メール送信に失敗しました: {email.to_email}: {e}')
+                    _record_failure(email, e, timezone.now())
+                    failed += 1
+                else:
+                    email.attempts += 1
+                    email.status = 'sent'
+                    email.sent_at = timezone.now()
+                    email.last_error = ''
+                    sent += 1
+                # 送信のたびに記録する（まとめて書くと、途中で落ちたときに送信済みの分がリース後に再送される）
+                _save_result(email)
+        finally:
+            connection.close()
+
+    return sent, failed
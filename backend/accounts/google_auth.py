@@ -0,0 +1,151 @@
+# accounts/google_auth.py
+"""
+GoogleのIDトークンをローカルで検証する。
+
+署名検証用の公開鍵（証明書）はプロセス内にキャッシュし、
+レスポンスのCache-Control（max-age - Age）またはExpiresの期限まで使い回す。
+期限切れ時の再取得は1スレッドだけが行い、同時に来たログインはその結果を待つ。
+google-auth・requestsは起動時間短縮のため初回の検証時に読み込む。
+"""
+import email.utils
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleTokenError(Exception):
+    """IDトークンが無効"""
+
+
+class GoogleCertsUnavailable(GoogleTokenError):
+    """検証に使える証明書を取得できない"""
+
+
+def cache_lifetime(headers, default):
+    """HTTPレスポンスヘッダから証明書をキャッシュしてよい秒数を求める"""
+    cache_control = headers.get('Cache-Control', '')
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    if match:
+        age = headers.get('Age', '0')
+        return max(0, int(match.group(1)) - (int(age) if age.isdigit() else 0))
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            expires_at = email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return default
+        return max(0, int(expires_at - time.time()))
+    return default
+
+
+class GoogleCertCache:
+    """Googleの署名用証明書（kid -> PEM）のプロセス内キャッシュ"""
+
+    def __init__(self, url=None, session=None):
+        self._url = url
+        self._session = session
+        self._certs = {}
+        self._expires_at = 0.0
+        self._last_fetch = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self._url or settings.GOOGLE_OAUTH2_CERTS_URL
+
+    def _fresh(self):
+        return self._certs and time.monotonic() < self._expires_at
+
+    def get_certs(self, kid=None):
+        """
+        有効な証明書を返す。kidが未知の場合（鍵のローテーション直後）は再取得を試みるが、
+        GOOGLE_CERTS_MIN_REFRESH秒に1回までに制限する。
+        """
+        certs = self._certs
+        if self._fresh() and (kid is None or kid in certs):
+            return certs
+
+        with self._lock:
+            # 待っている間に他のスレッドが取得済みならそれを使う
+            if self._fresh() and (kid is None or kid in self._certs):
+                return self._certs
+            if self._certs and time.monotonic() - self._last_fetch < settings.GOOGLE_CERTS_MIN_REFRESH:
+                return self._certs
+            self._refresh()
+            return self._certs
+
+    def _refresh(self):
+        # ロック内で呼ぶこと
+        import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+        self._last_fetch = time.monotonic()
+        try:
+            response = self._session.get(self.url, timeout=settings.GOOGLE_CERTS_TIMEOUT)
+            response.raise_for_status()
+            certs = response.json()
+        except (requests.RequestException, ValueError) as e:
+            if not self._certs:
+                raise GoogleCertsUnavailable(f'Googleの証明書を取得できませんでした: {e}')
+            # 取得に失敗しても手元の証明書でしばらく検証を続ける
+            logger.warning(f'Googleの証明書の更新に失敗しました（キャッシュを継続使用）: {e}')
+            self._expires_at = time.monotonic() + settings.GOOGLE_CERTS_MIN_REFRESH
+            return
+
+        lifetime = cache_lifetime(response.headers, settings.GOOGLE_CERTS_DEFAULT_TTL)
+        self._certs = certs
+        self._expires_at = time.monotonic() + lifetime
+        logger.info(f'Googleの証明書を更新しました（{len(certs)}件、{lifetime}秒有効）')
+
+    def clear(self):
+        with self._lock:
+            self._certs = {}
+            self._expires_at = 0.0
+            self._last_fetch = 0.0
+
+
+google_cert_cache = GoogleCertCache()
+
+
+def verify_google_id_token(token, cert_cache=None):
+    """
+    IDトークンの署名・有効期限・発行者・対象クライアントを検証し、クレームを返す。
+    無効な場合はGoogleTokenErrorを送出する。
+    """
+    from google.auth import exceptions as google_exceptions
+    from google.auth import jwt
+
+    cert_cache = cert_cache or google_cert_cache
+    client_ids = settings.GOOGLE_CLIENT_IDS
+    if not client_ids:
+        raise ImproperlyConfigured('GOOGLE_CLIENT_IDSが設定されていません。')
+
+    try:
+        kid = jwt.decode_header(token).get('kid')
+        claims = jwt.decode(
+            token,
+            certs=cert_cache.get_certs(kid),
+            audience=list(client_ids),
+            clock_skew_in_seconds=settings.GOOGLE_TOKEN_CLOCK_SKEW,
+        )
+    except (ValueError, google_exceptions.GoogleAuthError) as e:
+        raise GoogleTokenError(str(e))
+
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise GoogleTokenError(f'発行者が不正です: {claims.get("iss")}')
+    if not claims.get('email') or not claims.get('email_verified'):
+        raise GoogleTokenError('メールアドレスが確認されていないGoogleアカウントです。')
+    return claims
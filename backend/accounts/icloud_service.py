@@ -1,32 +1,168 @@
 # accounts/icloud_service.py
-from pyicloud_ipd import PyiCloudService
+# pyicloud_ipd・cryptographyは起動時間短縮のため初回利用時に読み込む
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
-from cryptography.fernet import Fernet
+from django.utils.module_loading import import_string
+from .location_buffer import LocationFix, location_buffer
+from datetime import datetime, timezone as dt_timezone
 import base64
+import hashlib
 import json
 import logging
+import os
+import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+
+class iCloudError(Exception):
+    """iCloudから位置情報を取得できない（messageは利用者向けの説明）"""
+
+    def __init__(self, message, requires_2fa=False):
+        super().__init__(message)
+        self.message = message
+        self.requires_2fa = requires_2fa
+
+
+class _PooledSession:
+    def __init__(self, api, secret_digest):
+        self.api = api
+        self.secret_digest = secret_digest
+        self.devices_by_name = None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class iCloudSessionPool:
+    """
+    Apple IDごとにログイン済みのiCloudセッションを保持するプール。
+    - Cookieはcookie_directory配下にApple IDごとに保存し、再ログイン時に使い回す
+      （未設定ならpyicloudの既定の保存先）
+    - idle_timeout秒使われなかったセッションは破棄する
+    - client_factoryを差し替えるとiCloudに接続せずに動かせる（テスト用の偽クライアントなど）
+    """
+
+    def __init__(self, client_factory=None, cookie_directory=None, idle_timeout=None):
+        self._client_factory = client_factory
+        self._cookie_directory = cookie_directory
+        self._idle_timeout = idle_timeout
+        self._sessions = {}
+        self._login_locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client_factory(self):
+        if self._client_factory is None:
+            self._client_factory = import_string(settings.ICLOUD_CLIENT_FACTORY)
+        return self._client_factory
+
+    @property
+    def idle_timeout(self):
+        if self._idle_timeout is None:
+            return settings.ICLOUD_SESSION_IDLE_TIMEOUT
+        return self._idle_timeout
+
+    def _cookie_directory_for(self, apple_id):
+        base = self._cookie_directory or settings.ICLOUD_COOKIE_DIR
+        if not base:
+            return None
+        path = os.path.join(str(base), re.sub(r'[^\w.@-]', '_', apple_id))
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+
+    def get(self, apple_id, password):
+        """ログイン済みのセッションを返す（なければログインする）"""
+        self.evict_idle()
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        with self._lock:
+            session = self._sessions.get(apple_id)
+            if session is not None and session.secret_digest == digest:
+                session.last_used = time.monotonic()
+                return session
+            login_lock = self._login_locks.setdefault(apple_id, threading.Lock())
+
+        # 同じApple IDのログインは1回だけ行う（他のApple IDのログインは妨げない）
+        with login_lock:
+            with self._lock:
+                session = self._sessions.get(apple_id)
+                if session is not None and session.secret_digest == digest:
+                    session.last_used = time.monotonic()
+                    return session
+            api = self.client_factory(apple_id, password, cookie_directory=self._cookie_directory_for(apple_id))
+            session = _PooledSession(api, digest)
+            with self._lock:
+                self._sessions[apple_id] = session
+            return session
+
+    def invalidate(self, apple_id):
+        with self._lock:
+            self._sessions.pop(apple_id, None)
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for apple_id in [key for key, session in self._sessions.items() if session.last_used < deadline]:
+                del self._sessions[apple_id]
+                self._login_locks.pop(apple_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    @staticmethod
+    def find_device(session, name):
+        """名前でデバイスを引く（一覧は辞書にしてセッションに保持し、見つからないときだけ取り直す）"""
+        with session.lock:
+            if session.devices_by_name is None or name not in session.devices_by_name:
+                session.devices_by_name = {device.get('name'): device for device in session.api.devices}
+            return session.devices_by_name.get(name)
+
+
+def _location_timestamp(location):
+    # timeStampはミリ秒のUNIX時刻
+    value = location.get('timeStamp')
+    if isinstance(value, (int, float)) and value > 0:
+        return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+    return timezone.now()
+
 class iCloudLocationService:
-    def __init__(self):
-        self.cipher_suite = None
-        self._init_encryption()
+    def __init__(self, session_pool=None):
+        self._cipher_suite = None
+        self._cipher_lock = threading.Lock()
+        # 空のプールは__len__が0で偽になるので、Noneかどうかで判定する
+        self.session_pool = session_pool if session_pool is not None else iCloudSessionPool()
+    
+    @property
+    def cipher_suite(self):
+        if self._cipher_suite is None:
+            with self._cipher_lock:
+                if self._cipher_suite is None:
+                    self._init_encryption()
+        return self._cipher_suite
     
     def _init_encryption(self):
         """暗号化キーを初期化"""
-        # 本番環境では環境変数から取得
-        key = getattr(settings, 'ICLOUD_ENCRYPTION_KEY', None)
+        from cryptography.fernet import Fernet
+        
+        # 保存済みのパスワードを別のプロセス（位置取得コマンドなど）でも復号できるよう、
+        # キーは必ず設定から取る。プロセスごとに生成すると他のプロセスでは復号できない
+        key = settings.ICLOUD_ENCRYPTION_KEY
         if not key:
-            # 開発環境用のキー生成（本番では環境変数を使用）
-            key = Fernet.generate_key()
-            print(f"開発用暗号化キー: {key.decode()}")
+            raise ImproperlyConfigured(
+                'ICLOUD_ENCRYPTION_KEYが設定されていません。'
+                'Fernet.generate_key()で生成したキーを全プロセス共通で設定してください。'
+            )
         
         if isinstance(key, str):
             key = key.encode()
         
-        self.cipher_suite = Fernet(key)
+        try:
+            self._cipher_suite = Fernet(key)
+        except ValueError as e:
+            raise ImproperlyConfigured(f'ICLOUD_ENCRYPTION_KEYが不正です: {e}')
     
     def encrypt_password(self, password):
         """パスワードを暗号化"""
@@ -50,9 +186,12 @@ class iCloudLocationService:
             return ""
     
     def test_icloud_connection(self, apple_id, password):
-        """iCloud接続をテスト"""
+        """
+        iCloud接続をテスト。
+        ログインはセッションプール経由（Cookieを保存し、2FAが必要ならverify_2fa_codeで同じセッションを使う）
+        """
         try:
-            api = PyiCloudService(apple_id, password)
+            api = self.session_pool.get(apple_id, password).api
             
             # 2FAが必要かチェック
             if api.requires_2fa:
@@ -82,6 +221,7 @@ class iCloudLocationService:
             }
             
         except Exception as e:
+            self.session_pool.invalidate(apple_id)
             error_str = str(e)
             logger.error(f"iCloud接続テストエラー: {e}")
             
@@ -106,9 +246,9 @@ class iCloudLocationService:
                 }
     
     def verify_2fa_code(self, apple_id, password, code):
-        """2FA認証コードを検証"""
+        """2FA認証コードを検証（test_icloud_connectionでコードを要求したプール内のセッションで行う）"""
         try:
-            api = PyiCloudService(apple_id, password)
+            api = self.session_pool.get(apple_id, password).api
             
             if api.requires_2fa:
                 # 2FAコードを送信
@@ -131,92 +271,92 @@ class iCloudLocationService:
                 }
                 
         except Exception as e:
+            self.session_pool.invalidate(apple_id)
             logger.error(f"2FA認証エラー: {e}")
             return {
                 'success': False,
                 'message': f'認証エラー: {str(e)}'
             }
     
-    def get_device_location(self, user):
-        """ユーザーのデバイス位置情報を取得"""
+    def fetch_device_location(self, user):
+        """
+        ユーザーの追跡デバイスの位置をLocationFixで返す（DBには書かない）。
+        取得できない場合はiCloudErrorを送出する。
+        """
         if not user.icloud_email or not user.icloud_password_encrypted:
-            return {
-                'success': False,
-                'message': 'iCloud設定が未完了です'
-            }
+            raise iCloudError('iCloud設定が未完了です')
+        
+        # パスワードを復号化
+        password = self.decrypt_password(user.icloud_password_encrypted)
+        if not password:
+            raise iCloudError('パスワードの復号化に失敗しました')
         
         try:
-            # パスワードを復号化
-            password = self.decrypt_password(user.icloud_password_encrypted)
-            if not password:
-                return {
-                    'success': False,
-                    'message': 'パスワードの復号化に失敗しました'
-                }
-            
-            # iCloudに接続
-            api = pyicloud.PyiCloudService(user.icloud_email, password)
-            
-            if api.requires_2fa:
-                return {
-                    'success': False,
-                    'requires_2fa': True,
-                    'message': '2段階認証が必要です'
-                }
+            # ログイン済みのセッションを使い回す
+            session = self.session_pool.get(user.icloud_email, password)
+            if session.api.requires_2fa:
+                self.session_pool.invalidate(user.icloud_email)
+                raise iCloudError('2段階認証が必要です', requires_2fa=True)
             
             # 指定されたデバイスを検索
-            target_device = None
-            for device in api.devices:
-                if device.get('name') == user.icloud_device_name:
-                    target_device = device
-                    break
-            
+            target_device = self.session_pool.find_device(session, user.icloud_device_name)
             if not target_device:
-                return {
-                    'success': False,
-                    'message': f'デバイス "{user.icloud_device_name}" が見つかりません'
-                }
+                raise iCloudError(f'デバイス "{user.icloud_device_name}" が見つかりません')
             
             # 位置情報を取得
             location = target_device.location()
-            
-            if location:
-                # ユーザーの位置情報を更新
-                user.last_known_latitude = location['latitude']
-                user.last_known_longitude = location['longitude']
-                user.last_location_update = timezone.now()
-                user.save(update_fields=['last_known_latitude', 'last_known_longitude', 'last_location_update'])
-                
-                return {
-                    'success': True,
-                    'location': {
-                        'latitude': location['latitude'],
-                        'longitude': location['longitude'],
-                        'accuracy': location.get('horizontalAccuracy', 0),
-                        'timestamp': location.get('timeStamp', timezone.now().isoformat())
-                    },
-                    'message': '位置情報取得成功'
-                }
-            else:
-                return {
-                    'success': False,
-                    'message': 'デバイスの位置情報が取得できませんでした'
-                }
-                
+        except iCloudError:
+            raise
         except Exception as e:
-            logger.error(f"位置情報取得エラー: {e}")
-            return {
+            # セッション切れなどの可能性があるので次回はログインし直す
+            self.session_pool.invalidate(user.icloud_email)
+            raise iCloudError(f'位置情報取得エラー: {str(e)}')
+        
+        if not location:
+            raise iCloudError('デバイスの位置情報が取得できませんでした')
+        
+        return LocationFix(
+            float(location['latitude']),
+            float(location['longitude']),
+            _location_timestamp(location),
+            accuracy=location.get('horizontalAccuracy'),
+        )
+    
+    def get_device_location(self, user):
+        """ユーザーのデバイス位置情報を取得"""
+        try:
+            fix = self.fetch_device_location(user)
+        except iCloudError as e:
+            logger.error(f"位置情報取得エラー: {e.message}")
+            result = {
                 'success': False,
-                'message': f'位置情報取得エラー: {str(e)}'
+                'message': e.message
             }
+            if e.requires_2fa:
+                result['requires_2fa'] = True
+            return result
+        
+        # ユーザーの位置情報を更新（アプリからの更新と同じバッファ経由）
+        location_buffer.offer(user.pk, fix)
+        
+        return {
+            'success': True,
+            'location': {
+                'latitude': fix.latitude,
+                'longitude': fix.longitude,
+                'accuracy': fix.accuracy or 0,
+                'timestamp': fix.timestamp.isoformat()
+            },
+            'message': '位置情報取得成功'
+        }
     
     def get_available_devices(self, apple_id, password):
         """利用可能なデバイスリストを取得"""
         try:
-            api = PyiCloudService(apple_id, password)
+            session = self.session_pool.get(apple_id, password)
             
             devices = []
-            for device in api.devices:
+            for device in session.api.devices:
                 device_info = {
                     'name': device.get('name', 'Unknown'),
                     'model': device.get('deviceDisplayName', 'Unknown'),
@@ -233,11 +373,22 @@ class iCloudLocationService:
             }
             
         except Exception as e:
+            self.session_pool.invalidate(apple_id)
             logger.error(f"デバイスリスト取得エラー: {e}")
             return {
                 'success': False,
                 'message': f'デバイスリスト取得エラー: {str(e)}'
             }
 
-# グローバルインスタンス
-icloud_service = iCloudLocationService()
\ No newline at end of file
+_icloud_service = None
+_icloud_service_lock = threading.Lock()
+
+
+def get_icloud_service():
+    """プロセス共通のインスタンス（初回呼び出し時に作成）"""
+    global _icloud_service
+    if _icloud_service is None:
+        with _icloud_service_lock:
+            if _icloud_service is None:
+                _icloud_service = iCloudLocationService()
+    return _icloud_service
\ No newline at end of file
@@ -0,0 +1,277 @@
+# accounts/location_buffer.py
+import atexit
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from math import asin, cos, radians, sin, sqrt
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+class LocationFix(NamedTuple):
+    latitude: float
+    longitude: float
+    timestamp: object  # datetime（タイムゾーン付き）
+    accuracy: Optional[float] = None  # メートル単位
+    speed: Optional[float] = None  # m/s
+
+
+def distance_meters(a, b):
+    """2つのLocationFix間の大円距離（メートル）"""
+    lat1, lat2 = radians(a.latitude), radians(b.latitude)
+    dlat = lat2 - lat1
+    dlng = radians(b.longitude - a.longitude)
+    h = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * asin(min(1.0, sqrt(h)))
+
+
+def is_significant_move(previous, fix):
+    """
+    前回採用した位置と比べて、DBに書く価値のある位置かを判定する。
+    - LOCATION_MIN_INTERVAL秒未満の連続送信は捨てる
+    - 前回位置の精度円内、またはLOCATION_MIN_DISTANCE未満の移動は捨てる
+      （ただしLOCATION_HEARTBEAT_INTERVAL秒経過していれば鮮度維持のため採用）
+    """
+    if previous is None:
+        return True
+
+    elapsed = (fix.timestamp - previous.timestamp).total_seconds()
+    if elapsed < settings.LOCATION_MIN_INTERVAL:
+        return False
+    if elapsed >= settings.LOCATION_HEARTBEAT_INTERVAL:
+        return True
+
+    threshold = max(previous.accuracy or 0.0, settings.LOCATION_MIN_DISTANCE)
+    return distance_meters(previous, fix) > threshold
+
+
+class LocationWriteBuffer:
+    """
+    位置情報のライトビハインドバッファ。
+    ユーザーIDごとに最新の位置だけを保持し、一定間隔でまとめてDBへ書き込む。
+    DBの位置情報はflush_interval秒（＋書き込み時間）以上は古くならない。
+
+    バッファはプロセスごとに持つ（共有しない）。
+    - get()で未書き込みの位置が見えるのは、その位置を受け取ったプロセスだけ。
+      別のワーカーからはDBの値が見え、最大flush_interval秒古い
+    - しきい値判定の比較対象（前回採用した位置）もプロセスごと。同じユーザーの送信が
+      複数のワーカーに振り分けられると、それぞれが自分の受けた位置と比較する
+    """
+
+    def __init__(self, flush_interval=None, max_pending=None, max_tracked=100000):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._max_tracked = max_tracked
+        self._pending = {}
+        self._last_accepted = OrderedDict()  # user_id -> 最後に採用したLocationFix
+        self._counts = defaultdict(lambda: [0, 0])  # user_id -> [採用数, 抑制数]
+        self._history = defaultdict(list)  # user_id -> 採用したLocationFixの列（履歴用）
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is None:
+            return settings.LOCATION_BUFFER_FLUSH_INTERVAL
+        return self._flush_interval
+
+    @property
+    def max_pending(self):
+        if self._max_pending is None:
+            return settings.LOCATION_BUFFER_MAX_PENDING
+        return self._max_pending
+
+    def offer(self, user_id, fix):
+        """
+        しきい値判定を行い、意味のある移動だけをバッファに積む。
+        採用した場合はTrue、抑制した場合はFalseを返す。
+        """
+        previous = self._previous_fix(user_id)
+        accepted = is_significant_move(previous, fix)
+
+        with self._lock:
+            self._counts[user_id][0 if accepted else 1] += 1
+            if accepted:
+                self._remember(user_id, fix)
+                self._history[user_id].append(fix)
+
+        if accepted:
+            self.put(user_id, fix)
+        elif self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return accepted
+
+    def put(self, user_id, fix):
+        """位置を登録（同じユーザーの未書き込みの位置は上書き）"""
+        with self._lock:
+            current = self._pending.get(user_id)
+            if current is None or current.timestamp <= fix.timestamp:
+                self._pending[user_id] = fix
+            pending_count = len(self._pending)
+
+        if self.flush_interval <= 0:
+            # 間隔0以下は即時書き込み（テスト・デバッグ用）
+            self.flush()
+            return
+
+        self._ensure_thread()
+        if pending_count >= self.max_pending:
+            self._wakeup.set()
+
+    def get(self, user_id):
+        """未書き込みの最新位置を返す（なければNone）"""
+        with self._lock:
+            return self._pending.get(user_id)
+
+    def _previous_fix(self, user_id):
+        with self._lock:
+            previous = self._pending.get(user_id) or self._last_accepted.get(user_id)
+        if previous is not None:
+            return previous
+
+        # このプロセスで初めて見るユーザーはDBの位置と比較する
+        from .models import UserLocation
+        row = (
+            UserLocation.objects
+            .filter(user_id=user_id)
+            .values_list('latitude', 'longitude', 'updated_at', 'accuracy', 'speed')
+            .first()
+        )
+        if row is None:
+            return None
+        previous = LocationFix(*row)
+        with self._lock:
+            self._remember(user_id, previous)
+        return previous
+
+    def _remember(self, user_id, fix):
+        # ロック内で呼ぶこと
+        self._last_accepted[user_id] = fix
+        self._last_accepted.move_to_end(user_id)
+        while len(self._last_accepted) > self._max_tracked:
+            self._last_accepted.popitem(last=False)
+
+    def flush(self):
+        """溜まっている位置・採用/抑制カウンタ・位置履歴をまとめてDBへ書き込む"""
+        from .location_history import ingest
+        from .models import UserLocation
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                counts, self._counts = self._counts, defaultdict(lambda: [0, 0])
+                history, self._history = self._history, defaultdict(list)
+            if not pending and not counts and not history:
+                return 0
+
+            locations = [
+                UserLocation(
+                    user_id=user_id,
+                    latitude=fix.latitude,
+                    longitude=fix.longitude,
+                    accuracy=fix.accuracy,
+                    speed=fix.speed,
+                    updated_at=fix.timestamp,
+                )
+                for user_id, fix in pending.items()
+            ]
+            try:
+                UserLocation.objects.bulk_create(
+                    locations,
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=['user'],
+                    update_fields=['latitude', 'longitude', 'accuracy', 'speed', 'updated_at'],
+                )
+            except Exception:
+                logger.exception('位置情報の一括書き込みに失敗しました（次回再試行）')
+                self._requeue(pending, counts, history)
+                return 0
+
+            # 同じ増分のユーザーをまとめて1クエリで加算
+            by_delta = defaultdict(list)
+            for user_id, (accepted, suppressed) in counts.items():
+                by_delta[(accepted, suppressed)].append(user_id)
+            for (accepted, suppressed), user_ids in by_delta.items():
+                try:
+                    UserLocation.objects.filter(user_id__in=user_ids).update(
+                        accepted_fixes=F('accepted_fixes') + accepted,
+                        suppressed_fixes=F('suppressed_fixes') + suppressed,
+                    )
+                except Exception:
+                    logger.exception('位置情報カウンタの書き込みに失敗しました（次回再試行）')
+                    # 書き込めなかった増分だけ戻す（加算済みのグループは戻さない）
+                    self._requeue({}, {user_id: counts[user_id] for user_id in user_ids}, {})
+
+            try:
+                ingest(history)
+            except Exception:
+                logger.exception('位置履歴の書き込みに失敗しました（次回再試行）')
+                self._requeue({}, {}, history)
+            return len(locations)
+
+    def _requeue(self, pending, counts, history):
+        with self._lock:
+            for user_id, fix in pending.items():
+                current = self._pending.get(user_id)
+                if current is None or current.timestamp < fix.timestamp:
+                    self._pending[user_id] = fix
+            for user_id, (accepted, suppressed) in counts.items():
+                self._counts[user_id][0] += accepted
+                self._counts[user_id][1] += suppressed
+            for user_id, fixes in history.items():
+                self._history[user_id][:0] = fixes
+
+    def shutdown(self, timeout=5.0):
+        """バックグラウンドスレッドを止め、残りを書き込む（プロセス終了時）"""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        return self.flush()
+
+    def _ensure_thread(self):
+        if self._stopped.is_set():
+            # 終了処理後に届いた位置はその場で書き込む
+            self.flush()
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='location-write-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                # 残りはshutdown()を呼んだスレッドで書き込む
+                break
+            try:
+                self.flush()
+            finally:
+                # このスレッド用のDB接続を閉じる
+                connections.close_all()
+
+
+# プロセス共通のバッファ
+location_buffer = LocationWriteBuffer()
+
+# プロセス終了時に残りを書き込む
+atexit.register(location_buffer.shutdown)
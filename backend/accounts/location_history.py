@@ -0,0 +1,238 @@
+# accounts/location_history.py
+"""
+位置履歴の保存・読み出し。
+
+1日分の軌跡を1行（LocationHistoryChunk）にまとめ、以下の形式で保存する。
+- 座標は1e-5度（約1m）、時刻は秒に量子化
+- 直前の点との差分をzigzag + 可変長整数で符号化
+- 取り込み時にDouglas–Peucker法（時刻同期距離）で間引く（末尾の一部だけを再計算）
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from math import cos, hypot, radians
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LocationHistoryChunk
+
+COORD_SCALE = 100000  # 1e-5度単位
+FORMAT_VERSION = 1
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LNG = 111320.0
+
+# 取り込み時に再間引きする末尾の点数
+RESIMPLIFY_TAIL = 64
+
+
+class HistoryPoint(NamedTuple):
+    timestamp: int  # UNIX秒
+    lat: int  # 1e-5度単位
+    lng: int  # 1e-5度単位
+
+    @classmethod
+    def from_fix(cls, fix):
+        return cls(
+            int(fix.timestamp.timestamp()),
+            round(fix.latitude * COORD_SCALE),
+            round(fix.longitude * COORD_SCALE),
+        )
+
+    @property
+    def time(self):
+        return datetime.fromtimestamp(self.timestamp, tz=dt_timezone.utc)
+
+    @property
+    def latitude(self):
+        return self.lat / COORD_SCALE
+
+    @property
+    def longitude(self):
+        return self.lng / COORD_SCALE
+
+
+# --- 符号化 ---
+
+def _write_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_points(points):
+    """HistoryPointの列をバイト列に符号化"""
+    out = bytearray([FORMAT_VERSION])
+    prev = HistoryPoint(0, 0, 0)
+    for point in points:
+        _write_varint(out, point.timestamp - prev.timestamp)
+        _write_varint(out, point.lat - prev.lat)
+        _write_varint(out, point.lng - prev.lng)
+        prev = point
+    return bytes(out)
+
+
+def decode_points(data):
+    """バイト列からHistoryPointを1点ずつ復号するジェネレータ"""
+    data = bytes(data)
+    if not data:
+        return
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'未対応の位置履歴フォーマットです: {data[0]}')
+
+    values = [0, 0, 0]
+    field = 0
+    shift = 0
+    acc = 0
+    for byte in memoryview(data)[1:]:
+        acc |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values[field] += (acc >> 1) ^ -(acc & 1)
+        acc = shift = 0
+        field += 1
+        if field == 3:
+            field = 0
+            yield HistoryPoint(*values)
+
+
+# --- 間引き ---
+
+def _synchronized_meters(point, start, end, lng_scale):
+    """
+    点と、線分start-end上で同じ時刻にいるはずの位置との距離（メートル、局所平面近似）。
+    時刻も考慮するため、同じ場所での長い滞在（往復や停止）が間引きで消えない。
+    """
+    span = end.timestamp - start.timestamp
+    ratio = (point.timestamp - start.timestamp) / span if span > 0 else 0.0
+    expected_lat = start.lat + (end.lat - start.lat) * ratio
+    expected_lng = start.lng + (end.lng - start.lng) * ratio
+    dx = (point.lng - expected_lng) * lng_scale
+    dy = (point.lat - expected_lat) * METERS_PER_DEGREE_LAT / COORD_SCALE
+    return hypot(dx, dy)
+
+
+def simplify(points, tolerance):
+    """Douglas–Peucker法（時刻同期距離）で軌跡を間引く（両端は必ず残す）"""
+    if len(points) <= 2:
+        return list(points)
+
+    lng_scale = METERS_PER_DEGREE_LNG * cos(radians(points[0].lat / COORD_SCALE)) / COORD_SCALE
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0.0
+        index = None
+        for i in range(first + 1, last):
+            distance = _synchronized_meters(points[i], points[first], points[last], lng_scale)
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+# --- 取り込み・読み出し ---
+
+def _local_date(timestamp):
+    return timezone.localdate(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+
+
+def ingest(fixes_by_user, tolerance=None):
+    """
+    {user_id: [LocationFix, ...]} を日ごとのチャンクに追記する。
+    既存チャンクの末尾RESIMPLIFY_TAIL点と新しい点をまとめて間引き直す。
+    """
+    if tolerance is None:
+        tolerance = settings.LOCATION_HISTORY_TOLERANCE
+
+    new_points = defaultdict(list)
+    for user_id, fixes in fixes_by_user.items():
+        for fix in fixes:
+            point = HistoryPoint.from_fix(fix)
+            new_points[(user_id, _local_date(point.timestamp))].append(point)
+    if not new_points:
+        return 0
+
+    with transaction.atomic():
+        existing = {
+            (chunk.user_id, chunk.date): chunk
+            for chunk in LocationHistoryChunk.objects.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in new_points},
+                date__in={day for _, day in new_points},
+            )
+        }
+
+        to_create = []
+        to_update = []
+        for (user_id, day), points in new_points.items():
+            chunk = existing.get((user_id, day))
+            old_points = list(decode_points(chunk.data)) if chunk else []
+            points.sort()
+            if old_points:
+                # 既存の末尾より古い点は捨てる（順序を保つ）
+                points = [point for point in points if point.timestamp > old_points[-1].timestamp]
+                if not points:
+                    continue
+
+            head, tail = old_points[:-RESIMPLIFY_TAIL], old_points[-RESIMPLIFY_TAIL:]
+            merged = head + simplify(tail + points, tolerance)
+
+            if chunk is None:
+                chunk = LocationHistoryChunk(user_id=user_id, date=day)
+                to_create.append(chunk)
+            else:
+                to_update.append(chunk)
+            chunk.data = encode_points(merged)
+            chunk.point_count = len(merged)
+            chunk.start_time = merged[0].time
+            chunk.end_time = merged[-1].time
+
+        LocationHistoryChunk.objects.bulk_create(to_create)
+        LocationHistoryChunk.objects.bulk_update(to_update, ['data', 'point_count', 'start_time', 'end_time'])
+
+    return len(to_create) + len(to_update)
+
+
+def iter_history(user_id, start, end):
+    """
+    期間内の位置履歴を時刻順に返すジェネレータ。
+    チャンクは1行ずつ取得し、必要になった時点で復号する。
+    """
+    start_ts = int(start.timestamp())
+    end_ts = int(end.timestamp())
+    chunks = (
+        LocationHistoryChunk.objects
+        .filter(
+            user_id=user_id,
+            date__gte=timezone.localdate(start) - timedelta(days=1),
+            date__lte=timezone.localdate(end),
+            end_time__gte=start,
+            start_time__lte=end,
+        )
+        .order_by('date')
+        .values_list('data', flat=True)
+        .iterator(chunk_size=1)
+    )
+    for data in chunks:
+        for point in decode_points(data):
+            if point.timestamp < start_ts:
+                continue
+            if point.timestamp > end_ts:
+                return
+            yield point
+
+
+def day_bounds(day):
+    """ローカル日付の開始・終了日時"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1) - timedelta(microseconds=1)
@@ -0,0 +1,79 @@
+# accounts/management/commands/bench_login.py
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        '起動中のサーバーに対してログインを並列実行し、logins/secとレイテンシを計測する。'
+        '同期版: gunicorn location_reminder.wsgi -w 4 で起動して --path /api/auth/login/ 、'
+        '非同期版: uvicorn location_reminder.asgi:application --workers 4 で起動して '
+        '--path /api/auth/async/login/ を指定し、結果を比較する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', default='/api/auth/login/',
+                            help='ログインAPIのパス（非同期版は /api/auth/async/login/）')
+        parser.add_argument('--requests', type=int, default=200, help='ログインの総回数')
+        parser.add_argument('--concurrency', type=int, default=20, help='同時接続数')
+        parser.add_argument('--email', default='bench-login@example.com')
+        parser.add_argument('--password', default='bench-login-password')
+        parser.add_argument('--create-user', action='store_true',
+                            help='計測用のメール認証済みユーザーを作成（既にあればパスワードを再設定）')
+
+    def handle(self, *args, **options):
+        email = options['email']
+        password = options['password']
+        if options['create_user']:
+            user, _ = User.objects.get_or_create(email=email, defaults={'username': email.split('@')[0]})
+            user.set_password(password)
+            user.is_email_verified = True
+            user.is_active = True
+            user.save()
+
+        url = options['base_url'].rstrip('/') + options['path']
+        total = options['requests']
+        concurrency = options['concurrency']
+        local = threading.local()
+
+        def login(_):
+            # スレッドごとにKeep-Aliveのセッションを使い回す（接続確立のコストを計測に含めない）
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                response = session.post(url, json={'email': email, 'password': password}, timeout=60)
+                status_code = response.status_code
+            except requests.RequestException:
+                status_code = None
+            return status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(login, range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for status_code, latency in results if status_code == 200)
+        failures = {}
+        for status_code, _ in results:
+            if status_code != 200:
+                failures[status_code] = failures.get(status_code, 0) + 1
+        if not latencies:
+            raise CommandError(f'成功したログインがありません: {failures}')
+
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(f'URL: {url}（同時接続数 {concurrency}）')
+        self.stdout.write(f'成功 {len(latencies)}/{total}、失敗 {failures or 0}')
+        self.stdout.write(
+            f'レイテンシ: 中央値 {statistics.median(latencies) * 1000:.0f}ms、p95 {p95 * 1000:.0f}ms'
+        )
+        self.stdout.write(self.style.SUCCESS(f'{len(latencies) / elapsed:.1f} logins/sec'))
@@ -0,0 +1,96 @@
+# accounts/management/commands/bench_startup.py
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 新しいプロセスで実行する計測スクリプト（ワーカー起動と同じく setup → URLconf読み込み）
+PROBE = '''
+import importlib, json, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+urls_done = time.perf_counter()
+print(json.dumps({"setup": setup_done - started, "urls": urls_done - setup_done}))
+'''
+
+
+def _parse_importtime(stderr):
+    """-X importtime の出力をトップレベルのパッケージごとの自己時間（マイクロ秒）に集計"""
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if len(parts) != 3:
+            continue
+        self_us, _, name = parts
+        if not self_us.isdigit():
+            continue
+        totals[name.split('.')[0]] += int(self_us)
+    return totals
+
+
+class Command(BaseCommand):
+    help = '新しいプロセスでの django.setup() とURLconf読み込みの時間、およびパッケージごとのimport時間を計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='計測回数（中央値を表示）')
+        parser.add_argument('--top', type=int, default=10, help='表示するサードパーティパッケージの数')
+        parser.add_argument('--budget-ms', type=float, default=None,
+                            help='起動時間（setup＋URLconf）の上限。超えたらエラー終了する')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'location_reminder.settings'))
+        runs = []
+        for _ in range(max(1, options['repeat'])):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', PROBE],
+                cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                raise CommandError(f'計測プロセスが失敗しました:\n{result.stderr[-2000:]}')
+            timings = json.loads(result.stdout.strip().splitlines()[-1])
+            runs.append((timings, _parse_importtime(result.stderr)))
+
+        setup_ms = statistics.median(timings['setup'] for timings, _ in runs) * 1000
+        urls_ms = statistics.median(timings['urls'] for timings, _ in runs) * 1000
+        total_ms = setup_ms + urls_ms
+        self.stdout.write(f'django.setup(): {setup_ms:.0f}ms')
+        self.stdout.write(f'URLconf読み込み: {urls_ms:.0f}ms')
+        self.stdout.write(f'合計: {total_ms:.0f}ms（{len(runs)}回の中央値）')
+
+        packages = defaultdict(list)
+        for _, totals in runs:
+            for name, micros in totals.items():
+                packages[name].append(micros)
+        medians = {name: statistics.median(values) / 1000 for name, values in packages.items()}
+
+        local_apps = [app.split('.')[0] for app in settings.INSTALLED_APPS
+                      if os.path.isdir(os.path.join(str(settings.BASE_DIR), app.split('.')[0]))]
+        local_apps.append(settings.ROOT_URLCONF.split('.')[0])
+        self.stdout.write('\nアプリごとのimport時間:')
+        for app in local_apps:
+            self.stdout.write(f'  {app:<24} {medians.get(app, 0.0):8.1f}ms')
+
+        self.stdout.write(f'\nimport時間の大きいパッケージ（上位{options["top"]}件）:')
+        others = sorted(
+            ((name, ms) for name, ms in medians.items() if name not in local_apps),
+            key=lambda item: item[1], reverse=True,
+        )
+        for name, ms in others[:options['top']]:
+            self.stdout.write(f'  {name:<24} {ms:8.1f}ms')
+
+        budget = options['budget_ms']
+        if budget is not None:
+            if total_ms > budget:
+                raise CommandError(f'起動時間 {total_ms:.0f}ms が上限 {budget:.0f}ms を超えています')
+            self.stdout.write(self.style.SUCCESS(f'\n上限 {budget:.0f}ms 以内です'))
@@ -0,0 +1,41 @@
+# accounts/management/commands/detect_visits.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import LocationHistoryChunk
+from accounts.visits import detect_visits_for_user
+
+
+class Command(BaseCommand):
+    help = '位置履歴から滞在（来店）を検出してVisitに書き込む'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='対象ユーザーID（複数指定可、省略時は最近の履歴があるユーザー全員）')
+        parser.add_argument('--lookback-days', type=int, default=settings.VISIT_LOOKBACK_DAYS,
+                            help='遡って読む位置履歴の日数')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        lookback = timedelta(days=options['lookback_days'])
+
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = (
+                LocationHistoryChunk.objects
+                .filter(end_time__gte=now - lookback)
+                .order_by('user_id')
+                .values_list('user_id', flat=True)
+                .distinct()
+            )
+
+        users = 0
+        visits = 0
+        for user_id in user_ids:
+            visits += detect_visits_for_user(user_id, lookback=lookback, now=now)
+            users += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{users}ユーザーから{visits}件の滞在を検出しました'))
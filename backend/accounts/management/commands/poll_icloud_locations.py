@@ -0,0 +1,81 @@
+# accounts/management/commands/poll_icloud_locations.py
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.icloud_service import get_icloud_service, iCloudError
+from accounts.location_buffer import location_buffer
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = '位置情報追跡が有効なユーザーのiCloudデバイス位置を並列に取得し、位置情報の更新経路に流す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.ICLOUD_POLL_WORKERS,
+                            help='iCloudへの同時リクエスト数')
+        parser.add_argument('--loop', action='store_true',
+                            help='終了せずに一定間隔で取得し続ける')
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help='--loop時の取得間隔（秒）')
+
+    def handle(self, *args, **options):
+        # 暗号化キーがなければ1件ずつ復号に失敗するだけなので、起動時に止める
+        try:
+            get_icloud_service().cipher_suite
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        workers = max(1, options['workers'])
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='icloud-poll') as executor:
+            while True:
+                started = time.monotonic()
+                # 未完了のリクエストはワーカー数の2倍まで（ユーザー数に比例してfutureを溜めない）
+                self._poll(executor, max_pending=workers * 2)
+                if not options['loop']:
+                    break
+                time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
+
+    def _poll(self, executor, max_pending):
+        users = (
+            User.objects
+            .filter(is_active=True, location_tracking_enabled=True, icloud_email__isnull=False)
+            .exclude(icloud_email='')
+            .exclude(icloud_password_encrypted='')
+            .only('id', 'icloud_email', 'icloud_password_encrypted', 'icloud_device_name')
+            .iterator(chunk_size=500)
+        )
+
+        # ワーカーはiCloudへの通信だけを行い、DBに触れるバッファへの登録はこのスレッドで行う
+        icloud_service = get_icloud_service()
+        pending = {}
+        total = accepted = failed = 0
+
+        def collect(futures):
+            nonlocal accepted, failed
+            for future in futures:
+                user_id = pending.pop(future)
+                try:
+                    fix = future.result()
+                except iCloudError as e:
+                    failed += 1
+                    self.stderr.write(f'ユーザー{user_id}: {e.message}')
+                    continue
+                if location_buffer.offer(user_id, fix):
+                    accepted += 1
+
+        for user in users:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(icloud_service.fetch_device_location, user)] = user.pk
+            total += 1
+        collect(as_completed(list(pending)))
+
+        location_buffer.flush()
+        self.stdout.write(self.style.SUCCESS(
+            f'{total}ユーザー中 {total - failed}件取得（{accepted}件を採用、{failed}件失敗）'
+        ))
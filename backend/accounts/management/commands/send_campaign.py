@@ -0,0 +1,63 @@
+# accounts/management/commands/send_campaign.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.campaigns import CampaignConnectionError, retry_failed, send_campaign
+from accounts.models import EmailCampaign
+
+
+class Command(BaseCommand):
+    help = 'お知らせメール（EmailCampaign）を認証済みユーザー全員に送信する（中断した場合は続きから再開）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='キャンペーン名')
+        parser.add_argument('--workers', type=int, default=settings.EMAIL_CAMPAIGN_CONNECTIONS,
+                            help='同時に使うSMTP接続数')
+        parser.add_argument('--rate', type=float, default=settings.EMAIL_CAMPAIGN_RATE,
+                            help='毎秒の最大送信数（0以下で無制限）')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='チェックポイントを進める単位の件数')
+        parser.add_argument('--restart', action='store_true',
+                            help='チェックポイントを破棄して最初から送り直す')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='送信できなかった宛先（EmailCampaignFailure）にだけ送り直す')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = EmailCampaign.objects.get(name=options['name'])
+        except EmailCampaign.DoesNotExist:
+            raise CommandError(f'キャンペーンが見つかりません: {options["name"]}')
+
+        if options['restart']:
+            campaign.status = 'draft'
+            campaign.last_user_id = 0
+            campaign.sent_count = 0
+            campaign.failed_count = 0
+            campaign.started_at = None
+            campaign.completed_at = None
+            campaign.save()
+            campaign.failures.all().delete()
+        elif campaign.status == 'completed' and not options['retry_failed']:
+            raise CommandError(
+                'このキャンペーンは送信済みです（最初から送り直す場合は --restart、失敗分だけなら --retry-failed）'
+            )
+
+        def progress(campaign):
+            self.stdout.write(
+                f'ユーザーID {campaign.last_user_id} まで: {campaign.sent_count}件送信、{campaign.failed_count}件失敗'
+            )
+
+        send = retry_failed if options['retry_failed'] else send_campaign
+        try:
+            campaign = send(
+                campaign,
+                workers=options['workers'],
+                rate=options['rate'],
+                batch_size=options['batch_size'],
+                progress=progress,
+            )
+        except CampaignConnectionError as e:
+            raise CommandError(f'{e}（ユーザーID {campaign.last_user_id} まで送信済み。再実行すると続きから送ります）')
+        self.stdout.write(self.style.SUCCESS(
+            f'送信完了: {campaign.sent_count}件送信、{campaign.failed_count}件失敗'
+        ))
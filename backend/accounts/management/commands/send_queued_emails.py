@@ -0,0 +1,39 @@
+# accounts/management/commands/send_queued_emails.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.email_outbox import claim_batch, deliver_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'アウトボックスの送信待ちメールを送信する。'
+        'ローカルのSMTPスタブで試す場合は EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False を指定する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+                            help='1本のSMTP接続で送る最大件数')
+        parser.add_argument('--loop', action='store_true',
+                            help='終了せずに送信待ちを監視し続ける')
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help='--loop時、送信待ちがないときの待機秒数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total_sent = total_failed = 0
+        while True:
+            emails = claim_batch(batch_size)
+            if emails:
+                sent, failed = deliver_batch(emails)
+                total_sent += sent
+                total_failed += failed
+                self.stdout.write(f'{sent}件送信、{failed}件失敗')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'合計 {total_sent}件送信、{total_failed}件失敗'))
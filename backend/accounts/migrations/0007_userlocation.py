@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_locations_forward(apps, schema_editor):
+    """User上の位置情報をUserLocationへ移す"""
+    User = apps.get_model('accounts', 'User')
+    UserLocation = apps.get_model('accounts', 'UserLocation')
+    rows = (
+        User.objects
+        .filter(last_known_latitude__isnull=False, last_known_longitude__isnull=False)
+        .values_list('id', 'last_known_latitude', 'last_known_longitude', 'last_location_update', 'updated_at')
+        .iterator(chunk_size=1000)
+    )
+    batch = []
+    for user_id, latitude, longitude, location_update, updated_at in rows:
+        batch.append(UserLocation(
+            user_id=user_id,
+            latitude=float(latitude),
+            longitude=float(longitude),
+            updated_at=location_update or updated_at,
+        ))
+        if len(batch) >= 1000:
+            UserLocation.objects.bulk_create(batch)
+            batch = []
+    UserLocation.objects.bulk_create(batch)
+
+
+def copy_locations_backward(apps, schema_editor):
+    """UserLocationの位置情報をUserへ戻す"""
+    User = apps.get_model('accounts', 'User')
+    UserLocation = apps.get_model('accounts', 'UserLocation')
+    for location in UserLocation.objects.iterator(chunk_size=1000):
+        User.objects.filter(pk=location.user_id).update(
+            last_known_latitude=location.latitude,
+            last_known_longitude=location.longitude,
+            last_location_update=location.updated_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_user_google_id_user_google_picture_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLocation',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='location', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('accuracy', models.FloatField(blank=True, null=True)),
+                ('speed', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(copy_locations_forward, copy_locations_backward),
+        migrations.RemoveField(
+            model_name='user',
+            name='last_known_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='last_known_longitude',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='last_location_update',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_userlocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlocation',
+            name='accepted_fixes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='suppressed_fixes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_locationhistorychunk'),
+        ('stores', '0004_alter_store_latitude_alter_store_longitude'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Visit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('arrived_at', models.DateTimeField()),
+                ('departed_at', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('distance_to_store', models.FloatField(blank=True, null=True)),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='stores.store')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-arrived_at'],
+                'indexes': [models.Index(fields=['user', '-arrived_at', '-id'], name='accounts_vi_user_id_f80990_idx')],
+                'unique_together': {('user', 'arrived_at')},
+            },
+        ),
+    ]
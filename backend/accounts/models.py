@@ -30,9 +30,6 @@ class User(AbstractUser):
     icloud_password_encrypted = models.TextField(blank=True, help_text="暗号化されたiCloudパスワード")
     icloud_device_name = models.CharField(max_length=100, blank=True, help_text="追跡するデバイス名")
     location_tracking_enabled = models.BooleanField(default=False, help_text="位置情報追跡を有効にする")
-    last_known_latitude = models.DecimalField(max_digits=22, decimal_places=16, null=True, blank=True)
-    last_known_longitude = models.DecimalField(max_digits=22, decimal_places=16, null=True, blank=True)
-    last_location_update = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -64,4 +61,145 @@ class User(AbstractUser):
         """パスワードリセットトークンを生成"""
         self.password_reset_token = uuid.uuid4()
         self.password_reset_sent_at = timezone.now()
-        self.save()
\ No newline at end of file
+        self.save()
+
+
+class UserLocation(models.Model):
+    """ユーザーの現在位置（認証で読むUser行とは別の細いテーブルに分離）"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='location')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    accuracy = models.FloatField(null=True, blank=True)  # メートル単位
+    speed = models.FloatField(null=True, blank=True)  # m/s
+    updated_at = models.DateTimeField(db_index=True)
+    # サーバー側の移動しきい値判定の結果（書き込み削減量の把握用）
+    accepted_fixes = models.PositiveIntegerField(default=0)
+    suppressed_fixes = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} ({self.latitude}, {self.longitude})"
+
+
+class LocationHistoryChunk(models.Model):
+    """ユーザー×日ごとの位置履歴（間引き・量子化・差分符号化したバイナリ）"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='location_history')
+    date = models.DateField()  # TIME_ZONE基準の日付
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    point_count = models.PositiveIntegerField(default=0)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['date']
+        unique_together = ('user', 'date')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.date} ({self.point_count}点)"
+
+
+class Visit(models.Model):
+    """位置履歴から検出した滞在（最寄り店舗に紐付け）"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='visits')
+    store = models.ForeignKey('stores.Store', on_delete=models.SET_NULL, null=True, blank=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    arrived_at = models.DateTimeField()
+    departed_at = models.DateTimeField()
+    point_count = models.PositiveIntegerField(default=0)
+    distance_to_store = models.FloatField(null=True, blank=True)  # メートル単位
+
+    class Meta:
+        ordering = ['-arrived_at']
+        unique_together = ('user', 'arrived_at')
+        indexes = [
+            # タイムラインAPIのキーセットページネーション用
+            models.Index(fields=['user', '-arrived_at', '-id']),
+        ]
+
+    @property
+    def duration_seconds(self):
+        return int((self.departed_at - self.arrived_at).total_seconds())
+
+    def __str__(self):
+        return f"{self.user_id} - {self.arrived_at:%Y/%m/%d %H:%M}"
+
+
+class EmailOutbox(models.Model):
+    """送信待ちメール（リクエストのトランザクション内で積み、ワーカーが送信する）"""
+    STATUS_CHOICES = [
+        ('pending', '送信待ち'),
+        ('sent', '送信済み'),
+        ('failed', '送信失敗'),
+    ]
+
+    KIND_CHOICES = [
+        ('verification', 'メール認証'),
+        ('welcome', 'ウェルカム'),
+        ('password_reset', 'パスワードリセット'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='outbox_emails')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # ワーカーが送信対象を拾うためのインデックス
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.subject} ({self.get_status_display()})"
+
+
+class EmailCampaign(models.Model):
+    """認証済みユーザー全員へのお知らせメール（送信の進捗をチェックポイントとして保持）"""
+    STATUS_CHOICES = [
+        ('draft', '下書き'),
+        ('sending', '送信中'),
+        ('completed', '送信完了'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    # Djangoテンプレート。{{ user.username }} などが使える
+    subject_template = models.CharField(max_length=255)
+    body_template = models.TextField()
+    html_template = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
+    # ここまでのユーザーIDには送信済み（中断後はこの次から再開）
+    last_user_id = models.BigIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+
+class EmailCampaignFailure(models.Model):
+    """お知らせメールを送れなかった宛先（send_campaign --retry-failed で再送し、送れたら削除する）"""
+    campaign = models.ForeignKey(EmailCampaign, on_delete=models.CASCADE, related_name='failures')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('campaign', 'user')
+
+    def __str__(self):
+        return f"{self.campaign_id} - {self.user_id}"
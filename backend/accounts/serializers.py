@@ -2,7 +2,7 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
-from .models import User
+from .models import User, Visit
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -19,29 +19,37 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        password_confirm = validated_data.pop('password_confirm')
+        """
+        ユーザーを作成してメール認証トークンを生成する。
+        save(password_hash=...)でハッシュ計算済みの値を渡すと、それをそのまま使う（非同期版の登録用）
+        """
+        validated_data.pop('password_confirm')
         password = validated_data.pop('password')
+        password_hash = validated_data.pop('password_hash', None)
         
         # create_userメソッドを使ってユーザーを作成
         user = User.objects.create_user(
             username=validated_data.get('username'),
             email=validated_data.get('email'),
-            password=password
+            password=None if password_hash else password,
+            phone_number=validated_data.get('phone_number', ''),
         )
-        
-        # その他のフィールドを個別に設定
-        if 'phone_number' in validated_data:
-            user.phone_number = validated_data['phone_number']
+        if password_hash:
+            user.password = password_hash
+            user.save(update_fields=['password'])
         
         # メール認証トークンを確実に生成
         user.generate_new_verification_token()
         
         return user
 
-class UserLoginSerializer(serializers.Serializer):
+class LoginCredentialsSerializer(serializers.Serializer):
+    """ログイン入力の形式チェックのみ（DBにアクセスしないので非同期ビューからも使える）"""
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
 
+
+class UserLoginSerializer(LoginCredentialsSerializer):
     def validate(self, attrs):
         email = attrs.get('email')
         password = attrs.get('password')
@@ -61,4 +69,15 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'phone_number', 'is_premium', 'created_at')
-        read_only_fields = ('id', 'is_premium', 'created_at')
\ No newline at end of file
+        read_only_fields = ('id', 'is_premium', 'created_at')
+
+class VisitSerializer(serializers.ModelSerializer):
+    store_name = serializers.CharField(source='store.name', read_only=True, default=None)
+    store_type = serializers.CharField(source='store.store_type', read_only=True, default=None)
+    duration_seconds = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Visit
+        fields = ('id', 'store', 'store_name', 'store_type', 'latitude', 'longitude',
+                  'arrived_at', 'departed_at', 'duration_seconds', 'distance_to_store')
+        read_only_fields = fields
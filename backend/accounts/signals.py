@@ -0,0 +1,24 @@
+# accounts/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .models import User
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, created, **kwargs):
+    """ユーザーの変更（パスワード変更・無効化など）時に認証キャッシュを破棄"""
+    if created:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user_tokens(user_id))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """トークン削除（ログアウト）時に認証キャッシュを破棄"""
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
@@ -1,3 +1,1086 @@
-from django.test import TestCase
+import http.server
+import io
+import json
+import os
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import verify_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMultiAlternatives
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from stores.models import Store
+from .async_views import auth_limiter, client_ip
+from .authentication import _CACHE_KEY, CachedTokenAuthentication, _LocalTokenCache, _digest, local_token_cache
+from .campaigns import CampaignConnectionError, TokenBucket, send_campaign
+from .email_outbox import claim_batch, deliver_batch, enqueue_email
+from .google_auth import cache_lifetime, google_cert_cache
+from .icloud_service import get_icloud_service, iCloudLocationService, iCloudSessionPool
+from .location_buffer import LocationFix, LocationWriteBuffer, distance_meters, is_significant_move
+from .location_history import HistoryPoint, day_bounds, decode_points, encode_points, ingest, iter_history, simplify
+from .models import EmailCampaign, EmailCampaignFailure, EmailOutbox, LocationHistoryChunk, User, UserLocation, Visit
+from .visits import detect_stay_points, detect_visits_for_user
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        if self.server.down:
+            return
+        self.server.connections += 1
+        self.reply('220 stub ESMTP')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line or self.server.down:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb in ('MAIL', 'RCPT'):
+                address = command.split(':', 1)[1].split()[0].strip('<>')
+                if verb == 'MAIL':
+                    sender, recipients = address, []
+                    self.reply('250 OK')
+                elif address in self.server.reject:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    lines.append(data)
+                self.server.messages.append((sender, recipients, b''.join(lines).decode()))
+                self.reply('250 OK')
+                if self.server.down_after is not None and len(self.server.messages) >= self.server.down_after:
+                    self.server.down = True
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                sender, recipients = (None, []) if verb == 'RSET' else (sender, recipients)
+                self.reply('250 OK')
+
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """
+    テスト用のローカルSMTPサーバー（受け取ったメッセージを記録するだけ、rejectの宛先は550で拒否）。
+    down_after通を受け取ると停止したことにして、以降の接続・コマンドを切断する
+    """
+    daemon_threads = True
+
+    def __init__(self, reject=()):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.reject = set(reject)
+        self.messages = []
+        self.connections = 0
+        self.down = False
+        self.down_after = None
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def settings(self):
+        return override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server_address[1],
+            EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+        )
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _make_signing_key(kid):
+    """テスト用のRSA鍵と自己署名証明書を作り、(署名器, 証明書PEM) を返す"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    from google.auth import crypt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = timezone.now()
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    return crypt.RSASigner.from_string(key_pem, key_id=kid), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class _CertsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        body = json.dumps(self.server.certs).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'public, max-age=3600')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CertsStub(http.server.ThreadingHTTPServer):
+    """Googleの証明書エンドポイントの代わりにcerts（kid -> PEM）を返すローカルHTTPサーバー"""
+    daemon_threads = True
+
+    def __init__(self, certs):
+        super().__init__(('127.0.0.1', 0), _CertsHandler)
+        self.certs = certs
+        self.requests = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/oauth2/v1/certs'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeDevice(dict):
+    def __init__(self, name, location):
+        super().__init__(name=name, deviceDisplayName='iPhone', id=name)
+        self._location = location
+
+    def location(self):
+        return self._location
+
+
+class FakeiCloudService:
+    """pyicloud_ipd.PyiCloudServiceの代わり（ICLOUD_CLIENT_FACTORYに指定してiCloudに接続せずに動かす）"""
+    accounts = {}
+    logins = []
+
+    def __init__(self, apple_id, password, cookie_directory=None):
+        account = self.accounts.get(apple_id)
+        if account is None or account['password'] != password:
+            raise Exception('Invalid email/password combination.')
+        self.logins.append((apple_id, cookie_directory))
+        self.account = account
+        self.requires_2fa = account.get('requires_2fa', False)
+        self.trusted_devices = []
+        self.devices = [FakeDevice(name, location) for name, location in account.get('devices', {}).items()]
+
+    def validate_2fa_code(self, code):
+        if code != self.account.get('code'):
+            return False
+        self.requires_2fa = False
+        return True
+
+
+@override_settings(EMAIL_OUTBOX_RETRY_BASE=30, EMAIL_OUTBOX_RETRY_MAX=3600, EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+                   EMAIL_OUTBOX_LEASE_SECONDS=300)
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.smtp = SmtpStub(reject={'bounce@example.com'})
+        self.addCleanup(self.smtp.stop)
+        overridden = self.smtp.settings()
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def enqueue(self, *addresses):
+        return [enqueue_email('welcome', address, 'ようこそ', f'{address} さん').pk for address in addresses]
+
+    def test_sends_batch_over_one_connection(self):
+        self.enqueue('a@example.com', 'b@example.com', 'c@example.com')
+        out = io.StringIO()
+        call_command('send_queued_emails', stdout=out)
+        self.assertIn('合計 3件送信、0件失敗', out.getvalue())
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual([recipients for _, recipients, _ in self.smtp.messages],
+                         [['a@example.com'], ['b@example.com'], ['c@example.com']])
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', 'attempts')), {('sent', 1)})
+
+    def test_failure_backs_off_then_gives_up(self):
+        good, bounce = self.enqueue('a@example.com', 'bounce@example.com')
+        started = timezone.now()
+        with self.assertLogs('accounts.email_outbox', 'WARNING'):
+            self.assertEqual(deliver_batch(claim_batch(10)), (1, 1))
+        email = EmailOutbox.objects.get(pk=bounce)
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('SMTPRecipientsRefused', email.last_error)
+        # 1回目の失敗後は RETRY_BASE 秒（±20%）待つ
+        self.assertGreaterEqual(email.next_attempt_at, started + timedelta(seconds=24))
+        self.assertLessEqual(email.next_attempt_at, timezone.now() + timedelta(seconds=36))
+        self.assertEqual(claim_batch(10), [])
+
+        with self.assertLogs('accounts.email_outbox', 'WARNING'):
+            self.assertEqual(deliver_batch(claim_batch(10, now=started + timedelta(minutes=5))), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+        self.assertEqual(EmailOutbox.objects.get(pk=good).status, 'sent')
+
+    def test_connection_failure_requeues_whole_batch(self):
+        self.enqueue('a@example.com', 'b@example.com')
+        with override_settings(EMAIL_PORT=self.smtp.server_address[1]), self.assertLogs('accounts.email_outbox', 'WARNING'):
+            self.smtp.stop()
+            self.assertEqual(deliver_batch(claim_batch(10)), (0, 2))
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', 'attempts')), {('pending', 1)})
+
+    def test_crash_mid_batch_does_not_resend_delivered_mail(self):
+        _, second, third = self.enqueue('a@example.com', 'b@example.com', 'c@example.com')
+        original_send = EmailMultiAlternatives.send
+
+        def crash_on_third(message, *args, **kwargs):
+            if message.to == ['c@example.com']:
+                raise SystemExit('ワーカーが落ちた')
+            return original_send(message, *args, **kwargs)
+
+        claimed_at = timezone.now()
+        with mock.patch.object(EmailMultiAlternatives, 'send', autospec=True, side_effect=crash_on_third):
+            with self.assertRaises(SystemExit):
+                deliver_batch(claim_batch(10, now=claimed_at))
+        self.assertEqual(EmailOutbox.objects.get(pk=second).status, 'sent')
+
+        # リース中は他のワーカーから見えず、リースが切れたら未送信のものだけ再送される
+        self.assertEqual(claim_batch(10, now=claimed_at + timedelta(seconds=299)), [])
+        reclaimed = claim_batch(10, now=claimed_at + timedelta(seconds=301))
+        self.assertEqual([email.pk for email in reclaimed], [third])
+        self.assertEqual(deliver_batch(reclaimed), (1, 0))
+        self.assertEqual(len(self.smtp.messages), 3)
+
+
+class EmailCampaignTests(TestCase):
+    def setUp(self):
+        self.smtp = SmtpStub()
+        self.addCleanup(self.smtp.stop)
+        overridden = self.smtp.settings()
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+        User.objects.bulk_create(
+            [User(username=f'user{i:02d}', email=f'user{i:02d}@example.com', is_email_verified=True) for i in range(13)]
+            + [User(username='unverified', email='unverified@example.com')]
+        )
+        self.campaign = EmailCampaign.objects.create(
+            name='お知らせ', subject_template='{{ user.username }}さんへ', body_template='{{ user.username }}さん、こんにちは',
+        )
+        self.verified = [f'user{i:02d}@example.com' for i in range(13)]
+
+    def recipients(self):
+        return [recipients[0] for _, recipients, _ in self.smtp.messages]
+
+    def test_resumes_from_checkpoint_without_resending(self):
+        def interrupt(campaign):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            send_campaign(self.campaign, workers=1, rate=0, batch_size=4, progress=interrupt)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sending')
+        checkpoint = self.campaign.last_user_id
+        before = self.recipients()
+        self.assertTrue(before)
+        self.assertEqual(self.campaign.sent_count, len(before))
+        # チェックポイントまでのユーザーには全員送信済み
+        self.assertEqual(set(User.objects.filter(pk__lte=checkpoint).values_list('email', flat=True)), set(before))
+
+        out = io.StringIO()
+        call_command('send_campaign', 'お知らせ', '--workers=2', '--rate=0', '--batch-size=4', stdout=out)
+        self.assertIn('送信完了: 13件送信、0件失敗', out.getvalue())
+        self.assertEqual(sorted(self.recipients()), self.verified)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.last_user_id),
+                         ('completed', User.objects.get(username='user12').pk))
+        self.assertIn('user00さん、こんにちは', self.smtp.messages[0][2])
+
+    def test_rejected_recipients_are_recorded_for_retry(self):
+        self.smtp.reject.update({'user03@example.com', 'user07@example.com'})
+        with self.assertLogs('accounts.campaigns', 'WARNING'):
+            send_campaign(self.campaign, workers=2, rate=0, batch_size=4)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count, self.campaign.failed_count),
+                         ('completed', 11, 2))
+        failed = EmailCampaignFailure.objects.filter(campaign=self.campaign).order_by('user_id')
+        self.assertEqual([failure.user.email for failure in failed], ['user03@example.com', 'user07@example.com'])
+        self.assertIn('550', failed[0].error)
+
+        # 1件はまだ拒否される
+        self.smtp.reject.discard('user03@example.com')
+        out = io.StringIO()
+        with self.assertLogs('accounts.campaigns', 'WARNING'):
+            call_command('send_campaign', 'お知らせ', '--retry-failed', '--rate=0', stdout=out)
+        self.assertIn('送信完了: 12件送信、1件失敗', out.getvalue())
+        self.assertEqual(list(self.campaign.failures.values_list('user__email', flat=True)), ['user07@example.com'])
+        self.assertEqual(sorted(self.recipients()), [email for email in self.verified if email != 'user07@example.com'])
+
+    @override_settings(EMAIL_CAMPAIGN_CONNECTION_RETRIES=1, EMAIL_CAMPAIGN_RETRY_DELAY=0)
+    def test_smtp_outage_stops_without_advancing_checkpoint(self):
+        self.smtp.down_after = 5
+        with self.assertRaises(CampaignConnectionError), self.assertLogs('accounts.campaigns', 'WARNING') as logs:
+            send_campaign(self.campaign, workers=1, rate=0, batch_size=4)
+        self.assertIn('再試行', logs.output[0])
+        self.campaign.refresh_from_db()
+        # 接続障害は宛先ごとの失敗にせず、送り終えたバッチまでで止める
+        self.assertEqual((self.campaign.status, self.campaign.last_user_id, self.campaign.sent_count,
+                          self.campaign.failed_count),
+                         ('sending', User.objects.get(username='user03').pk, 4, 0))
+        self.assertFalse(self.campaign.failures.exists())
+
+        with self.assertRaises(CommandError), self.assertLogs('accounts.campaigns', 'WARNING'):
+            call_command('send_campaign', 'お知らせ', '--rate=0', stdout=io.StringIO())
+
+        # 復旧後に再実行すると中断したバッチから送り直す
+        self.smtp.down, self.smtp.down_after = False, None
+        out = io.StringIO()
+        call_command('send_campaign', 'お知らせ', '--workers=1', '--rate=0', '--batch-size=4', stdout=out)
+        self.assertIn('送信完了: 13件送信、0件失敗', out.getvalue())
+        self.assertEqual(sorted(set(self.recipients())), self.verified)
+
+    def test_rate_limit_applies_across_workers(self):
+        started = time_module.monotonic()
+        # 10通/秒（最初の10通はバケットに貯まっている分）
+        send_campaign(self.campaign, workers=3, rate=10, batch_size=2)
+        self.assertGreaterEqual(time_module.monotonic() - started, 0.25)
+        self.assertEqual(sorted(self.recipients()), self.verified)
+        self.assertLessEqual(self.smtp.connections, 3)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        started = time_module.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time_module.monotonic() - started, 0.19)
+
+
+@override_settings(TOKEN_AUTH_LOCAL_TTL=0)
+class CachedTokenAuthenticationTests(TestCase):
+    """あるワーカーでの破棄が、別のワーカーの認証キャッシュに届くこと"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        local_token_cache.clear()
+        # 別プロセスのワーカー（プロセス内LRUは別物、Djangoキャッシュは同じ設定の別接続）
+        self.other_worker = mock.patch.multiple(
+            'accounts.authentication', cache=caches.create_connection('default'), local_token_cache=_LocalTokenCache()
+        )
+
+    def get_profile(self):
+        with self.other_worker:
+            return self.client.get('/api/auth/profile/')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_profile().status_code, 200)
+        return [query for query in queries if 'authtoken_token' in query['sql']]
+
+    def test_cache_hit_skips_token_query(self):
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(self.token_queries(), [])
+
+    def test_snapshot_holds_only_auth_fields(self):
+        self.user.phone_number = '09012345678'
+        self.user.stripe_customer_id = 'cus_secret'
+        self.user.save()
+        response = self.get_profile()
+        self.assertEqual(response.data['phone_number'], '09012345678')
+
+        cached = caches.create_connection('default').get(_CACHE_KEY.format(digest=_digest(self.token.key)))
+        self.assertNotIn(self.user.password, repr(cached))
+        self.assertNotIn('cus_secret', repr(cached))
+        self.assertEqual(cached[1], (self.user.pk, True, False, False))
+
+        # キャッシュから作ったユーザーはスナップショット以外のフィールドを持たない
+        with self.other_worker:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertIn('icloud_password_encrypted', user.get_deferred_fields())
+
+    def test_logout_reaches_other_worker(self):
+        self.assertEqual(self.get_profile().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.get_profile().status_code, 401)
+
+    def test_password_reset_drops_cached_user(self):
+        self.user.generate_password_reset_token()
+        reset_token = self.user.password_reset_token
+        self.assertEqual(self.get_profile().status_code, 200)
+        cached_key = _CACHE_KEY.format(digest=_digest(self.token.key))
+        self.assertIsNotNone(caches.create_connection('default').get(cached_key))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/auth/reset-password/{reset_token}/', {
+                'password': 'n3w-Passw0rd!', 'confirm_password': 'n3w-Passw0rd!',
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(caches.create_connection('default').get(cached_key))
+        # 次の認証はDBから読み直す
+        self.assertEqual(len(self.token_queries()), 1)
+
+    def test_deactivation_reaches_other_worker(self):
+        self.assertEqual(self.get_profile().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_profile().status_code, 401)
+
+    def test_refuses_process_local_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get('/api/auth/profile/')
+
+
+@override_settings(GOOGLE_CLIENT_IDS=['web-client.apps.googleusercontent.com'], GOOGLE_CERTS_MIN_REFRESH=0)
+class GoogleAuthTests(TestCase):
+    """ローカルの証明書サーバーで署名したIDトークンによるGoogle認証"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signer, cls.cert = _make_signing_key('key-1')
+        cls.rotated_signer, cls.rotated_cert = _make_signing_key('key-2')
+
+    def setUp(self):
+        self.certs = CertsStub({'key-1': self.cert})
+        self.addCleanup(self.certs.stop)
+        overridden = override_settings(GOOGLE_OAUTH2_CERTS_URL=self.certs.url)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        google_cert_cache.clear()
+        self.addCleanup(google_cert_cache.clear)
+        self.client = APIClient()
+
+    def id_token(self, signer=None, **claims):
+        from google.auth import jwt
+
+        now = int(time_module.time())
+        payload = {
+            'iss': 'https://accounts.google.com', 'aud': 'web-client.apps.googleusercontent.com',
+            'sub': '10769150350006150715113082367', 'email': 'shopper@gmail.com', 'email_verified': True,
+            'given_name': '花子', 'family_name': '山田', 'iat': now, 'exp': now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(signer or self.signer, payload).decode()
+
+    def sign_in(self, **data):
+        return self.client.post('/api/auth/google/', data, format='json')
+
+    def test_registers_from_verified_claims(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # クライアントが送った値ではなくクレームのメールアドレスを使う
+            response = self.sign_in(id_token=self.id_token(), email='attacker@example.com')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_new_user'])
+        user = User.objects.get(google_id='10769150350006150715113082367')
+        self.assertEqual((user.email, user.first_name, user.is_email_verified), ('shopper@gmail.com', '花子', True))
+        self.assertFalse(User.objects.filter(email='attacker@example.com').exists())
+
+        response = self.sign_in(id_token=self.id_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_new_user'])
+        self.assertEqual(response.data['token'], Token.objects.get(user=user).key)
+        # 証明書はCache-Controlの期限までプロセス内で使い回す
+        self.assertEqual(self.certs.requests, 1)
+
+    def test_links_existing_account_by_email(self):
+        user = User.objects.create_user(username='shopper', email='shopper@gmail.com', password='password')
+        response = self.sign_in(id_token=self.id_token())
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual((user.google_id, user.is_google_user), ('10769150350006150715113082367', True))
+
+    def test_rejects_invalid_tokens(self):
+        other_signer, _ = _make_signing_key('key-1')
+        invalid = {
+            'wrong audience': self.id_token(aud='someone-else.apps.googleusercontent.com'),
+            'wrong issuer': self.id_token(iss='https://evil.example.com'),
+            'expired': self.id_token(iat=int(time_module.time()) - 7200, exp=int(time_module.time()) - 3600),
+            'unverified email': self.id_token(email_verified=False),
+            'forged signature': self.id_token(signer=other_signer),
+        }
+        for reason, token in invalid.items():
+            with self.subTest(reason), self.assertLogs('accounts.views', 'WARNING'):
+                self.assertEqual(self.sign_in(id_token=token).status_code, 401)
+        self.assertFalse(User.objects.filter(email='shopper@gmail.com').exists())
+
+    def test_legacy_access_token_payload_is_rejected(self):
+        response = self.sign_in(access_token='ya29.token', email='shopper@gmail.com', google_id='1')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(email='shopper@gmail.com').exists())
+
+    def test_refetches_certs_after_key_rotation(self):
+        self.assertEqual(self.sign_in(id_token=self.id_token()).status_code, 201)
+        self.certs.certs = {'key-2': self.rotated_cert}
+        self.assertEqual(self.sign_in(id_token=self.id_token(signer=self.rotated_signer)).status_code, 200)
+        self.assertEqual(self.certs.requests, 2)
+
+    def test_unavailable_when_client_ids_unset(self):
+        with override_settings(GOOGLE_CLIENT_IDS=[]), self.assertLogs('accounts.views', 'ERROR'):
+            response = self.sign_in(id_token=self.id_token())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.certs.requests, 0)
+
+    def test_unavailable_when_certs_unreachable(self):
+        self.certs.stop()
+        with self.assertLogs('accounts.views', 'ERROR'):
+            response = self.sign_in(id_token=self.id_token())
+        self.assertEqual(response.status_code, 503)
+
+    def test_cache_lifetime(self):
+        self.assertEqual(cache_lifetime({'Cache-Control': 'public, max-age=3600', 'Age': '600'}, 60), 3000)
+        self.assertEqual(cache_lifetime({'Cache-Control': 'no-store'}, 60), 0)
+        self.assertEqual(cache_lifetime({}, 60), 60)
+
+
+@override_settings(AUTH_MAX_CONCURRENT_PER_IP=2)
+class AsyncAuthTests(TestCase):
+    """非同期版のログイン・登録が同期版と同じ検証・作成処理を通ること"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='shopper', email='shopper@example.com', password='s3cret-Passw0rd', is_email_verified=True
+        )
+
+    def post(self, path, data):
+        return self.client.post(path, data, content_type='application/json')
+
+    def registration(self, **overrides):
+        data = {'username': 'newcomer', 'email': 'newcomer@example.com', 'phone_number': '09012345678',
+                'password': 'n3w-Passw0rd!', 'password_confirm': 'n3w-Passw0rd!'}
+        data.update(overrides)
+        return data
+
+    def test_register_matches_sync_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post('/api/auth/async/register/', self.registration())
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='newcomer@example.com')
+        self.assertTrue(user.check_password('n3w-Passw0rd!'))
+        self.assertEqual(user.phone_number, '09012345678')
+        self.assertIsNotNone(user.email_verification_token)
+        self.assertTrue(EmailOutbox.objects.filter(to_email='newcomer@example.com').exists())
+
+    def test_register_validation_matches_sync_endpoint(self):
+        invalid = {
+            'invalid email': self.registration(email='not-an-email'),
+            'duplicate email': self.registration(email='shopper@example.com'),
+            'password mismatch': self.registration(password_confirm='other-Passw0rd!'),
+            'weak password': self.registration(password='12345678', password_confirm='12345678'),
+        }
+        for reason, data in invalid.items():
+            with self.subTest(reason):
+                response = self.post('/api/auth/async/register/', data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), self.post('/api/auth/register/', data).json())
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+
+    def test_login(self):
+        response = self.post('/api/auth/async/login/', {'email': 'shopper@example.com', 'password': 's3cret-Passw0rd'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['token'], Token.objects.get(user=self.user).key)
+
+    def test_login_rejections(self):
+        self.assertEqual(self.post('/api/auth/async/login/', {
+            'email': 'shopper@example.com', 'password': 'wrong-password',
+        }).status_code, 400)
+        self.assertEqual(self.post('/api/auth/async/login/', {
+            'email': 'nobody@example.com', 'password': 's3cret-Passw0rd',
+        }).status_code, 400)
+        response = self.post('/api/auth/async/login/', {'email': 'not-an-email', 'password': 's3cret-Passw0rd'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+        User.objects.filter(pk=self.user.pk).update(is_email_verified=False)
+        response = self.post('/api/auth/async/login/', {'email': 'shopper@example.com', 'password': 's3cret-Passw0rd'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['requires_verification'])
+
+    def test_concurrency_cap_per_ip(self):
+        for _ in range(2):
+            self.assertTrue(auth_limiter.acquire('127.0.0.1'))
+        try:
+            response = self.post('/api/auth/async/login/', {
+                'email': 'shopper@example.com', 'password': 's3cret-Passw0rd',
+            })
+            self.assertEqual(response.status_code, 429)
+        finally:
+            for _ in range(2):
+                auth_limiter.release('127.0.0.1')
+        response = self.post('/api/auth/async/login/', {'email': 'shopper@example.com', 'password': 's3cret-Passw0rd'})
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_login_goes_through_authentication_backends(self):
+        failed = []
+
+        def on_failure(sender, credentials, **kwargs):
+            failed.append(credentials['username'])
+
+        user_login_failed.connect(on_failure)
+        self.addCleanup(user_login_failed.disconnect, on_failure)
+        threads = []
+
+        def verify(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return verify_password(*args, **kwargs)
+
+        with mock.patch('accounts.backends.verify_password', side_effect=verify):
+            self.post('/api/auth/async/login/', {'email': 'shopper@example.com', 'password': 'wrong-password'})
+            response = self.post('/api/auth/async/login/', {
+                'email': 'shopper@example.com', 'password': 's3cret-Passw0rd',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(failed, ['shopper@example.com'])
+        # ハッシュ計算はイベントループではなく専用スレッドプールで行う
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('password-hash') for name in threads))
+        self.assertEqual(self.client.session['_auth_user_backend'], 'accounts.backends.PooledHashingModelBackend')
+
+    def test_login_rejects_inactive_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.post('/api/auth/async/login/', {'email': 'shopper@example.com', 'password': 's3cret-Passw0rd'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+
+    @override_settings(AUTH_TRUSTED_PROXY_COUNT=1)
+    def test_concurrency_cap_uses_forwarded_client_ip(self):
+        # 全リクエストが同じプロキシ（REMOTE_ADDR）から来ても、クライアントごとに数える
+        for _ in range(2):
+            self.assertTrue(auth_limiter.acquire('203.0.113.5'))
+        try:
+            credentials = {'email': 'shopper@example.com', 'password': 's3cret-Passw0rd'}
+            response = self.client.post('/api/auth/async/login/', credentials, content_type='application/json',
+                                        HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.5')
+            self.assertEqual(response.status_code, 429)
+            response = self.client.post('/api/auth/async/login/', credentials, content_type='application/json',
+                                        HTTP_X_FORWARDED_FOR='203.0.113.6')
+            self.assertEqual(response.status_code, 200)
+        finally:
+            for _ in range(2):
+                auth_limiter.release('203.0.113.5')
+
+    def test_client_ip(self):
+        factory = RequestFactory()
+        request = factory.post('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.5, 10.0.0.1')
+        cases = {0: '10.0.0.2', 1: '10.0.0.1', 2: '203.0.113.5', 4: '10.0.0.2'}
+        for count, expected in cases.items():
+            with self.subTest(count=count), override_settings(AUTH_TRUSTED_PROXY_COUNT=count):
+                self.assertEqual(client_ip(request), expected)
+        with override_settings(AUTH_TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(client_ip(factory.post('/', REMOTE_ADDR='10.0.0.2')), '10.0.0.2')
+
+
+@override_settings(LOCATION_MIN_DISTANCE=3.0, LOCATION_MIN_INTERVAL=2.0, LOCATION_HEARTBEAT_INTERVAL=300.0)
+class MovementThresholdTests(TestCase):
+    def setUp(self):
+        self.start = timezone.now()
+        self.previous = LocationFix(35.68, 139.76, self.start, accuracy=10.0)
+
+    def moved(self, seconds, north_meters, accuracy=10.0):
+        return LocationFix(35.68 + north_meters / 111195.0, 139.76, self.start + timedelta(seconds=seconds),
+                           accuracy=accuracy)
+
+    def test_distance_meters(self):
+        self.assertAlmostEqual(distance_meters(self.previous, self.moved(0, 100)), 100, delta=0.5)
+
+    def test_first_fix_is_always_significant(self):
+        self.assertTrue(is_significant_move(None, self.previous))
+
+    def test_too_soon_is_dropped_even_after_long_move(self):
+        self.assertFalse(is_significant_move(self.previous, self.moved(1, 500)))
+
+    def test_moves_within_accuracy_or_min_distance_are_dropped(self):
+        # 前回の精度円（10m）の内側
+        self.assertFalse(is_significant_move(self.previous, self.moved(30, 8)))
+        self.assertTrue(is_significant_move(self.previous, self.moved(30, 12)))
+        # 精度の記録がない場合はLOCATION_MIN_DISTANCEが基準
+        precise = self.previous._replace(accuracy=None)
+        self.assertFalse(is_significant_move(precise, self.moved(30, 2)))
+        self.assertTrue(is_significant_move(precise, self.moved(30, 4)))
+
+    def test_heartbeat_keeps_stationary_user_fresh(self):
+        self.assertFalse(is_significant_move(self.previous, self.moved(299, 0)))
+        self.assertTrue(is_significant_move(self.previous, self.moved(300, 0)))
+
+
+class LocationHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='walker', email='walker@example.com', password='password')
+        self.start = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=1), time(9)))
+
+    def fix(self, seconds, north_meters=0.0, east_meters=0.0):
+        return LocationFix(35.68 + north_meters / 110540.0, 139.76 + east_meters / 90400.0,
+                           self.start + timedelta(seconds=seconds))
+
+    def test_encode_decode_round_trip(self):
+        points = [
+            HistoryPoint(1700000000, 3568123, 13976712),
+            HistoryPoint(1700000001, 3568123, 13976712),  # 差分0
+            HistoryPoint(1700000300, -3368000, -7056000),  # 南半球・西半球への大きな差分
+            HistoryPoint(1700086400, 9000000, 18000000),
+        ]
+        data = encode_points(points)
+        self.assertEqual(list(decode_points(data)), points)
+        self.assertEqual(list(decode_points(b'')), [])
+        with self.assertRaises(ValueError):
+            list(decode_points(bytes([99]) + data[1:]))
+        # 1点あたり数バイトに収まる（座標は1e-5度、時刻は秒に量子化）
+        self.assertLess(len(encode_points([HistoryPoint(1700000000 + i, 3568000 + i, 13976000) for i in range(100)])), 400)
+
+    def test_simplify_drops_straight_line_points(self):
+        points = [HistoryPoint.from_fix(self.fix(i * 10, north_meters=i * 10)) for i in range(11)]
+        self.assertEqual(simplify(points, 5.0), [points[0], points[-1]])
+        self.assertEqual(simplify(points[:2], 5.0), points[:2])
+
+    def test_simplify_keeps_corners_and_stops(self):
+        # 北へ100m進んでから東へ100m（角は残る）
+        corner = [HistoryPoint.from_fix(self.fix(i * 10, north_meters=min(i, 10) * 10, east_meters=max(i - 10, 0) * 10))
+                  for i in range(21)]
+        self.assertEqual(simplify(corner, 5.0), [corner[0], corner[10], corner[20]])
+
+        # 同じ道を進んでも途中で止まった時間は残る（時刻同期距離）
+        stop = [HistoryPoint.from_fix(self.fix(0)), HistoryPoint.from_fix(self.fix(10, north_meters=50)),
+                HistoryPoint.from_fix(self.fix(600, north_meters=50)), HistoryPoint.from_fix(self.fix(610, north_meters=100))]
+        self.assertEqual(simplify(stop, 5.0), stop)
+
+    def test_ingest_appends_and_reads_back(self):
+        ingest({self.user.pk: [self.fix(i * 10, north_meters=i * 10) for i in range(5)]}, tolerance=5.0)
+        ingest({self.user.pk: [self.fix(i * 10, north_meters=i * 10) for i in range(5, 11)]
+                + [self.fix(10, north_meters=10)]}, tolerance=5.0)  # 既存の末尾より古い点は捨てる
+        chunk = LocationHistoryChunk.objects.get(user=self.user)
+        self.assertEqual(chunk.point_count, 2)
+        self.assertEqual((chunk.start_time, chunk.end_time), (self.start, self.start + timedelta(seconds=100)))
+
+        points = list(iter_history(self.user.pk, *day_bounds(self.start.date())))
+        self.assertEqual([point.timestamp for point in points],
+                         [int(self.start.timestamp()), int(self.start.timestamp()) + 100])
+        self.assertAlmostEqual(points[-1].latitude, self.fix(100, north_meters=100).latitude, places=5)
+        self.assertEqual(list(iter_history(self.user.pk, self.start + timedelta(seconds=1),
+                                           self.start + timedelta(seconds=99))), [])
+
+
+@override_settings(VISIT_STAY_RADIUS=50.0, VISIT_MIN_DURATION=300, VISIT_STORE_RADIUS=50.0, VISIT_LOOKBACK_DAYS=2)
+class VisitDetectionTests(TestCase):
+    # 地点A（店の前）に10分 → B に2分 → C に10分 → D へ移動中
+    ROUTE = [('A', 0, 600), ('B', 700, 820), ('C', 900, 1500), ('D', 1600, 1660)]
+    PLACES = {'A': 0, 'B': 300, 'C': 600, 'D': 900}  # 北へのメートル
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='walker', email='walker@example.com', password='password')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=3)
+        self.store = Store.objects.create(name='コンビニ', store_type='convenience', address='東京都',
+                                          latitude=35.68010, longitude=139.76)
+
+    def fixes(self):
+        for place, first, last in self.ROUTE:
+            for seconds in range(first, last + 1, 60):
+                # 滞在中も数mずつ揺れる
+                jitter = (seconds // 60) % 3 * 4
+                yield LocationFix(35.68 + (self.PLACES[place] + jitter) / 110540.0, 139.76,
+                                  self.start + timedelta(seconds=seconds))
+
+    def test_detect_stay_points(self):
+        points = [HistoryPoint.from_fix(fix) for fix in self.fixes()]
+        stays = list(detect_stay_points(points))
+        # Bは短すぎ、Dは滞在中の可能性があるので出さない
+        self.assertEqual([(stay.arrived_at, stay.departed_at) for stay in stays], [
+            (self.start, self.start + timedelta(seconds=600)),
+            (self.start + timedelta(seconds=900), self.start + timedelta(seconds=1500)),
+        ])
+        self.assertEqual(stays[0].point_count, 11)
+        self.assertAlmostEqual(stays[0].latitude, 35.68 + 4 / 110540.0, places=5)
+
+    def test_detect_visits_matches_store_and_is_idempotent(self):
+        ingest({self.user.pk: list(self.fixes())})
+        self.assertEqual(detect_visits_for_user(self.user.pk), 2)
+        first, second = Visit.objects.filter(user=self.user).order_by('arrived_at')
+        self.assertEqual(first.store, self.store)
+        self.assertLess(first.distance_to_store, 20)
+        self.assertIsNone(second.store)
+
+        # 再実行しても前回の出発時刻以降しか読まないので重複しない
+        out = io.StringIO()
+        call_command('detect_visits', stdout=out)
+        self.assertIn('1ユーザーから0件', out.getvalue())
+        self.assertEqual(Visit.objects.filter(user=self.user).count(), 2)
+
+
+@override_settings(LOCATION_MIN_DISTANCE=3.0, LOCATION_MIN_INTERVAL=2.0, LOCATION_HEARTBEAT_INTERVAL=300.0)
+class LocationWriteBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='walker', email='walker@example.com', password='password')
+        self.start = timezone.now().replace(microsecond=0)
+        # 時間を長くしてバックグラウンドスレッドには書かせない
+        self.buffer = LocationWriteBuffer(flush_interval=3600)
+        self.addCleanup(self.buffer.shutdown)
+
+    def fix(self, seconds, north_meters=0.0):
+        return LocationFix(35.68 + north_meters / 111000.0, 139.76, self.start + timedelta(seconds=seconds), accuracy=5.0)
+
+    def test_coalesces_to_newest_fix_per_user(self):
+        self.buffer.put(self.user.pk, self.fix(10, 100))
+        self.buffer.put(self.user.pk, self.fix(20, 200))
+        # 遅れて届いた古い位置では上書きしない
+        self.buffer.put(self.user.pk, self.fix(15, 150))
+        self.assertEqual(self.buffer.get(self.user.pk), self.fix(20, 200))
+        self.assertFalse(UserLocation.objects.exists())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        location = UserLocation.objects.get(user=self.user)
+        self.assertAlmostEqual(location.latitude, self.fix(20, 200).latitude)
+        self.assertEqual(location.updated_at, self.start + timedelta(seconds=20))
+        self.assertIsNone(self.buffer.get(self.user.pk))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_writes_counters_and_history(self):
+        self.assertTrue(self.buffer.offer(self.user.pk, self.fix(0)))
+        self.assertFalse(self.buffer.offer(self.user.pk, self.fix(10, 1)))
+        self.assertTrue(self.buffer.offer(self.user.pk, self.fix(20, 50)))
+        self.buffer.flush()
+        location = UserLocation.objects.get(user=self.user)
+        self.assertEqual((location.accepted_fixes, location.suppressed_fixes), (2, 1))
+        self.assertEqual(LocationHistoryChunk.objects.get(user=self.user).point_count, 2)
+
+    def test_failed_location_write_is_requeued(self):
+        self.buffer.put(self.user.pk, self.fix(10, 100))
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError), \
+                self.assertLogs('accounts.location_buffer', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        # 失敗中に届いた新しい位置が優先される
+        self.buffer.put(self.user.pk, self.fix(20, 200))
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(UserLocation.objects.get(user=self.user).updated_at, self.start + timedelta(seconds=20))
+
+    def test_failed_counter_write_is_requeued(self):
+        self.buffer.offer(self.user.pk, self.fix(0))
+        self.buffer.offer(self.user.pk, self.fix(1))
+        with mock.patch.object(QuerySet, 'update', side_effect=DatabaseError), \
+                self.assertLogs('accounts.location_buffer', 'ERROR'):
+            self.buffer.flush()
+        location = UserLocation.objects.get(user=self.user)
+        self.assertEqual((location.accepted_fixes, location.suppressed_fixes), (0, 0))
+
+        self.buffer.flush()
+        location.refresh_from_db()
+        self.assertEqual((location.accepted_fixes, location.suppressed_fixes), (1, 1))
+
+    def test_shutdown_stops_thread_and_writes_pending(self):
+        self.buffer.put(self.user.pk, self.fix(10, 100))
+        thread = self.buffer._thread
+        self.assertTrue(thread.is_alive())
+
+        self.assertEqual(self.buffer.shutdown(), 1)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(UserLocation.objects.filter(user=self.user).exists())
+
+        # 終了処理後に届いた位置はその場で書き込まれる
+        self.buffer.put(self.user.pk, self.fix(20, 200))
+        self.assertIsNone(self.buffer.get(self.user.pk))
+        self.assertEqual(UserLocation.objects.get(user=self.user).updated_at, self.start + timedelta(seconds=20))
+
+
+@override_settings(ICLOUD_ENCRYPTION_KEY='JEE_zwhwuRYKrPdk9pq-tIKLU7mIsWeKEsURFX4KLKo=',
+                   ICLOUD_CLIENT_FACTORY='accounts.tests.FakeiCloudService')
+class PollIcloudLocationsTests(TestCase):
+    """偽のiCloudクライアントでの位置取得コマンド"""
+
+    def setUp(self):
+        FakeiCloudService.accounts = {}
+        FakeiCloudService.logins = []
+        self.buffer = LocationWriteBuffer(flush_interval=3600)
+        self.addCleanup(self.buffer.shutdown)
+        for target, value in (('accounts.icloud_service._icloud_service', None),
+                              ('accounts.management.commands.poll_icloud_locations.location_buffer', self.buffer)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tracked_user(self, name, device='iPhone', location=None, **account):
+        apple_id = f'{name}@icloud.com'
+        FakeiCloudService.accounts[apple_id] = dict(
+            password='app-specific-password',
+            devices={'iPhone': location or {'latitude': 35.68, 'longitude': 139.76, 'horizontalAccuracy': 10.0,
+                                            'timeStamp': int(time_module.time() * 1000)}},
+            **account,
+        )
+        return User.objects.create_user(
+            username=name, email=f'{name}@example.com', password='password', location_tracking_enabled=True,
+            icloud_email=apple_id, icloud_device_name=device,
+            icloud_password_encrypted=get_icloud_service().encrypt_password('app-specific-password'),
+        )
+
+    def poll(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('poll_icloud_locations', '--workers', '2', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_refuses_to_start_without_key(self):
+        with override_settings(ICLOUD_ENCRYPTION_KEY=''), self.assertRaisesMessage(CommandError, 'ICLOUD_ENCRYPTION_KEY'):
+            self.poll()
+        self.assertEqual(FakeiCloudService.logins, [])
+
+    def test_password_encrypted_in_one_process_decrypts_in_another(self):
+        encrypted = iCloudLocationService().encrypt_password('app-specific-password')
+        self.assertEqual(iCloudLocationService().decrypt_password(encrypted), 'app-specific-password')
+
+    def test_polls_devices_and_reuses_sessions(self):
+        first = self.tracked_user('hanako')
+        second = self.tracked_user('taro', location={'latitude': 34.70, 'longitude': 135.50, 'timeStamp': 0})
+        out, err = self.poll()
+        self.assertIn('2ユーザー中 2件取得', out)
+        self.assertEqual(err, '')
+        self.assertAlmostEqual(UserLocation.objects.get(user=first).latitude, 35.68)
+        self.assertAlmostEqual(UserLocation.objects.get(user=second).longitude, 135.50)
+
+        # 2回目はログイン済みのセッションを使い回す
+        self.poll()
+        self.assertEqual(sorted(apple_id for apple_id, _ in FakeiCloudService.logins),
+                         ['hanako@icloud.com', 'taro@icloud.com'])
+
+    def test_reports_failures_per_user(self):
+        self.tracked_user('hanako')
+        needs_2fa = self.tracked_user('taro', requires_2fa=True)
+        missing_device = self.tracked_user('jiro', device='iPad')
+        out, err = self.poll()
+        self.assertIn('3ユーザー中 1件取得（1件を採用、2件失敗）', out)
+        self.assertIn(f'ユーザー{needs_2fa.pk}: 2段階認証が必要です', err)
+        self.assertIn(f'ユーザー{missing_device.pk}: デバイス "iPad" が見つかりません', err)
+        self.assertEqual(UserLocation.objects.count(), 1)
+
+
+    def test_bounds_pending_requests(self):
+        for i in range(6):
+            self.tracked_user(f'user{i}')
+        fetch = iCloudLocationService.fetch_device_location
+
+        def slow_fetch(service, user):
+            time_module.sleep(0.02)
+            return fetch(service, user)
+
+        submitted, outstanding = [], []
+        submit = ThreadPoolExecutor.submit
+
+        def record_submit(executor, fn, *args, **kwargs):
+            outstanding.append(sum(not future.done() for future in submitted))
+            future = submit(executor, fn, *args, **kwargs)
+            submitted.append(future)
+            return future
+
+        with mock.patch.object(iCloudLocationService, 'fetch_device_location', autospec=True, side_effect=slow_fetch), \
+                mock.patch.object(ThreadPoolExecutor, 'submit', autospec=True, side_effect=record_submit):
+            out = io.StringIO()
+            call_command('poll_icloud_locations', '--workers', '1', stdout=out, stderr=io.StringIO())
+        self.assertIn('6ユーザー中 6件取得', out.getvalue())
+        # ワーカー1つなら未完了は2件まで（次を渡す時点では1件以下）
+        self.assertEqual(len(outstanding), 6)
+        self.assertLessEqual(max(outstanding), 1)
+
+    def test_connection_check_and_2fa_use_pooled_session(self):
+        cookie_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cookie_dir)
+        self.tracked_user('hanako', requires_2fa=True, code='123456')
+        service = iCloudLocationService(session_pool=iCloudSessionPool(cookie_directory=cookie_dir))
+
+        result = service.test_icloud_connection('hanako@icloud.com', 'app-specific-password')
+        self.assertTrue(result['requires_2fa'])
+        self.assertFalse(service.verify_2fa_code('hanako@icloud.com', 'app-specific-password', '000000')['success'])
+        self.assertTrue(service.verify_2fa_code('hanako@icloud.com', 'app-specific-password', '123456')['success'])
+        devices = service.get_available_devices('hanako@icloud.com', 'app-specific-password')
+        self.assertEqual([device['name'] for device in devices['devices']], ['iPhone'])
+
+        # 2FAを要求したセッションでコードを検証し、Cookieはプールの保存先に置く
+        self.assertEqual(FakeiCloudService.logins, [('hanako@icloud.com', os.path.join(cookie_dir, 'hanako@icloud.com'))])
+
+        result = service.test_icloud_connection('hanako@icloud.com', 'wrong-password')
+        self.assertFalse(result['success'])
+        self.assertEqual(len(service.session_pool), 0)
+
+
+class LazyImportTests(SimpleTestCase):
+    """ワーカー起動（setup＋URLconf読み込み）で重いSDKを読み込まないこと"""
+    # requestsはDRF（rest_framework.compat）が読み込むので対象外
+    LAZY_MODULES = ('stripe', 'google.auth', 'pyicloud_ipd', 'cryptography.fernet', 'geopy')
+
+    def test_startup_does_not_import_sdks(self):
+        probe = (
+            'import importlib, json, sys, django\n'
+            'django.setup()\n'
+            'from django.conf import settings\n'
+            'importlib.import_module(settings.ROOT_URLCONF)\n'
+            f'print(json.dumps([name for name in {self.LAZY_MODULES!r} if name in sys.modules]))\n'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'location_reminder.settings'))
+        result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, env=env,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout.splitlines()[-1]), [])
+
+
+class UserLocationMigrationTests(TransactionTestCase):
+    """0007: User上の位置情報をUserLocationへ移すデータ移行"""
+    before = [('accounts', '0006_user_google_id_user_google_picture_and_more')]
+    after = [('accounts', '0007_userlocation')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # 最新の状態に戻す
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_forward_and_backward(self):
+        apps = self.migrate(self.before)
+        OldUser = apps.get_model('accounts', 'User')
+        updated = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        located = OldUser.objects.create(username='located', email='located@example.com',
+                                         last_known_latitude='35.681236', last_known_longitude='139.767125',
+                                         last_location_update=updated)
+        # 位置の更新時刻がない場合はupdated_atを使う
+        untimed = OldUser.objects.create(username='untimed', email='untimed@example.com',
+                                         last_known_latitude='34.702485', last_known_longitude='135.495951')
+        OldUser.objects.create(username='nowhere', email='nowhere@example.com')
+
+        apps = self.migrate(self.after)
+        locations = {row.user_id: row for row in apps.get_model('accounts', 'UserLocation').objects.all()}
+        self.assertEqual(set(locations), {located.pk, untimed.pk})
+        self.assertAlmostEqual(locations[located.pk].latitude, 35.681236)
+        self.assertAlmostEqual(locations[located.pk].longitude, 139.767125)
+        self.assertEqual(locations[located.pk].updated_at, updated)
+        self.assertEqual(locations[untimed.pk].updated_at, untimed.updated_at)
+
+        apps = self.migrate(self.before)
+        restored = apps.get_model('accounts', 'User').objects.get(pk=located.pk)
+        self.assertAlmostEqual(float(restored.last_known_latitude), 35.681236)
+        self.assertEqual(restored.last_location_update, updated)
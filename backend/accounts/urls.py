@@ -1,22 +1,29 @@
 # accounts/urls.py
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
+    path('logout/', views.logout_view, name='logout'),
     path('profile/', views.profile, name='profile'),
     path('verify-email/<uuid:token>/', views.verify_email, name='verify_email'),
     path('resend-verification/', views.resend_verification_email, name='resend_verification'),
     path('request-password-reset/', views.request_password_reset, name='request_password_reset'),
     path('reset-password/<uuid:token>/', views.reset_password, name='reset_password'),
     
+    # ASGI向けの非同期版（パスワードのハッシュ計算を専用スレッドプールで実行）
+    path('async/register/', async_views.async_register, name='async_register'),
+    path('async/login/', async_views.async_login, name='async_login'),
+    
     # Google認証
     path('google/', views.google_auth, name='google_auth'),
     
     # React Native位置情報API
     path('location/update/', views.update_location, name='update_location'),
     path('location/get/', views.get_location, name='get_location'),
+    path('location/history/', views.location_history, name='location_history'),
+    path('location/visits/', views.visit_timeline, name='visit_timeline'),
     
     # 接続テスト用
     path('test/', views.api_test, name='api_test'),
@@ -1,18 +1,18 @@
 # accounts/utils.py
-from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.urls import reverse
 from django.utils import timezone
+from .email_outbox import enqueue_email
+
+# 送信はアウトボックス経由（send_queued_emailsコマンドが送る）
 
 def send_verification_email(user, request):
-    """メール認証用のメールを送信"""
+    """メール認証用のメールを送信キューに登録"""
     
-    print(f"=== メール送信開始 ===")
+    print(f"=== メール登録開始 ===")
     print(f"宛先: {user.email}")
-    print(f"送信者: {settings.DEFAULT_FROM_EMAIL}")
-    print(f"SMTP設定: {settings.EMAIL_HOST}:{settings.EMAIL_PORT}")
     print(f"認証トークン: {user.email_verification_token}")
     
     # トークンが存在することを確認
@@ -64,29 +64,16 @@ def send_verification_email(user, request):
 位置リマインダーアプリ運営チーム
     """
     
-    try:
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-        
-        # 送信時刻を記録
-        user.email_verification_sent_at = timezone.now()
-        user.save()
-        
-        return True
-    except Exception as e:
-        print(f"メール送信エラー詳細: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    enqueue_email('verification', user.email, subject, plain_message, html_message, user=user)
+    
+    # 送信時刻を記録
+    user.email_verification_sent_at = timezone.now()
+    user.save(update_fields=['email_verification_sent_at'])
+    
+    return True
 
 def send_welcome_email(user):
-    """認証完了後のウェルカムメール"""
+    """認証完了後のウェルカムメールを送信キューに登録"""
     
     subject = "【位置リマインダーアプリ】登録完了のお知らせ"
     
@@ -118,24 +105,11 @@ def send_welcome_email(user):
 位置リマインダーアプリ運営チーム
     """
     
-    try:
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-        return True
-    except Exception as e:
-        print(f"ウェルカムメール送信エラー詳細: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    enqueue_email('welcome', user.email, subject, plain_message, html_message, user=user)
+    return True
 
 def send_password_reset_email(user, request):
-    """パスワードリセット用のメールを送信"""
+    """パスワードリセット用のメールを送信キューに登録"""
     
     # パスワードリセットURL（フロントエンド用）
     reset_url = f"{settings.FRONTEND_URL}/reset-password/{user.password_reset_token}/"
@@ -180,23 +154,10 @@ def send_password_reset_email(user, request):
 位置リマインダーアプリ運営チーム
     """
     
-    try:
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-        
-        # 送信時刻を記録
-        user.password_reset_sent_at = timezone.now()
-        user.save()
-        
-        return True
-    except Exception as e:
-        print(f"パスワードリセットメール送信エラー詳細: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
\ No newline at end of file
+    enqueue_email('password_reset', user.email, subject, plain_message, html_message, user=user)
+    
+    # 送信時刻を記録
+    user.password_reset_sent_at = timezone.now()
+    user.save(update_fields=['password_reset_sent_at'])
+    
+    return True
\ No newline at end of file
@@ -5,15 +5,19 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import login
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer
-from .models import User
+from django.utils.dateparse import parse_datetime
+from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer, VisitSerializer
+from .models import User, UserLocation, Visit
+from .location_buffer import LocationFix, location_buffer
+from .location_history import day_bounds, iter_history
+from reminders.pagination import KeysetPagination
 from .utils import send_verification_email, send_welcome_email, send_password_reset_email
 from django.contrib.auth.password_validation import validate_password
-from django.core.exceptions import ValidationError
-from google.auth.transport import requests
-from google.oauth2 import id_token
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from .google_auth import GoogleCertsUnavailable, GoogleTokenError, verify_google_id_token
 import logging
 import random
 import string
@@ -29,13 +33,13 @@ def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
         print("シリアライザー検証成功")
-        user = serializer.save()
-        print(f"ユーザー作成完了: {user.email}, トークン: {user.email_verification_token}")
-        
-        # 認証メールを送信
-        print("認証メール送信開始...")
-        mail_sent = send_verification_email(user, request)
-        print(f"メール送信結果: {mail_sent}")
+        with transaction.atomic():
+            user = serializer.save()
+            print(f"ユーザー作成完了: {user.email}, トークン: {user.email_verification_token}")
+            
+            # 認証メールを送信キューに登録
+            mail_sent = send_verification_email(user, request)
+        print(f"メール登録結果: {mail_sent}")
         
         if mail_sent:
             return Response({
@@ -76,9 +80,17 @@ def login_view(request):
         })
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def logout_view(request):
+    """トークンを削除してログアウト（認証キャッシュはシグナルで破棄）"""
+    Token.objects.filter(user=request.user).delete()
+    return Response({'message': 'ログアウトしました。'})
+
 @api_view(['GET'])
 def profile(request):
-    serializer = UserSerializer(request.user)
+    # request.userは認証キャッシュのスナップショットなので、表示するフィールドはDBから読む
+    serializer = UserSerializer(User.objects.get(pk=request.user.pk))
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -100,12 +112,11 @@ def verify_email(request, token):
                 'expired': True
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # メール認証を完了
-        user.is_email_verified = True
-        user.save()
-        
-        # ウェルカムメールを送信
-        send_welcome_email(user)
+        # メール認証を完了し、ウェルカムメールを送信キューに登録
+        with transaction.atomic():
+            user.is_email_verified = True
+            user.save()
+            send_welcome_email(user)
         
         return Response({
             'message': 'メールアドレスの認証が完了しました。ログインしてアプリをご利用ください。',
@@ -136,10 +147,12 @@ def resend_verification_email(request):
                 'message': 'このメールアドレスは既に認証済みです。'
             })
         
-        # 新しいトークンを生成してメール送信
-        user.generate_new_verification_token()
+        # 新しいトークンを生成してメールを送信キューに登録
+        with transaction.atomic():
+            user.generate_new_verification_token()
+            mail_sent = send_verification_email(user, request)
         
-        if send_verification_email(user, request):
+        if mail_sent:
             return Response({
                 'message': '認証メールを再送信しました。メールをご確認ください。'
             })
@@ -174,10 +187,12 @@ def request_password_reset(request):
                 'requires_verification': True
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # パスワードリセットトークンを生成
-        user.generate_password_reset_token()
+        # パスワードリセットトークンを生成してメールを送信キューに登録
+        with transaction.atomic():
+            user.generate_password_reset_token()
+            mail_sent = send_password_reset_email(user, request)
         
-        if send_password_reset_email(user, request):
+        if mail_sent:
             return Response({
                 'message': 'パスワードリセット用のメールを送信しました。メールをご確認ください。'
             })
@@ -258,25 +273,37 @@ def update_location(request):
     latitude = request.data.get('latitude')
     longitude = request.data.get('longitude')
     accuracy = request.data.get('accuracy')
+    speed = request.data.get('speed')
     
     if not latitude or not longitude:
         return Response({
             'error': '緯度と経度が必要です。'
         }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        fix = LocationFix(
+            float(latitude),
+            float(longitude),
+            timezone.now(),
+            accuracy=float(accuracy) if accuracy not in (None, '') else None,
+            speed=float(speed) if speed not in (None, '') else None,
+        )
+    except (TypeError, ValueError):
+        return Response({
+            'error': '無効な緯度経度です。'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    # 位置情報を更新
-    user.last_known_latitude = latitude
-    user.last_known_longitude = longitude
-    user.last_location_update = timezone.now()
-    user.save()
+    # 意味のある移動だけをバッファに積み、UserLocationへまとめて書き込む（User行は更新しない）
+    accepted = location_buffer.offer(user.pk, fix)
     
     return Response({
-        'message': '位置情報が更新されました。',
+        'message': '位置情報が更新されました。' if accepted else '前回位置からの移動が小さいため更新を省略しました。',
+        'accepted': accepted,
         'location': {
             'latitude': latitude,
             'longitude': longitude,
             'accuracy': accuracy,
-            'timestamp': user.last_location_update
+            'timestamp': fix.timestamp
         }
     })
 
@@ -285,39 +312,131 @@ def update_location(request):
 def get_location(request):
     """現在の位置情報を取得"""
     user = request.user
+
+    # このプロセスに未書き込みの位置があればそちらが最新
+    # （別のワーカーが受け取った位置はLOCATION_BUFFER_FLUSH_INTERVAL秒以内にDBへ書かれる）
+    fix = location_buffer.get(user.pk)
+    if fix is not None:
+        return Response({
+            'location': {
+                'latitude': fix.latitude,
+                'longitude': fix.longitude,
+                'timestamp': fix.timestamp
+            }
+        })
     
-    if not user.last_known_latitude or not user.last_known_longitude:
+    location = UserLocation.objects.filter(user=user).first()
+    if location is None:
         return Response({
             'error': '位置情報が設定されていません。'
         }, status=status.HTTP_404_NOT_FOUND)
     
     return Response({
         'location': {
-            'latitude': float(user.last_known_latitude),
-            'longitude': float(user.last_known_longitude),
-            'timestamp': user.last_location_update
+            'latitude': location.latitude,
+            'longitude': location.longitude,
+            'timestamp': location.updated_at
         }
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def location_history(request):
+    """位置履歴を取得（start/endはISO 8601、省略時は今日）"""
+    start_param = request.GET.get('start')
+    end_param = request.GET.get('end')
+    start, end = day_bounds(timezone.localdate())
+    try:
+        if start_param:
+            start = parse_datetime(start_param)
+        if end_param:
+            end = parse_datetime(end_param)
+        limit = min(int(request.GET.get('limit', 5000)), 20000)
+    except ValueError:
+        start = None
+    if start is None or end is None:
+        return Response({
+            'error': '無効な期間指定です。'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+
+    points = []
+    truncated = False
+    for point in iter_history(request.user.pk, start, end):
+        if len(points) >= limit:
+            truncated = True
+            break
+        points.append({
+            'latitude': point.latitude,
+            'longitude': point.longitude,
+            'timestamp': point.time
+        })
+
+    return Response({
+        'points': points,
+        'truncated': truncated
+    })
+
+class VisitPagination(KeysetPagination):
+    time_field = 'arrived_at'
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def visit_timeline(request):
+    """滞在（来店）のタイムラインを新しい順に取得"""
+    visits = (
+        Visit.objects
+        .filter(user=request.user)
+        .select_related('store')
+        .only('id', 'store_id', 'latitude', 'longitude', 'arrived_at', 'departed_at',
+              'distance_to_store', 'store__name', 'store__store_type')
+    )
+    paginator = VisitPagination()
+    page = paginator.paginate_queryset(visits, request)
+    return paginator.get_paginated_response(VisitSerializer(page, many=True).data)
+
 # Google認証エンドポイント
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def google_auth(request):
-    """Google認証でログインまたは新規登録"""
-    access_token = request.data.get('access_token')
-    email = request.data.get('email')
-    first_name = request.data.get('first_name', '')
-    last_name = request.data.get('last_name', '')
-    google_id = request.data.get('google_id')
-    picture = request.data.get('picture', '')
+    """GoogleのIDトークンを検証してログインまたは新規登録"""
+    raw_id_token = request.data.get('id_token')
     
-    if not access_token or not email or not google_id:
+    if not raw_id_token:
         return Response({
-            'error': 'access_token、email、google_idが必要です。'
+            'error': 'id_tokenが必要です。'
         }, status=status.HTTP_400_BAD_REQUEST)
     
+    # ユーザー情報はクライアントの送信値ではなく、検証済みのクレームから取る
+    try:
+        claims = verify_google_id_token(raw_id_token)
+    except ImproperlyConfigured as e:
+        # GOOGLE_CLIENT_IDS未設定。トークンの対象を確認できないので受け付けない
+        logger.error(f"Google認証の設定エラー: {e}")
+        return Response({
+            'error': 'Google認証は現在利用できません。'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except GoogleCertsUnavailable as e:
+        logger.error(f"Google証明書取得エラー: {e}")
+        return Response({
+            'error': 'Google認証を一時的に利用できません。しばらく後でお試しください。'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except GoogleTokenError as e:
+        logger.warning(f"GoogleのIDトークン検証失敗: {e}")
+        return Response({
+            'error': 'GoogleのIDトークンが無効です。'
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    
+    email = claims['email']
+    google_id = claims['sub']
+    first_name = claims.get('given_name', '')
+    last_name = claims.get('family_name', '')
+    picture = claims.get('picture', '')
+    
     try:
-        # Googleトークンの検証（簡易版 - 本番では厳密な検証が必要）
         logger.info(f"Google認証試行: {email}")
         
         # 既存のGoogleユーザーをチェック
@@ -373,22 +492,23 @@ def google_auth(request):
                 # ランダムパスワードを生成（Google認証ユーザーは使用しない）
                 random_password = ''.join(random.choices(string.ascii_letters + string.digits, k=20))
                 
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                    password=random_password,
-                    google_id=google_id,
-                    google_picture=picture,
-                    is_google_user=True,
-                    is_email_verified=True  # Googleアカウントは認証済み
-                )
-                
-                logger.info(f"新規Googleユーザー作成: {user.email}")
-                
-                # ウェルカムメールを送信
-                send_welcome_email(user)
+                with transaction.atomic():
+                    user = User.objects.create_user(
+                        username=username,
+                        email=email,
+                        first_name=first_name,
+                        last_name=last_name,
+                        password=random_password,
+                        google_id=google_id,
+                        google_picture=picture,
+                        is_google_user=True,
+                        is_email_verified=True  # Googleアカウントは認証済み
+                    )
+                    
+                    logger.info(f"新規Googleユーザー作成: {user.email}")
+                    
+                    # ウェルカムメールを送信キューに登録
+                    send_welcome_email(user)
                 
                 # 認証トークンを生成
                 token, created = Token.objects.get_or_create(user=user)
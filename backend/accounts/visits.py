@@ -0,0 +1,135 @@
+# accounts/visits.py
+from datetime import timedelta
+from math import asin, cos, radians, sin, sqrt
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from stores.models import Store
+from .location_history import COORD_SCALE, iter_history
+from .models import Visit
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lat2 = radians(lat1), radians(lat2)
+    dlat = lat2 - lat1
+    dlng = radians(lng2 - lng1)
+    h = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * asin(min(1.0, sqrt(h)))
+
+
+class StayPoint(NamedTuple):
+    latitude: float
+    longitude: float
+    arrived_at: object
+    departed_at: object
+    point_count: int
+
+
+class _Cluster:
+    """滞在候補の点の集まり（重心を逐次更新）"""
+
+    def __init__(self, point):
+        self.lat_sum = point.lat
+        self.lng_sum = point.lng
+        self.count = 1
+        self.first = point
+        self.last = point
+
+    @property
+    def latitude(self):
+        return self.lat_sum / self.count / COORD_SCALE
+
+    @property
+    def longitude(self):
+        return self.lng_sum / self.count / COORD_SCALE
+
+    def add(self, point):
+        self.lat_sum += point.lat
+        self.lng_sum += point.lng
+        self.count += 1
+        self.last = point
+
+    def to_stay(self):
+        return StayPoint(self.latitude, self.longitude, self.first.time, self.last.time, self.count)
+
+
+def detect_stay_points(points, radius=None, min_duration=None):
+    """
+    時刻順の点列から滞在を検出するジェネレータ（1パス、メモリは一定）。
+    重心からradius以内に収まり続けた時間がmin_duration秒以上なら滞在とみなす。
+    最後のクラスタは滞在中の可能性があるため出力しない。
+    """
+    if radius is None:
+        radius = settings.VISIT_STAY_RADIUS
+    if min_duration is None:
+        min_duration = settings.VISIT_MIN_DURATION
+
+    cluster = None
+    for point in points:
+        if cluster is None:
+            cluster = _Cluster(point)
+            continue
+        distance = _haversine(cluster.latitude, cluster.longitude,
+                              point.lat / COORD_SCALE, point.lng / COORD_SCALE)
+        if distance <= radius:
+            cluster.add(point)
+            continue
+        if cluster.last.timestamp - cluster.first.timestamp >= min_duration:
+            yield cluster.to_stay()
+        cluster = _Cluster(point)
+
+
+def nearest_store(latitude, longitude, max_distance=None):
+    """max_distance以内で最も近い店舗と距離を返す（なければ (None, None)）"""
+    if max_distance is None:
+        max_distance = settings.VISIT_STORE_RADIUS
+    lat_range = max_distance / 111000.0
+    lng_range = max_distance / (111000.0 * max(cos(radians(latitude)), 0.01))
+
+    best, best_distance = None, None
+    candidates = Store.objects.filter(
+        is_active=True,
+        latitude__range=(latitude - lat_range, latitude + lat_range),
+        longitude__range=(longitude - lng_range, longitude + lng_range),
+    ).only('id', 'latitude', 'longitude')
+    for store in candidates:
+        distance = _haversine(latitude, longitude, float(store.latitude), float(store.longitude))
+        if distance <= max_distance and (best_distance is None or distance < best_distance):
+            best, best_distance = store, distance
+    return best, best_distance
+
+
+def detect_visits_for_user(user_id, lookback=None, now=None):
+    """
+    最後に検出した滞在の出発時刻以降の位置履歴を読み、新しい滞在をVisitに書き込む。
+    同じ到着時刻の滞在は一意なので、再実行しても重複しない。
+    """
+    now = now or timezone.now()
+    if lookback is None:
+        lookback = timedelta(days=settings.VISIT_LOOKBACK_DAYS)
+
+    resume_from = Visit.objects.filter(user_id=user_id).aggregate(last=Max('departed_at'))['last']
+    # 前回の滞在の最後の点は含めない
+    start = max(resume_from + timedelta(seconds=1), now - lookback) if resume_from else now - lookback
+
+    visits = []
+    for stay in detect_stay_points(iter_history(user_id, start, now)):
+        store, distance = nearest_store(stay.latitude, stay.longitude)
+        visits.append(Visit(
+            user_id=user_id,
+            store=store,
+            latitude=stay.latitude,
+            longitude=stay.longitude,
+            arrived_at=stay.arrived_at,
+            departed_at=stay.departed_at,
+            point_count=stay.point_count,
+            distance_to_store=distance,
+        ))
+
+    Visit.objects.bulk_create(visits, ignore_conflicts=True)
+    return len(visits)
@@ -0,0 +1,47 @@
+# location_reminder/caches.py
+"""
+キャッシュがプロセス間で共有されているかの判定。
+
+トリガーセット・エンタイトルメント・トークン認証のキャッシュは、変更したワーカー以外にも
+無効化が届く必要がある。LocMemCacheはプロセスごとに別物なので、これらのキャッシュには使えない。
+"""
+from django.conf import settings
+from django.core import checks
+
+# プロセスごとに別の内容を持つバックエンド
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+# 読み書きのたびにDBへクエリを発行するバックエンド
+DATABASE_CACHE_BACKENDS = (
+    'django.core.cache.backends.db.DatabaseCache',
+)
+
+
+def is_shared_cache(alias='default'):
+    """キャッシュの内容が全ワーカーで共有されるか"""
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+    return backend not in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    """manage.py check・runserver・migrate時に、プロセス内キャッシュ・本番でのDBキャッシュの設定を検出する"""
+    if is_shared_cache():
+        backend = settings.CACHES.get('default', {}).get('BACKEND')
+        if backend in DATABASE_CACHE_BACKENDS and not settings.DEBUG:
+            return [
+                checks.Warning(
+                    'CACHES["default"] がDatabaseCacheです。キャッシュの読み書きのたびにDBへのクエリが発生します。',
+                    hint='本番ではREDIS_URLを設定してください。',
+                    id='location_reminder.W001',
+                )
+            ]
+        return []
+    return [
+        checks.Error(
+            'CACHES["default"] がプロセス内キャッシュ（LocMemCache）です。',
+            hint='REDIS_URLを設定するか、DatabaseCache（python manage.py createcachetable）を使ってください。',
+            id='location_reminder.E001',
+        )
+    ]
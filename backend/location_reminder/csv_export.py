@@ -0,0 +1,109 @@
+# location_reminder/csv_export.py
+"""
+管理画面からのCSVエクスポート。
+
+- values_list()（JOINした項目を含む）を .iterator(chunk_size) で読みながら1行ずつ書き出すので、
+  件数に関わらずメモリ使用量は一定で、最初のチャンクを読んだ時点でダウンロードが始まる
+- ModelAdminにCsvExportMixinを混ぜると、選択した行のエクスポート（アクション）と
+  現在の絞り込み条件でのエクスポート（一覧の「CSVエクスポート」ボタン、<changelist>/export/）が使える
+"""
+import csv
+import datetime
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.urls import path, reverse
+from django.utils import timezone
+
+# 表計算ソフトで開いたときに式として解釈される先頭文字
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """csv.writerの書き込み先（書いた行をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv_rows(queryset, columns, chunk_size=2000):
+    """ヘッダー行とデータ行をCSVの文字列として1行ずつ返す。columnsは (見出し, フィールドパス) のリスト"""
+    writer = csv.writer(_Echo())
+    # Excelで文字化けしないようBOMを付ける
+    yield '\ufeff' + writer.writerow([header for header, _ in columns])
+    rows = queryset.values_list(*[field for _, field in columns]).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield writer.writerow([_format(value) for value in row])
+
+
+def stream_csv(queryset, columns, filename, chunk_size=2000):
+    """querysetをCSVとしてストリーミングで返すレスポンス"""
+    response = StreamingHttpResponse(
+        iter_csv_rows(queryset, columns, chunk_size),
+        content_type='text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class CsvExportMixin:
+    """
+    ModelAdmin用のCSVエクスポート。
+    csv_export_columns に (見出し, フィールドパス) を並べる（'user__email' のようにJOINした項目も可）。
+    """
+    csv_export_columns = ()
+    csv_export_chunk_size = 2000
+    change_list_template = 'admin/csv_export_change_list.html'
+
+    def _csv_filename(self):
+        return f'{self.model._meta.model_name}_{timezone.localtime():%Y%m%d_%H%M%S}.csv'
+
+    def export_csv_response(self, queryset):
+        return stream_csv(queryset, self.csv_export_columns, self._csv_filename(), self.csv_export_chunk_size)
+
+    @admin.action(description='選択した行をCSVでエクスポート')
+    def export_csv(self, request, queryset):
+        return self.export_csv_response(queryset)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if self.has_view_permission(request):
+            actions['export_csv'] = self.get_action('export_csv')
+        return actions
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path('export/', self.admin_site.admin_view(self.export_changelist_view),
+                 name='%s_%s_export' % info),
+        ]
+        return urls + super().get_urls()
+
+    def export_changelist_view(self, request):
+        """一覧と同じ絞り込み・検索・並び順でエクスポート"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            info = self.model._meta.app_label, self.model._meta.model_name
+            return HttpResponseRedirect(reverse('admin:%s_%s_changelist' % info, current_app=self.admin_site.name) + '?e=1')
+        return self.export_csv_response(changelist.get_queryset(request))
@@ -0,0 +1,45 @@
+# location_reminder/paginators.py
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    大きなテーブルの管理画面用Paginator。
+    COUNT(*) で全件を数える代わりに、
+    - 絞り込みなしの一覧はテーブルの推定行数（PostgreSQLの統計情報、それ以外は主キーの最大値）を使い、
+    - 絞り込みありの一覧は ADMIN_EXACT_COUNT_LIMIT 件まで数えて打ち切る。
+    推定値が上限より小さければ正確に数える。
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        if not isinstance(queryset, models.QuerySet):
+            return super().count
+
+        if not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # 上限件数までのサブクエリを数えるので、コストは一致件数ではなく上限で決まる
+        return queryset.order_by()[:limit].count()
+
+    @staticmethod
+    def _estimate(queryset):
+        model = queryset.model
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+                row = cursor.fetchone()
+            # 一度もANALYZEされていないテーブルは-1（PostgreSQL 14以降）
+            return int(row[0]) if row and row[0] >= 0 else None
+        if isinstance(model._meta.pk, models.AutoField):
+            # 主キーのインデックスの末尾を読むだけ（削除された行の分だけ多めになる）
+            return queryset.model._default_manager.using(queryset.db).aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        return None
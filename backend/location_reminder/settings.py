@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -63,7 +63,7 @@ ROOT_URLCONF = "location_reminder.urls"
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [BASE_DIR / 'templates'],  # アプリに属さない共通テンプレート（管理画面のCSVエクスポート等）
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -91,6 +91,30 @@ DATABASES = {
 }
 
 
+# キャッシュ
+# トリガーセット等の無効化を全ワーカーに届けるため、プロセス間で共有されるバックエンドを使う
+# （LocMemCacheは location_reminder.E001 のエラーになる）
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    # Redisがない環境（開発・小規模運用）ではDBのキャッシュテーブルを使う。
+    # テーブルはmigrate（reminders.0008）で作成される。読み書きごとにクエリが発生するため、
+    # 本番ではREDIS_URLを設定する（未設定なら location_reminder.W001 の警告）
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache",
+            "OPTIONS": {"MAX_ENTRIES": config('CACHE_MAX_ENTRIES', default=100000, cast=int)},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -164,7 +188,7 @@ LOGGING = {
 # REST Framework設定
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -177,20 +201,120 @@ REST_FRAMEWORK = {
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY', default='')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+STRIPE_WEBHOOK_TOLERANCE = config('STRIPE_WEBHOOK_TOLERANCE', default=300, cast=int)  # 署名の許容時刻差（秒）
+STRIPE_EVENT_MAX_ATTEMPTS = config('STRIPE_EVENT_MAX_ATTEMPTS', default=8, cast=int)
+STRIPE_PREMIUM_PRICE_ID = config('STRIPE_PREMIUM_PRICE_ID', default='price_premium_monthly')
+# Stripe APIクライアント（subscriptions/stripe_client.py）
+STRIPE_BACKEND = config('STRIPE_BACKEND', default='subscriptions.stripe_client.HttpBackend')  # テストではFakeStripeBackend
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)  # 使い回す接続数
+STRIPE_TIMEOUT = config('STRIPE_TIMEOUT', default=5.0, cast=float)  # 1回の試行のタイムアウト（秒）
+STRIPE_DEADLINE = config('STRIPE_DEADLINE', default=15.0, cast=float)  # 再試行を含めた1呼び出しの期限（秒）
+STRIPE_MAX_RETRIES = config('STRIPE_MAX_RETRIES', default=2, cast=int)
+STRIPE_RETRY_BASE_DELAY = config('STRIPE_RETRY_BASE_DELAY', default=0.5, cast=float)
+STRIPE_RETRY_MAX_DELAY = config('STRIPE_RETRY_MAX_DELAY', default=4.0, cast=float)
+STRIPE_CIRCUIT_FAILURES = config('STRIPE_CIRCUIT_FAILURES', default=5, cast=int)  # 連続失敗でブレーカーを開く回数
+STRIPE_CIRCUIT_RESET = config('STRIPE_CIRCUIT_RESET', default=30.0, cast=float)  # ブレーカーを開いておく秒数
+
+# エンタイトルメント（プラン・利用上限）のプロセス内キャッシュ
+ENTITLEMENT_LOCAL_TTL = config('ENTITLEMENT_LOCAL_TTL', default=10.0, cast=float)  # 他プロセスでの変更が反映されるまでの最大秒数
+ENTITLEMENT_LOCAL_SIZE = config('ENTITLEMENT_LOCAL_SIZE', default=10000, cast=int)
+# プランごとの利用上限（0は無制限）。既存のリマインダーにも適用されるので、下げる前に利用者へ告知すること
+PLAN_LIMITS = {
+    'free': {
+        'max_active_reminders': config('FREE_MAX_ACTIVE_REMINDERS', default=0, cast=int),
+        'max_trigger_distance': config('FREE_MAX_TRIGGER_DISTANCE', default=0, cast=int),  # メートル単位
+    },
+    'premium': {
+        'max_active_reminders': config('PREMIUM_MAX_ACTIVE_REMINDERS', default=0, cast=int),
+        'max_trigger_distance': config('PREMIUM_MAX_TRIGGER_DISTANCE', default=0, cast=int),
+    },
+}
 
 # メール設定
 # EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # 開発時はコンソール出力
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'  # Gmail送信用
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
 EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
-EMAIL_USE_TLS = True
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@location-reminder.com')
 
+# リマインダーログの保持日数（これより古いログは日次集計に畳み込んで削除）
+REMINDER_LOG_RETENTION_DAYS = config('REMINDER_LOG_RETENTION_DAYS', default=90, cast=int)
+
+# 位置情報ライトビハインドバッファ（秒・件数）
+LOCATION_BUFFER_FLUSH_INTERVAL = config('LOCATION_BUFFER_FLUSH_INTERVAL', default=5.0, cast=float)
+LOCATION_BUFFER_MAX_PENDING = config('LOCATION_BUFFER_MAX_PENDING', default=1000, cast=int)
+
+# 位置情報の移動しきい値（これ未満の移動・間隔の位置はDBに書かない）
+LOCATION_MIN_DISTANCE = config('LOCATION_MIN_DISTANCE', default=3.0, cast=float)  # メートル
+LOCATION_MIN_INTERVAL = config('LOCATION_MIN_INTERVAL', default=2.0, cast=float)  # 秒
+LOCATION_HEARTBEAT_INTERVAL = config('LOCATION_HEARTBEAT_INTERVAL', default=300.0, cast=float)  # 秒
+
+# 位置履歴の間引き許容誤差（Douglas–Peucker法、メートル）
+LOCATION_HISTORY_TOLERANCE = config('LOCATION_HISTORY_TOLERANCE', default=10.0, cast=float)
+
+# 滞在（来店）検出
+VISIT_STAY_RADIUS = config('VISIT_STAY_RADIUS', default=50.0, cast=float)  # メートル
+VISIT_MIN_DURATION = config('VISIT_MIN_DURATION', default=300, cast=int)  # 秒
+VISIT_STORE_RADIUS = config('VISIT_STORE_RADIUS', default=50.0, cast=float)  # メートル
+VISIT_LOOKBACK_DAYS = config('VISIT_LOOKBACK_DAYS', default=2, cast=int)
+
+# トークン認証キャッシュ（秒）
+TOKEN_AUTH_CACHE_TTL = config('TOKEN_AUTH_CACHE_TTL', default=300, cast=int)
+TOKEN_AUTH_LOCAL_TTL = config('TOKEN_AUTH_LOCAL_TTL', default=10.0, cast=float)
+TOKEN_AUTH_LOCAL_SIZE = config('TOKEN_AUTH_LOCAL_SIZE', default=10000, cast=int)
+
+# メールアウトボックス（send_queued_emailsコマンド）
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+EMAIL_OUTBOX_RETRY_BASE = config('EMAIL_OUTBOX_RETRY_BASE', default=30, cast=int)  # 秒
+EMAIL_OUTBOX_RETRY_MAX = config('EMAIL_OUTBOX_RETRY_MAX', default=3600, cast=int)  # 秒
+EMAIL_OUTBOX_LEASE_SECONDS = config('EMAIL_OUTBOX_LEASE_SECONDS', default=300, cast=int)
+
+# お知らせメールの一斉送信（send_campaignコマンド）
+EMAIL_CAMPAIGN_CONNECTIONS = config('EMAIL_CAMPAIGN_CONNECTIONS', default=3, cast=int)
+EMAIL_CAMPAIGN_RATE = config('EMAIL_CAMPAIGN_RATE', default=10.0, cast=float)  # 通/秒
+# SMTP接続の障害時に同じメールを送り直す回数と、最初の待ち時間（秒、回ごとに倍）。超えたら送信を中断する
+EMAIL_CAMPAIGN_CONNECTION_RETRIES = config('EMAIL_CAMPAIGN_CONNECTION_RETRIES', default=3, cast=int)
+EMAIL_CAMPAIGN_RETRY_DELAY = config('EMAIL_CAMPAIGN_RETRY_DELAY', default=5.0, cast=float)
+
+# GoogleのIDトークン検証
+GOOGLE_CLIENT_IDS = config('GOOGLE_CLIENT_IDS', default='', cast=Csv())  # 受け付けるOAuthクライアントID（カンマ区切り）
+GOOGLE_OAUTH2_CERTS_URL = config('GOOGLE_OAUTH2_CERTS_URL', default='https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_CERTS_DEFAULT_TTL = config('GOOGLE_CERTS_DEFAULT_TTL', default=3600, cast=int)  # キャッシュヘッダがない場合（秒）
+GOOGLE_CERTS_MIN_REFRESH = config('GOOGLE_CERTS_MIN_REFRESH', default=60, cast=int)  # 再取得の最短間隔（秒）
+GOOGLE_CERTS_TIMEOUT = config('GOOGLE_CERTS_TIMEOUT', default=5.0, cast=float)
+GOOGLE_TOKEN_CLOCK_SKEW = config('GOOGLE_TOKEN_CLOCK_SKEW', default=30, cast=int)
+
+# 非同期ログイン・登録（accounts/async_views.py）
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=4, cast=int)  # ハッシュ計算の同時実行数
+AUTH_MAX_CONCURRENT_PER_IP = config('AUTH_MAX_CONCURRENT_PER_IP', default=4, cast=int)
+# 前段のリバースプロキシの段数。0ならREMOTE_ADDR、1以上ならX-Forwarded-Forの右からこの段数目をクライアントIPとする
+AUTH_TRUSTED_PROXY_COUNT = config('AUTH_TRUSTED_PROXY_COUNT', default=0, cast=int)
+
+# iCloud位置情報のセッションプール・ポーリング
+ICLOUD_ENCRYPTION_KEY = config('ICLOUD_ENCRYPTION_KEY', default='')  # iCloudパスワード暗号化用のFernetキー（全プロセス共通）
+ICLOUD_CLIENT_FACTORY = config('ICLOUD_CLIENT_FACTORY', default='pyicloud_ipd.PyiCloudService')
+ICLOUD_COOKIE_DIR = config('ICLOUD_COOKIE_DIR', default='')  # 空ならpyicloudの既定（一時ディレクトリ配下）
+ICLOUD_SESSION_IDLE_TIMEOUT = config('ICLOUD_SESSION_IDLE_TIMEOUT', default=1800, cast=int)  # 秒
+ICLOUD_POLL_WORKERS = config('ICLOUD_POLL_WORKERS', default=8, cast=int)
+
+# 管理画面の一覧の件数表示（これより多い件数は数えず推定値・上限値を表示する）
+ADMIN_EXACT_COUNT_LIMIT = config('ADMIN_EXACT_COUNT_LIMIT', default=10000, cast=int)
+
+# 管理画面の店舗マップ（このズーム以上で個別の店舗を表示。範囲内がSTORE_MAP_MAX_POINTSを超えたら集計表示）
+STORE_MAP_CLUSTER_MAX_ZOOM = config('STORE_MAP_CLUSTER_MAX_ZOOM', default=14, cast=int)
+STORE_MAP_MAX_POINTS = config('STORE_MAP_MAX_POINTS', default=2000, cast=int)
+
 # フロントエンドURL
 FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:3000')
 
 # カスタムユーザーモデル
 AUTH_USER_MODEL = 'accounts.User'
 
+# ModelBackendと同じ認証（非同期版ではハッシュ計算を専用スレッドプールで行う）
+AUTHENTICATION_BACKENDS = ['accounts.backends.PooledHashingModelBackend']
+
@@ -1,8 +1,12 @@
 # reminders/admin.py
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Q
-from .models import Reminder, ReminderLog
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from location_reminder.csv_export import CsvExportMixin
+from location_reminder.paginators import EstimatedCountPaginator
+from .counters import rebuild_user_stats
+from .models import Reminder, ReminderLog, ReminderLogDailyRollup
 
 @admin.register(Reminder)
 class ReminderAdmin(admin.ModelAdmin):
@@ -34,6 +38,11 @@ class ReminderAdmin(admin.ModelAdmin):
     list_editable = ('is_active',)
     
     ordering = ('-created_at',)
+
+    # 一覧の行ごとにユーザー・件数を読まない、全件のCOUNT(*)をしない
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('基本情報', {
@@ -53,6 +62,20 @@ class ReminderAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ('last_triggered', 'created_at', 'updated_at', 'trigger_log_count')
+
+    def get_queryset(self, request):
+        # ログ件数は表示する行についてだけ数える相関サブクエリにする（JOIN＋GROUP BYで全件を集計しない）
+        log_counts = (
+            ReminderLog.objects
+            .filter(reminder=OuterRef('pk'))
+            .order_by()
+            .values('reminder')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return super().get_queryset(request).annotate(
+            _trigger_log_count=Coalesce(Subquery(log_counts), 0)
+        )
     
     def user_display(self, obj):
         """ユーザー情報を表示"""
@@ -82,7 +105,7 @@ class ReminderAdmin(admin.ModelAdmin):
     
     def trigger_log_count(self, obj):
         """トリガーログ数を表示"""
-        count = obj.reminderlog_set.count()
+        count = obj._trigger_log_count
         if count > 0:
             return format_html(
                 '<a href="/admin/reminders/reminderlog/?reminder__id__exact={}">{} 件</a>',
@@ -91,9 +114,10 @@ class ReminderAdmin(admin.ModelAdmin):
             )
         return '0 件'
     trigger_log_count.short_description = '実行履歴'
+    trigger_log_count.admin_order_field = '_trigger_log_count'
 
 @admin.register(ReminderLog)
-class ReminderLogAdmin(admin.ModelAdmin):
+class ReminderLogAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'reminder_title_display',
         'user_display',
@@ -114,6 +138,25 @@ class ReminderLogAdmin(admin.ModelAdmin):
     )
     
     ordering = ('-triggered_at',)
+
+    # 一覧の行ごとにリマインダー・ユーザーを読まない、全件のCOUNT(*)をしない
+    list_select_related = ('reminder__user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    csv_export_columns = (
+        ('ID', 'id'),
+        ('トリガー日時', 'triggered_at'),
+        ('リマインダーID', 'reminder_id'),
+        ('リマインダー', 'reminder__title'),
+        ('店舗タイプ', 'reminder__store_type'),
+        ('ユーザーID', 'reminder__user_id'),
+        ('ユーザー名', 'reminder__user__username'),
+        ('メールアドレス', 'reminder__user__email'),
+        ('緯度', 'user_latitude'),
+        ('経度', 'user_longitude'),
+        ('店舗までの距離(m)', 'distance_to_store'),
+    )
     
     readonly_fields = (
         'reminder',
@@ -131,6 +174,18 @@ class ReminderLogAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         """ログは変更不可"""
         return False
+
+    def delete_model(self, request, obj):
+        """ログの削除はシグナルでカウンタに反映されないので、削除後に統計カウンタを作り直す"""
+        super().delete_model(request, obj)
+        rebuild_user_stats(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        """一括削除も同様に、対象ユーザーの統計カウンタを作り直す"""
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in sorted(user_ids):
+            rebuild_user_stats(user_id)
     
     def reminder_title_display(self, obj):
         """リマインダータイトルを表示"""
@@ -163,4 +218,27 @@ class ReminderLogAdmin(admin.ModelAdmin):
             '<a href="{}" target="_blank" class="button">ユーザー位置を確認</a>',
             url
         )
-    google_maps_link.short_description = 'ユーザー位置'
\ No newline at end of file
+    google_maps_link.short_description = 'ユーザー位置'
+
+@admin.register(ReminderLogDailyRollup)
+class ReminderLogDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('reminder', 'date', 'trigger_count', 'distance_avg_display', 'distance_min', 'distance_max')
+    list_filter = ('date', 'reminder__store_type')
+    search_fields = ('reminder__title', 'reminder__user__username')
+    list_select_related = ('reminder__user',)
+    ordering = ('-date',)
+
+    def has_add_permission(self, request):
+        """集計は追加不可"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """集計は変更不可"""
+        return False
+
+    def distance_avg_display(self, obj):
+        """平均距離を表示"""
+        if obj.distance_avg is None:
+            return '-'
+        return f'{obj.distance_avg:.1f}m'
+    distance_avg_display.short_description = '平均距離'
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class RemindersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "reminders"
+
+    def ready(self):
+        from location_reminder.caches import check_shared_cache
+        from . import signals  # noqa: F401
+
+        checks.register(check_shared_cache, checks.Tags.caches)
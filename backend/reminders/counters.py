@@ -0,0 +1,161 @@
+# reminders/counters.py
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .models import Reminder, ReminderLog, ReminderLogDailyRollup, ReminderStats
+
+
+def period_starts(day):
+    """日付から (当日, 週の開始日(月曜), 月の開始日) を返す"""
+    return day, day - timedelta(days=day.weekday()), day.replace(day=1)
+
+
+def _roll_periods(stats, today):
+    """起点日が古くなった期間カウンタを0に戻す"""
+    day, week_start, month_start = period_starts(today)
+    if stats.today != day:
+        stats.today, stats.triggers_today = day, 0
+    if stats.week_start != week_start:
+        stats.week_start, stats.triggers_week = week_start, 0
+    if stats.month_start != month_start:
+        stats.month_start, stats.triggers_month = month_start, 0
+
+
+def record_reminder_change(user_id, total_delta=0, active_delta=0, create_missing=True):
+    """リマインダー件数の増減を反映（呼び出し元のトランザクション内で実行）"""
+    if not total_delta and not active_delta:
+        return
+    updated = ReminderStats.objects.filter(user_id=user_id).update(
+        total_reminders=F('total_reminders') + total_delta,
+        active_reminders=F('active_reminders') + active_delta,
+    )
+    if not updated and create_missing:
+        # カウンタ行がまだない場合は現在のDBの状態から作る（今回の変更も含まれる）
+        rebuild_user_stats(user_id)
+
+
+def reminder_trigger_counts(reminder_id):
+    """リマインダーのトリガー件数 (全期間, 当日, 今週, 今月)。削除時にカウンタから引く分"""
+    day, week_start, month_start = period_starts(timezone.localdate())
+
+    def since(start):
+        return timezone.make_aware(datetime.combine(start, time.min))
+
+    raw = ReminderLog.objects.filter(reminder_id=reminder_id).aggregate(
+        total=Count('id'),
+        today=Count('id', filter=Q(triggered_at__gte=since(day))),
+        week=Count('id', filter=Q(triggered_at__gte=since(week_start))),
+        month=Count('id', filter=Q(triggered_at__gte=since(month_start))),
+    )
+    compacted = ReminderLogDailyRollup.objects.filter(reminder_id=reminder_id).aggregate(
+        total=Sum('trigger_count'),
+        today=Sum('trigger_count', filter=Q(date__gte=day)),
+        week=Sum('trigger_count', filter=Q(date__gte=week_start)),
+        month=Sum('trigger_count', filter=Q(date__gte=month_start)),
+    )
+    return tuple(raw[name] + (compacted[name] or 0) for name in ('total', 'today', 'week', 'month'))
+
+
+def record_reminder_delete(user_id, was_active, trigger_counts):
+    """
+    リマインダーの削除を反映（呼び出し元のトランザクション内で実行）。
+    ログ・日次集計もCASCADEで消えるので、そのトリガー件数も引く。
+    """
+    try:
+        stats = ReminderStats.objects.select_for_update().get(user_id=user_id)
+    except ReminderStats.DoesNotExist:
+        # ユーザーごと削除される場合はカウンタ行も消えるので作り直さない
+        return
+
+    _roll_periods(stats, timezone.localdate())
+    total, today, week, month = trigger_counts
+    stats.total_reminders = max(stats.total_reminders - 1, 0)
+    stats.active_reminders = max(stats.active_reminders - int(bool(was_active)), 0)
+    stats.total_triggers = max(stats.total_triggers - total, 0)
+    stats.triggers_today = max(stats.triggers_today - today, 0)
+    stats.triggers_week = max(stats.triggers_week - week, 0)
+    stats.triggers_month = max(stats.triggers_month - month, 0)
+    if stats.last_triggered_at is not None:
+        # 削除したリマインダーが最後のトリガーだった場合に備えて残りから求め直す
+        stats.last_triggered_at = Reminder.objects.filter(user_id=user_id).aggregate(
+            last_triggered=Max('last_triggered')
+        )['last_triggered']
+    stats.save()
+
+
+def record_triggers(user_id, count, triggered_at):
+    """トリガー発生を反映（呼び出し元のトランザクション内で実行）"""
+    try:
+        stats = ReminderStats.objects.select_for_update().get(user_id=user_id)
+    except ReminderStats.DoesNotExist:
+        rebuild_user_stats(user_id)
+        return
+
+    _roll_periods(stats, timezone.localdate())
+    stats.total_triggers += count
+    stats.triggers_today += count
+    stats.triggers_week += count
+    stats.triggers_month += count
+    if stats.last_triggered_at is None or triggered_at > stats.last_triggered_at:
+        stats.last_triggered_at = triggered_at
+    stats.save()
+
+
+def get_user_stats(user_id):
+    """統計カウンタを取得（主キー1件の読み取り、なければ再構築）"""
+    try:
+        stats = ReminderStats.objects.get(user_id=user_id)
+    except ReminderStats.DoesNotExist:
+        stats = rebuild_user_stats(user_id)
+    # 読み取り時点で期間が切り替わっていれば0として扱う（保存はしない）
+    _roll_periods(stats, timezone.localdate())
+    return stats
+
+
+def _trigger_count_since(user_id, since_date):
+    compacted = ReminderLogDailyRollup.objects.filter(
+        reminder__user_id=user_id, date__gte=since_date
+    ).aggregate(total=Sum('trigger_count'))['total'] or 0
+    since = timezone.make_aware(datetime.combine(since_date, time.min))
+    recent = ReminderLog.objects.filter(reminder__user_id=user_id, triggered_at__gte=since).count()
+    return compacted + recent
+
+
+@transaction.atomic
+def rebuild_user_stats(user_id):
+    """
+    リマインダー・日次集計・生ログから統計カウンタを作り直す。
+
+    増分更新はシグナルからしか行わないので、QuerySet.update()やシグナルを受けない
+    ReminderLogの削除（QuerySet.delete()、シェルからの一括削除など）の後は
+    rebuild_reminder_stats コマンドでこの関数を呼んで直す。
+    管理画面からのログ削除は ReminderLogAdmin が削除後にこの関数を呼ぶ。
+    ログ圧縮の削除は件数を日次集計に移すだけなので作り直し不要。
+    """
+    # カウンタ行を先に（なければ0件で）作ってから行ロックを取り、ロックを持ったまま数える。
+    # 同時に再構築・増分更新しても一意制約で衝突せず、古い集計値で上書きしない
+    ReminderStats.objects.bulk_create([ReminderStats(user_id=user_id)], ignore_conflicts=True)
+    stats = ReminderStats.objects.select_for_update().get(user_id=user_id)
+
+    reminders = Reminder.objects.filter(user_id=user_id).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        last_triggered=Max('last_triggered'),
+    )
+    day, week_start, month_start = period_starts(timezone.localdate())
+    compacted_total = ReminderLogDailyRollup.objects.filter(
+        reminder__user_id=user_id
+    ).aggregate(total=Sum('trigger_count'))['total'] or 0
+
+    stats.total_reminders = reminders['total']
+    stats.active_reminders = reminders['active']
+    stats.total_triggers = compacted_total + ReminderLog.objects.filter(reminder__user_id=user_id).count()
+    stats.today, stats.triggers_today = day, _trigger_count_since(user_id, day)
+    stats.week_start, stats.triggers_week = week_start, _trigger_count_since(user_id, week_start)
+    stats.month_start, stats.triggers_month = month_start, _trigger_count_since(user_id, month_start)
+    stats.last_triggered_at = reminders['last_triggered']
+    stats.save()
+    return stats
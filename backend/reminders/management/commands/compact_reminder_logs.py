@@ -0,0 +1,39 @@
+# reminders/management/commands/compact_reminder_logs.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reminders.rollups import compact_batch, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = '保持期間を過ぎたReminderLogを日次集計に畳み込み、少しずつ削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.REMINDER_LOG_RETENTION_DAYS,
+                            help='生ログを残す日数')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='1トランザクションで処理するログ件数')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='1回の実行で処理するバッチ数の上限')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='バッチ間の待機秒数（DB負荷の平準化用）')
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['retention_days'])
+        total = 0
+        batches = 0
+
+        while options['max_batches'] is None or batches < options['max_batches']:
+            processed = compact_batch(cutoff, options['batch_size'])
+            if not processed:
+                break
+            total += processed
+            batches += 1
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{cutoff:%Y-%m-%d}より前のログ{total}件を{batches}バッチで集計に移動しました'
+        ))
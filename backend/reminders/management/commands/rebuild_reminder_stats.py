@@ -0,0 +1,26 @@
+# reminders/management/commands/rebuild_reminder_stats.py
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from reminders.counters import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'リマインダー統計カウンタをリマインダー・集計・ログから作り直す（ログをQuerySetで直接削除した後などに実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='対象ユーザーID（複数指定可、省略時は全ユーザー）')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            User = get_user_model()
+            user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=1000)
+
+        count = 0
+        for user_id in user_ids:
+            rebuild_user_stats(user_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{count}ユーザーの統計カウンタを再構築しました'))
@@ -0,0 +1,187 @@
+# reminders/management/commands/sweep_triggers.py
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.location_buffer import location_buffer
+from accounts.models import UserLocation
+from reminders import sweep_worker
+from reminders.counters import record_reminder_change, record_triggers
+from reminders.models import Reminder, ReminderLog
+from reminders.triggers import COOLDOWN_SECONDS, invalidate_trigger_set
+from stores.models import Store
+from subscriptions.entitlements import get_entitlements_many
+
+
+class Command(BaseCommand):
+    help = '最近位置を送信した全ユーザーの有効なリマインダーをサーバー側で一括判定する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since-minutes', type=int, default=15,
+                            help='この分数以内に位置情報を更新したユーザーを対象にする')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='1チャンクあたりのユーザー数')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='ワーカープロセス数（1ならプロセスプールを使わない）')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='判定のみ行い、DBには書き込まない')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # このプロセスのバッファに残っている位置を先に書き込む。
+        # Webワーカーのバッファにある位置は最大LOCATION_BUFFER_FLUSH_INTERVAL秒遅れてDBに入るが、
+        # updated_atは位置の取得時刻なので、--since-minutesの範囲内なら次回の実行で判定される
+        location_buffer.flush()
+        now = timezone.now()
+        cutoff = now - timedelta(minutes=options['since_minutes'])
+        workers = max(1, options['workers'])
+        dry_run = options['dry_run']
+
+        store_index = sweep_worker.build_store_index(
+            Store.objects.values_list('store_type', 'latitude', 'longitude').iterator(chunk_size=2000)
+        )
+        chunks = self._iter_chunks(cutoff, now, options['chunk_size'])
+
+        user_count = 0
+        triggered_count = 0
+        # プランの上限で除外・距離を縮めたリマインダー数（_iter_chunksが数える）
+        self.over_limit_count = 0
+
+        def collect(chunk_size, results):
+            nonlocal user_count, triggered_count
+            user_count += chunk_size
+            if results and not dry_run:
+                triggered_count += self._write_results(results, now)
+            elif results:
+                triggered_count += len(results)
+
+        if workers == 1:
+            sweep_worker.init_worker(store_index)
+            for chunk in chunks:
+                collect(len(chunk), sweep_worker.evaluate_chunk(chunk))
+        else:
+            # ワーカーに親のDB接続を引き継がないようforkではなくspawnで起動
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=sweep_worker.init_worker,
+                                     initargs=(store_index,)) as executor:
+                pending = {}
+                for chunk in chunks:
+                    future = executor.submit(sweep_worker.evaluate_chunk, chunk)
+                    pending[future] = len(chunk)
+                    # 投入中のチャンク数を抑えてメモリを一定に保つ
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(pending.pop(future), future.result())
+                for future in list(pending):
+                    collect(pending.pop(future), future.result())
+
+        elapsed = time.perf_counter() - started
+        rate = user_count / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'{user_count}ユーザーを判定、{triggered_count}件トリガー、プラン上限超過{self.over_limit_count}件'
+            f'（{elapsed:.2f}秒, {rate:.1f} users/sec, workers={workers}'
+            f'{", dry-run" if dry_run else ""}）'
+        ))
+
+    def _iter_chunks(self, cutoff, now, chunk_size):
+        """対象ユーザーをチャンクに分け、クールダウン明けのリマインダーを添えて返す"""
+        users = (
+            UserLocation.objects
+            .filter(updated_at__gte=cutoff)
+            .order_by('user_id')
+            .values_list('user_id', 'latitude', 'longitude')
+            .iterator(chunk_size=chunk_size)
+        )
+        cooldown_cutoff = now - timedelta(seconds=COOLDOWN_SECONDS)
+
+        while True:
+            batch = list(islice(users, chunk_size))
+            if not batch:
+                return
+
+            # プランの上限（件数・距離）はクールダウン中のものも含めた新しい順で適用する
+            user_ids = [user_id for user_id, _, _ in batch]
+            entitlements = get_entitlements_many(user_ids)
+            entries = {}
+            seen = Counter()
+            reminders = (
+                Reminder.objects
+                .filter(user_id__in=user_ids, is_active=True)
+                .order_by('user_id', '-id')
+                .values_list('user_id', 'id', 'store_type', 'trigger_distance', 'last_triggered')
+            )
+            for user_id, reminder_id, store_type, trigger_distance, last_triggered in reminders:
+                limits = entitlements.get(user_id)
+                if limits is None:
+                    continue
+                seen[user_id] += 1
+                max_reminders, max_distance = limits.max_active_reminders, limits.max_trigger_distance
+                if max_reminders is not None and seen[user_id] > max_reminders:
+                    self.over_limit_count += 1
+                    continue
+                if max_distance is not None and trigger_distance > max_distance:
+                    self.over_limit_count += 1
+                    trigger_distance = max_distance
+                if last_triggered is not None and last_triggered >= cooldown_cutoff:
+                    continue
+                entries.setdefault(user_id, []).append((reminder_id, store_type, trigger_distance))
+
+            chunk = [
+                (user_id, float(latitude), float(longitude), tuple(entries[user_id]))
+                for user_id, latitude, longitude in batch
+                if user_id in entries
+            ]
+            if chunk:
+                yield chunk
+
+    def _write_results(self, results, now):
+        """トリガー結果をまとめてDBへ書き戻す"""
+        by_reminder = {reminder_id: row for reminder_id, *row in results}
+
+        with transaction.atomic():
+            # 判定中に他の経路でトリガー済みになったものは除外
+            still_active = list(
+                Reminder.objects
+                .select_for_update()
+                .filter(pk__in=by_reminder, is_active=True)
+                .values_list('id', flat=True)
+            )
+            if not still_active:
+                return 0
+
+            Reminder.objects.filter(pk__in=still_active).update(
+                is_active=False,
+                last_triggered=now,
+                updated_at=now,
+            )
+            ReminderLog.objects.bulk_create([
+                ReminderLog(
+                    reminder_id=reminder_id,
+                    user_id=by_reminder[reminder_id][0],
+                    user_latitude=round(by_reminder[reminder_id][1], 6),
+                    user_longitude=round(by_reminder[reminder_id][2], 6),
+                    distance_to_store=by_reminder[reminder_id][3],
+                )
+                for reminder_id in still_active
+            ])
+
+            # update()/bulk_create()はシグナルを発火しないので、統計カウンタと
+            # トリガーセットを明示的に更新する
+            per_user = Counter(by_reminder[reminder_id][0] for reminder_id in still_active)
+            for user_id, count in per_user.items():
+                record_reminder_change(user_id, active_delta=-count)
+                record_triggers(user_id, count, now)
+            user_ids = set(per_user)
+            transaction.on_commit(lambda: [invalidate_trigger_set(user_id) for user_id in user_ids])
+
+        return len(still_active)
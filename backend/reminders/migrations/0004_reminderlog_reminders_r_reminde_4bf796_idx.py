@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0003_alter_reminder_store_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reminderlog',
+            index=models.Index(fields=['reminder', '-triggered_at', '-id'], name='reminders_r_reminde_4bf796_idx'),
+        ),
+    ]
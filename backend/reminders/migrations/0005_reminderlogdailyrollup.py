@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0004_reminderlog_reminders_r_reminde_4bf796_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderLogDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('trigger_count', models.PositiveIntegerField(default=0)),
+                ('distance_sum', models.FloatField(default=0)),
+                ('distance_min', models.FloatField(blank=True, null=True)),
+                ('distance_max', models.FloatField(blank=True, null=True)),
+                ('reminder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reminders.reminder')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('reminder', 'date')},
+            },
+        ),
+    ]
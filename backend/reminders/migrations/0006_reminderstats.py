@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_user_google_id_user_google_picture_and_more'),
+        ('reminders', '0005_reminderlogdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reminder_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_reminders', models.PositiveIntegerField(default=0)),
+                ('active_reminders', models.PositiveIntegerField(default=0)),
+                ('total_triggers', models.PositiveIntegerField(default=0)),
+                ('triggers_today', models.PositiveIntegerField(default=0)),
+                ('today', models.DateField(blank=True, null=True)),
+                ('triggers_week', models.PositiveIntegerField(default=0)),
+                ('week_start', models.DateField(blank=True, null=True)),
+                ('triggers_month', models.PositiveIntegerField(default=0)),
+                ('month_start', models.DateField(blank=True, null=True)),
+                ('last_triggered_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_log_users(apps, schema_editor):
+    """既存のログにリマインダーのユーザーを入れる"""
+    Reminder = apps.get_model('reminders', 'Reminder')
+    ReminderLog = apps.get_model('reminders', 'ReminderLog')
+    ReminderLog.objects.filter(user__isnull=True).update(
+        user_id=Subquery(Reminder.objects.filter(pk=OuterRef('reminder_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0006_reminderstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminderlog',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_log_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reminderlog',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='reminderlog',
+            index=models.Index(fields=['user', '-triggered_at', '-id'], name='reminders_r_user_id_bdf072_idx'),
+        ),
+    ]
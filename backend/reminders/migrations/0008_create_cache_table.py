@@ -0,0 +1,23 @@
+# reminders/migrations/0008_create_cache_table.py
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    """
+    DatabaseCacheのテーブル（settings.CACHESのLOCATION）を作る。
+    トークン認証・エンタイトルメント・トリガーセットのキャッシュが使うので、migrateだけで動くようにする。
+    既にある場合・DatabaseCacheでない場合は何もしない
+    """
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0007_reminderlog_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -26,10 +26,65 @@ class Reminder(models.Model):
 
 class ReminderLog(models.Model):
     reminder = models.ForeignKey(Reminder, on_delete=models.CASCADE)
+    # ログAPIでユーザーの全リマインダーのログを時刻順に読むための非正規化（reminder.userと同じ）
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
     triggered_at = models.DateTimeField(auto_now_add=True)
     user_latitude = models.DecimalField(max_digits=9, decimal_places=6)
     user_longitude = models.DecimalField(max_digits=9, decimal_places=6)
     distance_to_store = models.FloatField()  # メートル単位
 
     class Meta:
-        ordering = ['-triggered_at']
\ No newline at end of file
+        ordering = ['-triggered_at']
+        indexes = [
+            # ログAPIのキーセットページネーション用（ユーザー全体・リマインダー指定）
+            models.Index(fields=['user', '-triggered_at', '-id']),
+            models.Index(fields=['reminder', '-triggered_at', '-id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.reminder.user_id
+        super().save(*args, **kwargs)
+
+class ReminderLogDailyRollup(models.Model):
+    """保持期間を過ぎたReminderLogを集約した、リマインダー×日ごとの集計"""
+    reminder = models.ForeignKey(Reminder, on_delete=models.CASCADE)
+    date = models.DateField()  # TIME_ZONE基準の日付
+    trigger_count = models.PositiveIntegerField(default=0)
+    distance_sum = models.FloatField(default=0)  # メートル単位
+    distance_min = models.FloatField(null=True, blank=True)
+    distance_max = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('reminder', 'date')
+
+    @property
+    def distance_avg(self):
+        if not self.trigger_count:
+            return None
+        return self.distance_sum / self.trigger_count
+
+    def __str__(self):
+        return f"{self.reminder_id} - {self.date} ({self.trigger_count}件)"
+
+
+class ReminderStats(models.Model):
+    """ユーザーごとのリマインダー統計カウンタ（変更と同じトランザクションで増分更新）"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='reminder_stats')
+    total_reminders = models.PositiveIntegerField(default=0)
+    active_reminders = models.PositiveIntegerField(default=0)
+    total_triggers = models.PositiveIntegerField(default=0)
+    # 期間カウンタは起点日と組で持ち、起点が古くなったら0から数え直す
+    triggers_today = models.PositiveIntegerField(default=0)
+    today = models.DateField(null=True, blank=True)
+    triggers_week = models.PositiveIntegerField(default=0)
+    week_start = models.DateField(null=True, blank=True)  # 月曜日
+    triggers_month = models.PositiveIntegerField(default=0)
+    month_start = models.DateField(null=True, blank=True)
+    last_triggered_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.total_reminders}件"
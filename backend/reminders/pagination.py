@@ -0,0 +1,77 @@
+# reminders/pagination.py
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    (time_field, id) の降順キーセットページネーション。
+    OFFSETを使わないため、何ページ目でも複合インデックスの範囲走査1回で済む。
+    """
+    time_field = 'triggered_at'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            last_time, last_id = position
+            queryset = queryset.filter(
+                Q(**{f'{self.time_field}__lt': last_time})
+                | Q(**{self.time_field: last_time, 'id__lt': last_id})
+            )
+
+        rows = list(queryset.order_by(f'-{self.time_field}', '-id')[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last_row = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            decoded = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            time_part, id_part = decoded.rsplit('|', 1)
+            last_time = parse_datetime(time_part)
+            last_id = int(id_part)
+        except (TypeError, ValueError, UnicodeError):
+            raise ParseError('無効なカーソルです')
+        if last_time is None:
+            raise ParseError('無効なカーソルです')
+        return last_time, last_id
+
+    def encode_cursor(self, row):
+        raw = f'{getattr(row, self.time_field).isoformat()}|{row.id}'
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next or self.last_row is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_row))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,115 @@
+# reminders/rollups.py
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ReminderLog, ReminderLogDailyRollup
+
+
+def retention_cutoff(retention_days=None):
+    """保持期間の境界（TIME_ZONE基準の日付の0時）を返す"""
+    if retention_days is None:
+        retention_days = settings.REMINDER_LOG_RETENTION_DAYS
+    cutoff_date = timezone.localdate() - timedelta(days=retention_days)
+    return timezone.make_aware(datetime.combine(cutoff_date, time.min))
+
+
+def compact_batch(cutoff, batch_size=1000):
+    """
+    cutoffより古いログを最大batch_size件、日次集計に畳み込んで削除する。
+    処理した件数を返す（0なら対象なし）。
+    同時に複数の実行があっても、ログは行ロックで別々のバッチに分かれ、二重に数えない。
+    """
+    with transaction.atomic():
+        rows = list(
+            ReminderLog.objects
+            .select_for_update(skip_locked=True)
+            .filter(triggered_at__lt=cutoff)
+            .order_by('id')
+            .values_list('id', 'reminder_id', 'triggered_at', 'distance_to_store')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        # (リマインダー, 日付) ごとに集計
+        buckets = {}
+        for _, reminder_id, triggered_at, distance in rows:
+            key = (reminder_id, timezone.localdate(triggered_at))
+            count, total, low, high = buckets.get(key, (0, 0.0, distance, distance))
+            buckets[key] = (count + 1, total + distance, min(low, distance), max(high, distance))
+
+        # 集計行を先に（なければ0件で）作ってから行ロックを取る。
+        # 同じ(リマインダー, 日付)を別の実行が同時に作っても一意制約で衝突しない
+        ReminderLogDailyRollup.objects.bulk_create(
+            [ReminderLogDailyRollup(reminder_id=reminder_id, date=day) for reminder_id, day in buckets],
+            ignore_conflicts=True,
+        )
+        rollups = {
+            (rollup.reminder_id, rollup.date): rollup
+            for rollup in ReminderLogDailyRollup.objects.select_for_update().filter(
+                reminder_id__in={reminder_id for reminder_id, _ in buckets},
+                date__in={day for _, day in buckets},
+            )
+        }
+
+        for key, (count, total, low, high) in buckets.items():
+            rollup = rollups[key]
+            rollup.trigger_count += count
+            rollup.distance_sum += total
+            rollup.distance_min = low if rollup.distance_min is None else min(rollup.distance_min, low)
+            rollup.distance_max = high if rollup.distance_max is None else max(rollup.distance_max, high)
+
+        ReminderLogDailyRollup.objects.bulk_update(
+            [rollups[key] for key in buckets], ['trigger_count', 'distance_sum', 'distance_min', 'distance_max']
+        )
+        ReminderLog.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+    return len(rows)
+
+
+def daily_trigger_counts(user, since_date):
+    """
+    since_date以降の日別トリガー集計を返す。
+    古い日は集計テーブルから、保持期間内の日は生ログ（小さい）から読んで合算する。
+    """
+    days = {}
+
+    def merge(day, count, total, low, high):
+        entry = days.setdefault(day, {'date': day, 'trigger_count': 0, 'distance_sum': 0.0,
+                                      'distance_min': None, 'distance_max': None})
+        entry['trigger_count'] += count
+        entry['distance_sum'] += total or 0.0
+        if low is not None:
+            entry['distance_min'] = low if entry['distance_min'] is None else min(entry['distance_min'], low)
+        if high is not None:
+            entry['distance_max'] = high if entry['distance_max'] is None else max(entry['distance_max'], high)
+
+    rollups = (
+        ReminderLogDailyRollup.objects
+        .filter(reminder__user=user, date__gte=since_date)
+        .values('date')
+        .annotate(count=Sum('trigger_count'), total=Sum('distance_sum'),
+                  low=Min('distance_min'), high=Max('distance_max'))
+        .order_by()
+    )
+    for row in rollups:
+        merge(row['date'], row['count'], row['total'], row['low'], row['high'])
+
+    since = timezone.make_aware(datetime.combine(since_date, time.min))
+    raw = (
+        ReminderLog.objects
+        .filter(user=user, triggered_at__gte=since)
+        .annotate(date=TruncDate('triggered_at'))
+        .values('date')
+        .annotate(count=Count('id'), total=Sum('distance_to_store'),
+                  low=Min('distance_to_store'), high=Max('distance_to_store'))
+        .order_by()
+    )
+    for row in raw:
+        merge(row['date'], row['count'], row['total'], row['low'], row['high'])
+
+    return [days[day] for day in sorted(days, reverse=True)]
@@ -1,5 +1,7 @@
 # reminders/serializers.py
 from rest_framework import serializers
+from subscriptions.entitlements import get_entitlements
+from .counters import get_user_stats
 from .models import Reminder, ReminderLog
 
 class ReminderSerializer(serializers.ModelSerializer):
@@ -11,6 +13,29 @@ class ReminderSerializer(serializers.ModelSerializer):
                  'trigger_distance', 'last_triggered', 'created_at', 'updated_at')
         read_only_fields = ('id', 'last_triggered', 'created_at', 'updated_at')
 
+    def validate(self, attrs):
+        """プランの上限（トリガー距離・有効なリマインダー数）を確認"""
+        user = self.context['request'].user
+        entitlements = get_entitlements(user.pk)
+
+        trigger_distance = attrs.get('trigger_distance')
+        if (trigger_distance is not None
+                and entitlements.max_trigger_distance is not None
+                and trigger_distance != getattr(self.instance, 'trigger_distance', None)
+                and trigger_distance > entitlements.max_trigger_distance):
+            raise serializers.ValidationError({
+                'trigger_distance': f'現在のプランではトリガー距離は{entitlements.max_trigger_distance}m以下にしてください'
+            })
+
+        was_active = self.instance is not None and self.instance.is_active
+        is_active = attrs.get('is_active', self.instance.is_active if self.instance is not None else True)
+        if is_active and not was_active and entitlements.max_active_reminders is not None:
+            if get_user_stats(user.pk).active_reminders >= entitlements.max_active_reminders:
+                raise serializers.ValidationError(
+                    f'現在のプランで有効にできるリマインダーは{entitlements.max_active_reminders}件までです'
+                )
+        return attrs
+
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
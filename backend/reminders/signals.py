@@ -0,0 +1,72 @@
+# reminders/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .counters import record_reminder_change, record_reminder_delete, record_triggers, reminder_trigger_counts
+from .models import Reminder, ReminderLog
+from .triggers import invalidate_trigger_set
+
+
+@receiver(post_save, sender=Reminder)
+@receiver(post_delete, sender=Reminder)
+def invalidate_reminder_trigger_set(sender, instance, **kwargs):
+    """リマインダーの変更・削除時にトリガーセットを無効化（コミット後）"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_trigger_set(user_id))
+
+
+@receiver(post_init, sender=Reminder)
+def remember_reminder_active_state(sender, instance, **kwargs):
+    """統計カウンタの差分計算用に、読み込み時のis_activeを覚えておく"""
+    # only()等で遅延読み込みになっている場合は追加クエリを発生させない（必要になったらpre_saveで読む）
+    instance._counted_is_active = instance.__dict__.get('is_active')
+
+
+def _stored_is_active(instance):
+    """遅延読み込みで読み込み時の値がない場合に、DB上の現在のis_activeを読む"""
+    if instance._counted_is_active is None and not instance._state.adding:
+        instance._counted_is_active = (
+            Reminder._base_manager.filter(pk=instance.pk).values_list('is_active', flat=True).first()
+        )
+    return instance._counted_is_active
+
+
+@receiver(pre_save, sender=Reminder)
+def load_reminder_active_state(sender, instance, update_fields=None, **kwargs):
+    """is_activeを遅延読み込みのまま書き換えた場合は、保存前にDB上の値を読んでおく"""
+    if 'is_active' in instance.__dict__ and (update_fields is None or 'is_active' in update_fields):
+        _stored_is_active(instance)
+
+
+@receiver(post_save, sender=Reminder)
+def count_reminder_save(sender, instance, created, update_fields=None, **kwargs):
+    """リマインダーの作成・有効状態の変更を統計カウンタに反映"""
+    if created:
+        record_reminder_change(instance.user_id, total_delta=1, active_delta=int(instance.is_active))
+    elif 'is_active' not in instance.__dict__ or (update_fields is not None and 'is_active' not in update_fields):
+        # is_activeを保存していない
+        return
+    elif instance._counted_is_active is not None and instance._counted_is_active != instance.is_active:
+        record_reminder_change(instance.user_id, active_delta=1 if instance.is_active else -1)
+    instance._counted_is_active = instance.is_active
+
+
+@receiver(pre_delete, sender=Reminder)
+def remember_reminder_triggers(sender, instance, **kwargs):
+    """CASCADEでログ・日次集計が消える前に、差し引くトリガー件数を数えておく"""
+    _stored_is_active(instance)
+    instance._counted_triggers = reminder_trigger_counts(instance.pk)
+
+
+@receiver(post_delete, sender=Reminder)
+def count_reminder_delete(sender, instance, **kwargs):
+    """リマインダーの削除を統計カウンタに反映"""
+    record_reminder_delete(instance.user_id, instance._counted_is_active, instance._counted_triggers)
+
+
+@receiver(post_save, sender=ReminderLog)
+def count_reminder_log(sender, instance, created, **kwargs):
+    """トリガーログの記録を統計カウンタに反映"""
+    if created:
+        record_triggers(instance.user_id, 1, instance.triggered_at)
@@ -0,0 +1,85 @@
+# reminders/sweep_worker.py
+# sweep_triggersのワーカープロセスで実行される距離計算カーネル。
+# spawn/forkserverでも起動できるよう、Djangoには依存しない。
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = 111000.0
+
+# ワーカープロセスごとの店舗インデックス {店舗タイプ: (緯度昇順の緯度配列, 経度配列)}
+_STORE_INDEX = {}
+
+
+def build_store_index(rows):
+    """(店舗タイプ, 緯度, 経度) の列から緯度ソート済みの配列インデックスを作る"""
+    grouped = {}
+    for store_type, latitude, longitude in rows:
+        grouped.setdefault(store_type, []).append((float(latitude), float(longitude)))
+
+    index = {}
+    for store_type, points in grouped.items():
+        coords = np.array(points, dtype=np.float64)
+        order = np.argsort(coords[:, 0], kind='stable')
+        index[store_type] = (
+            np.ascontiguousarray(coords[order, 0]),
+            np.ascontiguousarray(coords[order, 1]),
+        )
+    return index
+
+
+def init_worker(store_index):
+    """ProcessPoolExecutorのinitializer。インデックスをプロセスに一度だけ渡す"""
+    global _STORE_INDEX
+    _STORE_INDEX = store_index
+
+
+def haversine_meters(latitude, longitude, latitudes, longitudes):
+    """1地点から複数地点への大円距離（メートル）をまとめて計算"""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlng = np.radians(longitudes - longitude)
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def nearest_distance(latitude, longitude, store_type, max_distance):
+    """max_distance以内の最寄り店舗までの距離。なければNone"""
+    arrays = _STORE_INDEX.get(store_type)
+    if arrays is None:
+        return None
+    latitudes, longitudes = arrays
+
+    # 緯度帯で候補を絞り込んでからベクトル計算
+    band = max_distance / METERS_PER_DEGREE
+    lo = np.searchsorted(latitudes, latitude - band, side='left')
+    hi = np.searchsorted(latitudes, latitude + band, side='right')
+    if hi <= lo:
+        return None
+
+    distance = float(haversine_meters(latitude, longitude, latitudes[lo:hi], longitudes[lo:hi]).min())
+    return distance if distance <= max_distance else None
+
+
+def evaluate_chunk(users):
+    """
+    ユーザーのチャンクを評価してトリガー結果を返す。
+    users: [(user_id, 緯度, 経度, ((reminder_id, 店舗タイプ, トリガー距離), ...)), ...]
+    戻り値: [(reminder_id, user_id, 緯度, 経度, 距離), ...]
+    """
+    results = []
+    for user_id, latitude, longitude, entries in users:
+        max_distances = {}
+        for _, store_type, trigger_distance in entries:
+            max_distances[store_type] = max(max_distances.get(store_type, 0), trigger_distance)
+
+        nearest = {
+            store_type: nearest_distance(latitude, longitude, store_type, max_distance)
+            for store_type, max_distance in max_distances.items()
+        }
+
+        for reminder_id, store_type, trigger_distance in entries:
+            distance = nearest[store_type]
+            if distance is not None and distance <= trigger_distance:
+                results.append((reminder_id, user_id, latitude, longitude, distance))
+    return results
@@ -1,3 +1,475 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import checks
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.location_buffer import LocationFix, LocationWriteBuffer
+from accounts.models import User, UserLocation
+from location_reminder.caches import check_shared_cache
+from location_reminder.paginators import EstimatedCountPaginator
+from stores.models import Store
+from subscriptions.entitlements import local_entitlement_cache
+from .counters import get_user_stats, rebuild_user_stats
+from .models import Reminder, ReminderLog, ReminderLogDailyRollup, ReminderStats
+from .rollups import compact_batch, daily_trigger_counts, retention_cutoff
+from .triggers import get_trigger_set
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class TriggerSetCacheTests(TestCase):
+    """あるワーカーでの変更が、別のワーカーのキャッシュ済みTriggerSetに反映されること"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        self.reminder = Reminder.objects.create(user=self.user, title='牛乳')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # 別プロセスのワーカーを、同じ設定から作った別のキャッシュ接続で表す
+        self.other_worker = caches.create_connection('default')
+
+    def trigger_ids(self, worker_cache=None):
+        with mock.patch('reminders.triggers.cache', worker_cache or self.other_worker):
+            return {entry.reminder_id for entry in get_trigger_set(self.user.pk).entries}
+
+    def test_created_reminder_reaches_other_worker(self):
+        self.assertEqual(self.trigger_ids(), {self.reminder.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/reminders/', {'title': '目薬', 'store_type': 'pharmacy'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.trigger_ids(), {self.reminder.pk, response.data['id']})
+
+    def test_deactivate_and_reactivate_reach_other_worker(self):
+        url = f'/api/reminders/{self.reminder.pk}/'
+        self.trigger_ids()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'is_active': False}, format='json')
+        self.assertEqual(self.trigger_ids(), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'is_active': True}, format='json')
+        self.assertEqual(self.trigger_ids(), {self.reminder.pk})
+
+    def test_sweep_deactivation_reaches_other_worker(self):
+        from .management.commands.sweep_triggers import Command
+
+        self.trigger_ids()
+        with self.captureOnCommitCallbacks(execute=True):
+            # sweep_triggersの書き戻しは別プロセスで走る（update()なのでシグナルは発火しない）
+            Command()._write_results([(self.reminder.pk, self.user.pk, 35.0, 139.0, 10.0)], self.reminder.created_at)
+        self.assertEqual(self.trigger_ids(), set())
+
+    def test_process_local_cache_reads_database(self):
+        with override_settings(CACHES=LOCMEM_CACHES):
+            self.assertEqual(self.trigger_ids(caches['default']), {self.reminder.pk})
+            # シグナルを通らない変更でも、キャッシュを使わないので反映される
+            Reminder.objects.filter(pk=self.reminder.pk).update(is_active=False)
+            self.assertEqual(self.trigger_ids(caches['default']), set())
+            self.assertEqual([error.id for error in check_shared_cache()], ['location_reminder.E001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_cache(), [])
+        # 本番でのDatabaseCacheはクエリが増えるので警告する
+        self.assertEqual([warning.id for warning in check_shared_cache()], ['location_reminder.W001'])
+        self.assertIn(check_shared_cache, checks.registry.registry.get_checks())
+
+    def test_migration_creates_cache_table(self):
+        migration = importlib.import_module('reminders.migrations.0008_create_cache_table')
+        table = 'reminders_test_cache'
+        cache_settings = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': table}}
+        with override_settings(CACHES=cache_settings):
+            migration.create_cache_table(None, mock.Mock(connection=connection))
+        self.assertIn(table, connection.introspection.table_names())
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {table}')
+
+
+class SweepTriggersCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # 東京駅の約20m北にコンビニ、約1km北に薬局
+        Store.objects.create(name='コンビニ', store_type='convenience', address='東京都',
+                             latitude=35.68138, longitude=139.76710)
+        Store.objects.create(name='薬局', store_type='pharmacy', address='東京都',
+                             latitude=35.69100, longitude=139.76710)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        UserLocation.objects.create(user=self.user, latitude=35.68120, longitude=139.76710, updated_at=timezone.now())
+        self.near = Reminder.objects.create(user=self.user, title='牛乳', store_type='convenience', trigger_distance=30)
+        self.far = Reminder.objects.create(user=self.user, title='目薬', store_type='pharmacy', trigger_distance=50)
+
+    def sweep(self, *args):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('sweep_triggers', '--workers=1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_triggers_reminders_within_distance(self):
+        output = self.sweep()
+        self.assertIn('1ユーザーを判定、1件トリガー', output)
+        self.near.refresh_from_db()
+        self.far.refresh_from_db()
+        self.assertFalse(self.near.is_active)
+        self.assertIsNotNone(self.near.last_triggered)
+        self.assertTrue(self.far.is_active)
+        log = ReminderLog.objects.get()
+        self.assertEqual(log.reminder, self.near)
+        self.assertAlmostEqual(log.distance_to_store, 20, delta=1)
+        # update()/bulk_create()で書いた分も統計カウンタに入る
+        stats = get_user_stats(self.user.pk)
+        self.assertEqual((stats.active_reminders, stats.total_triggers), (1, 1))
+
+    def test_skips_stale_locations_and_cooldown(self):
+        Reminder.objects.filter(pk=self.near.pk).update(last_triggered=timezone.now() - timedelta(minutes=10))
+        self.assertIn('0件トリガー', self.sweep())
+        UserLocation.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(hours=1))
+        Reminder.objects.filter(pk=self.near.pk).update(last_triggered=None)
+        self.assertIn('0ユーザーを判定', self.sweep())
+
+    def test_dry_run_writes_nothing(self):
+        self.assertIn('1件トリガー', self.sweep('--dry-run'))
+        self.assertFalse(ReminderLog.objects.exists())
+        self.assertTrue(Reminder.objects.get(pk=self.near.pk).is_active)
+
+    def test_worker_processes_match_single_process(self):
+        # 東京駅の近くにいる別のユーザー2人（チャンクを分けてワーカーに配る）
+        others = []
+        for i in range(2):
+            user = User.objects.create_user(username=f'other{i}', email=f'other{i}@example.com', password='password')
+            UserLocation.objects.create(user=user, latitude=35.68120, longitude=139.76710, updated_at=timezone.now())
+            others.append(Reminder.objects.create(user=user, title='パン', store_type='convenience', trigger_distance=30))
+        output = self.sweep('--workers=2', '--chunk-size=1')
+        self.assertIn('3ユーザーを判定、3件トリガー', output)
+        self.assertIn('workers=2', output)
+        self.assertEqual(set(ReminderLog.objects.values_list('reminder_id', flat=True)),
+                         {self.near.pk} | {reminder.pk for reminder in others})
+        self.assertTrue(Reminder.objects.get(pk=self.far.pk).is_active)
+
+    def test_flushes_buffered_locations_first(self):
+        UserLocation.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(hours=1))
+        buffer = LocationWriteBuffer(flush_interval=3600)
+        self.addCleanup(buffer.shutdown)
+        buffer.put(self.user.pk, LocationFix(35.68120, 139.76710, timezone.now()))
+        with mock.patch('reminders.management.commands.sweep_triggers.location_buffer', buffer):
+            self.assertIn('1ユーザーを判定、1件トリガー', self.sweep())
+
+    def test_reports_reminders_over_plan_limit(self):
+        self.assertIn('プラン上限超過0件', self.sweep('--dry-run'))
+        limits = {'max_active_reminders': 0, 'max_trigger_distance': 40}
+        local_entitlement_cache.clear()
+        with override_settings(PLAN_LIMITS={'free': limits, 'premium': limits}):
+            output = self.sweep()
+        local_entitlement_cache.clear()
+        # 薬局のリマインダー（50m）は40mに縮めて判定され、件数として報告される
+        self.assertIn('1件トリガー、プラン上限超過1件', output)
+
+
+class ReminderLogPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        other = User.objects.create_user(username='other', email='other@example.com', password='password')
+        milk = Reminder.objects.create(user=cls.user, title='牛乳')
+        medicine = Reminder.objects.create(user=cls.user, title='目薬', store_type='pharmacy')
+        base = timezone.now().replace(microsecond=0)
+        # 2件ずつ同じ時刻（idで順序が決まる）
+        for i, reminder in enumerate([milk, medicine, milk, medicine, milk]):
+            log = ReminderLog.objects.create(reminder=reminder, user_latitude=35.0, user_longitude=139.0,
+                                             distance_to_store=float(i))
+            ReminderLog.objects.filter(pk=log.pk).update(triggered_at=base - timedelta(minutes=i // 2))
+        ReminderLog.objects.create(reminder=Reminder.objects.create(user=other, title='他人'),
+                                   user_latitude=35.0, user_longitude=139.0, distance_to_store=0.0)
+        cls.expected = list(
+            ReminderLog.objects.filter(user=cls.user).order_by('-triggered_at', '-id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_follow_cursor_without_gaps_or_duplicates(self):
+        seen = []
+        url = '/api/reminders/logs/?page_size=2'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_log_user_is_filled_from_reminder(self):
+        self.assertEqual(set(ReminderLog.objects.filter(pk__in=self.expected).values_list('user', flat=True)),
+                         {self.user.pk})
+
+    def test_filter_by_reminder(self):
+        reminder = Reminder.objects.get(title='目薬')
+        response = self.client.get(f'/api/reminders/logs/?reminder={reminder.pk}')
+        self.assertEqual([row['reminder_title'] for row in response.data['results']], ['目薬', '目薬'])
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor_is_bad_request(self):
+        for cursor in ('not-base64!', 'bm90IGEgY3Vyc29y'):
+            response = self.client.get('/api/reminders/logs/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+class CompactReminderLogsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        self.milk = Reminder.objects.create(user=self.user, title='牛乳')
+        self.medicine = Reminder.objects.create(user=self.user, title='目薬', store_type='pharmacy')
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(), time(12)))
+        self.old_day = noon - timedelta(days=100)
+        # 100日前に牛乳3件・目薬1件、101日前に牛乳1件、昨日に牛乳1件
+        for reminder, when, distance in [
+            (self.milk, self.old_day, 10.0), (self.milk, self.old_day + timedelta(hours=1), 30.0),
+            (self.medicine, self.old_day, 5.0), (self.milk, self.old_day + timedelta(hours=2), 20.0),
+            (self.milk, self.old_day - timedelta(days=1), 7.0), (self.milk, noon - timedelta(days=1), 1.0),
+        ]:
+            log = ReminderLog.objects.create(reminder=reminder, user_latitude=35.0, user_longitude=139.0,
+                                             distance_to_store=distance)
+            ReminderLog.objects.filter(pk=log.pk).update(triggered_at=when)
+
+    def test_compaction_preserves_daily_totals(self):
+        since = timezone.localdate() - timedelta(days=200)
+        before = daily_trigger_counts(self.user, since)
+        total_before = get_user_stats(self.user.pk).total_triggers
+
+        # バッチ境界で同じ (リマインダー, 日) が分かれても既存の集計行に足し込まれる
+        out = io.StringIO()
+        call_command('compact_reminder_logs', '--retention-days=90', '--batch-size=2', stdout=out)
+        self.assertIn('ログ5件を3バッチ', out.getvalue())
+
+        self.assertEqual(ReminderLog.objects.count(), 1)
+        rollup = ReminderLogDailyRollup.objects.get(reminder=self.milk, date=timezone.localdate(self.old_day))
+        self.assertEqual((rollup.trigger_count, rollup.distance_sum), (3, 60.0))
+        self.assertEqual((rollup.distance_min, rollup.distance_max, rollup.distance_avg), (10.0, 30.0, 20.0))
+        self.assertEqual(ReminderLogDailyRollup.objects.count(), 3)
+
+        self.assertEqual(daily_trigger_counts(self.user, since), before)
+        self.assertEqual(get_user_stats(self.user.pk).total_triggers, total_before)
+        self.assertEqual(rebuild_user_stats(self.user.pk).total_triggers, total_before)
+
+    def test_concurrent_runs_lock_separate_batches(self):
+        # 他の実行がロック中のログは飛ばし、他の実行が先に作った集計行には足し込む
+        ReminderLogDailyRollup.objects.create(reminder=self.milk, date=timezone.localdate(self.old_day))
+        calls = []
+        original = QuerySet.select_for_update
+
+        def record(queryset, **kwargs):
+            calls.append((queryset.model, kwargs))
+            return original(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=record):
+            self.assertEqual(compact_batch(retention_cutoff(90)), 5)
+        self.assertIn((ReminderLog, {'skip_locked': True}), calls)
+        rollup = ReminderLogDailyRollup.objects.get(reminder=self.milk, date=timezone.localdate(self.old_day))
+        self.assertEqual((rollup.trigger_count, rollup.distance_min), (3, 10.0))
+
+    def test_daily_counts_read_logs_without_reminder_join(self):
+        since = timezone.localdate() - timedelta(days=7)
+        with CaptureQueriesContext(connection) as queries:
+            daily_trigger_counts(self.user, since)
+        log_queries = [query['sql'] for query in queries if 'FROM "reminders_reminderlog"' in query['sql']]
+        self.assertEqual(len(log_queries), 1)
+        self.assertNotIn('reminders_reminder"', log_queries[0].replace('reminders_reminderlog"', ''))
+
+    def test_max_batches_limits_work_per_run(self):
+        call_command('compact_reminder_logs', '--batch-size=2', '--max-batches=1', stdout=io.StringIO())
+        self.assertEqual(ReminderLog.objects.count(), 4)
+        self.assertEqual(sum(ReminderLogDailyRollup.objects.values_list('trigger_count', flat=True)), 2)
+
+
+class ReminderStatsCounterTests(TestCase):
+    """増分更新したカウンタが、DBから作り直した値と一致すること"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        self.reminder = Reminder.objects.create(user=self.user, title='牛乳')
+        Reminder.objects.create(user=self.user, title='目薬', store_type='pharmacy')
+
+    def assertMatchesRebuild(self):
+        fields = ('total_reminders', 'active_reminders', 'total_triggers', 'triggers_today',
+                  'triggers_week', 'triggers_month', 'last_triggered_at')
+        counted = get_user_stats(self.user.pk)
+        rebuilt = rebuild_user_stats(self.user.pk)
+        self.assertEqual([getattr(counted, name) for name in fields], [getattr(rebuilt, name) for name in fields])
+        return rebuilt
+
+    def test_deactivating_deferred_is_active(self):
+        reminder = Reminder.objects.only('id', 'user').get(pk=self.reminder.pk)
+        reminder.is_active = False
+        reminder.save()
+        self.assertEqual(self.assertMatchesRebuild().active_reminders, 1)
+
+        # is_activeを読み込まず・保存しない更新ではカウンタは変わらない
+        reminder = Reminder.objects.only('id', 'user', 'title').get(pk=self.reminder.pk)
+        reminder.title = '豆乳'
+        reminder.save()
+        self.assertEqual(self.assertMatchesRebuild().active_reminders, 1)
+
+    def test_update_fields_without_is_active(self):
+        self.reminder.is_active = False
+        self.reminder.save(update_fields=['title'])
+        self.assertEqual(self.assertMatchesRebuild().active_reminders, 2)
+
+    def test_deleting_reminder_with_logs_and_rollups(self):
+        for distance in (10.0, 20.0):
+            ReminderLog.objects.create(reminder=self.reminder, user_latitude=35.0, user_longitude=139.0,
+                                       distance_to_store=distance)
+        ReminderLogDailyRollup.objects.create(reminder=self.reminder, date=timezone.localdate() - timedelta(days=200),
+                                              trigger_count=4, distance_sum=40.0)
+        self.reminder.last_triggered = timezone.now()
+        self.reminder.save()
+        # 集計行は直接作ったのでカウンタを作り直してから削除する
+        rebuild_user_stats(self.user.pk)
+
+        Reminder.objects.get(pk=self.reminder.pk).delete()
+        stats = self.assertMatchesRebuild()
+        self.assertEqual((stats.total_reminders, stats.active_reminders, stats.total_triggers), (1, 1, 0))
+        self.assertIsNone(stats.last_triggered_at)
+
+
+    def test_rebuild_locks_row_before_counting(self):
+        # 行がなくても先に作って行ロックを取り、ロック後に数える（同時の再構築が古い値で上書きしない）
+        ReminderStats.objects.filter(user=self.user).delete()
+        order = []
+        original = QuerySet.select_for_update
+
+        def record(queryset, **kwargs):
+            order.append(('lock', queryset.model))
+            return original(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=record), \
+                CaptureQueriesContext(connection) as queries:
+            stats = rebuild_user_stats(self.user.pk)
+        self.assertEqual(order, [('lock', ReminderStats)])
+        reminder_query = next(i for i, query in enumerate(queries) if 'FROM "reminders_reminder"' in query['sql'])
+        stats_query = next(i for i, query in enumerate(queries)
+                           if query['sql'].startswith('SELECT') and 'FROM "reminders_reminderstats"' in query['sql'])
+        self.assertLess(stats_query, reminder_query)
+        self.assertEqual((stats.total_reminders, stats.active_reminders), (2, 2))
+        self.assertEqual(ReminderStats.objects.filter(user=self.user).count(), 1)
+
+    def test_admin_log_deletion_rebuilds_counters(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        logs = [
+            ReminderLog.objects.create(reminder=self.reminder, user_latitude=35.0, user_longitude=139.0,
+                                       distance_to_store=distance)
+            for distance in (10.0, 20.0, 30.0)
+        ]
+        self.assertEqual(get_user_stats(self.user.pk).total_triggers, 3)
+        self.client.force_login(admin_user)
+
+        response = self.client.post('/admin/reminders/reminderlog/', {
+            'action': 'delete_selected',
+            '_selected_action': [logs[0].pk, logs[1].pk],
+            'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.assertMatchesRebuild().total_triggers, 1)
+
+        response = self.client.post(f'/admin/reminders/reminderlog/{logs[2].pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_user_stats(self.user.pk).total_triggers, 0)
+
+    def test_rebuild_command_repairs_queryset_deletion(self):
+        ReminderLog.objects.create(reminder=self.reminder, user_latitude=35.0, user_longitude=139.0,
+                                   distance_to_store=10.0)
+        # QuerySet.delete()はシグナルを送らないのでカウンタは残る
+        ReminderLog.objects.filter(reminder=self.reminder).delete()
+        self.assertEqual(get_user_stats(self.user.pk).total_triggers, 1)
+
+        call_command('rebuild_reminder_stats', f'--user={self.user.pk}', stdout=io.StringIO())
+        self.assertEqual(get_user_stats(self.user.pk).total_triggers, 0)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """管理画面の一覧のクエリ数が行数に比例しないこと"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        for i in range(10):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password')
+            reminder = Reminder.objects.create(user=user, title=f'買い物{i}', memo='牛乳')
+            for _ in range(2):
+                ReminderLog.objects.create(reminder=reminder, user_latitude=35.0, user_longitude=139.0,
+                                           distance_to_store=12.5)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_reminder_changelist(self):
+        # セッション・ユーザー・推定行数・上限付きの件数・一覧の行・trigger_distanceの絞り込み候補
+        with self.assertNumQueries(6):
+            response = self.client.get('/admin/reminders/reminder/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'user9@example.com')
+
+    def test_reminder_change_form_counts_logs_in_one_query(self):
+        reminder = Reminder.objects.first()
+        response = self.client.get(f'/admin/reminders/reminder/{reminder.pk}/change/')
+        self.assertContains(response, '2 件')
+
+    def test_reminder_log_changelist(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/admin/reminders/reminderlog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '12.5m')
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_paginator_stops_counting_at_limit(self):
+        # 絞り込みなしは推定行数、絞り込みありは上限まで数える
+        self.assertGreaterEqual(EstimatedCountPaginator(ReminderLog.objects.order_by('id'), 2).count, 20)
+        self.assertEqual(EstimatedCountPaginator(ReminderLog.objects.filter(distance_to_store__gt=0), 2).count, 5)
+        self.assertEqual(EstimatedCountPaginator(Reminder.objects.filter(title='買い物1'), 2).count, 1)
+
+
+class CsvExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        user = User.objects.create_user(username='shopper', email='shopper@example.com', password='password')
+        for store_type, title in (('convenience', '=牛乳'), ('pharmacy', '目薬')):
+            reminder = Reminder.objects.create(user=user, title=title, store_type=store_type)
+            ReminderLog.objects.create(reminder=reminder, user_latitude=35.0, user_longitude=139.0,
+                                       distance_to_store=20.0)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def read_csv(self, response):
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_export_filtered_changelist(self):
+        response = self.client.get('/admin/reminders/reminderlog/export/?reminder__store_type=pharmacy')
+        rows = self.read_csv(response)
+        self.assertEqual(rows[0][:4], ['ID', 'トリガー日時', 'リマインダーID', 'リマインダー'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3], '目薬')
+        self.assertEqual(rows[1][7], 'shopper@example.com')
+
+    def test_export_action_escapes_formulas(self):
+        logs = ReminderLog.objects.order_by('id')
+        response = self.client.post('/admin/reminders/reminderlog/', {
+            'action': 'export_csv',
+            '_selected_action': [logs[0].pk],
+        })
+        rows = self.read_csv(response)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3], "'=牛乳")
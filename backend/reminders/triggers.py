@@ -0,0 +1,151 @@
+# reminders/triggers.py
+import time
+from math import cos, radians
+from typing import NamedTuple, Optional, Tuple
+
+from django.core.cache import cache
+
+from location_reminder.caches import is_shared_cache
+from stores.models import Store
+from .models import Reminder
+
+# トリガー後に再通知しない時間（秒）
+COOLDOWN_SECONDS = 3600
+
+# コンパイル済みトリガーセットのキャッシュ保持時間（秒）
+TRIGGER_SET_TIMEOUT = 60 * 60
+
+_VERSION_KEY = 'reminders:trigger_set_version:{user_id}'
+_SET_KEY = 'reminders:trigger_set:{user_id}:{version}'
+
+
+class TriggerEntry(NamedTuple):
+    reminder_id: int
+    store_type: str
+    trigger_distance: int
+    cooldown_until: float  # UNIXタイムスタンプ（クールダウンなしは0.0）
+
+
+class TriggerSet(NamedTuple):
+    """ユーザーの有効なリマインダーをトリガー判定用に圧縮したもの"""
+    version: int
+    entries: Tuple[TriggerEntry, ...]
+    max_distances: Tuple[Tuple[str, int], ...]  # (店舗タイプ, 最大トリガー距離)
+
+    def due_entries(self, now_ts):
+        """クールダウンが明けているエントリのみを返す"""
+        return tuple(entry for entry in self.entries if entry.cooldown_until < now_ts)
+
+    def limited(self, max_entries, max_distance):
+        """
+        プランの上限を適用したTriggerSetを返す（新しいリマインダーから最大max_entries件、距離はmax_distanceまで）。
+        Noneの上限は適用しない。適用されたリマインダーはover_limit()で利用者に示すこと
+        """
+        if not self.over_limit(max_entries, max_distance):
+            return self
+        entries = tuple(
+            entry._replace(trigger_distance=min(entry.trigger_distance, max_distance or entry.trigger_distance))
+            for entry in self.entries[:max_entries]
+        )
+        max_distances = {}
+        for entry in entries:
+            max_distances[entry.store_type] = max(max_distances.get(entry.store_type, 0), entry.trigger_distance)
+        return self._replace(entries=entries, max_distances=tuple(sorted(max_distances.items())))
+
+    def over_limit(self, max_entries, max_distance):
+        """プランの上限により通知されない・距離を縮めて判定されるリマインダーのID"""
+        return tuple(
+            entry.reminder_id
+            for index, entry in enumerate(self.entries)
+            if (max_entries is not None and index >= max_entries)
+            or (max_distance is not None and entry.trigger_distance > max_distance)
+        )
+
+
+def compile_trigger_set(user_id, version):
+    """DBから有効なリマインダーを読み込み、TriggerSetを組み立てる"""
+    rows = (
+        Reminder.objects
+        .filter(user_id=user_id, is_active=True)
+        .order_by('-id')  # プランの上限を超えた分は新しいものを優先する
+        .values_list('id', 'store_type', 'trigger_distance', 'last_triggered')
+    )
+
+    entries = []
+    max_distances = {}
+    for reminder_id, store_type, trigger_distance, last_triggered in rows:
+        cooldown_until = last_triggered.timestamp() + COOLDOWN_SECONDS if last_triggered else 0.0
+        entries.append(TriggerEntry(reminder_id, store_type, trigger_distance, cooldown_until))
+        max_distances[store_type] = max(max_distances.get(store_type, 0), trigger_distance)
+
+    return TriggerSet(
+        version=version,
+        entries=tuple(entries),
+        max_distances=tuple(sorted(max_distances.items())),
+    )
+
+
+def _current_version(user_id):
+    key = _VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # キーが追い出された場合でも古いセットを復活させないよう時刻ベースで初期化
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_trigger_set(user_id):
+    """
+    キャッシュ済みのTriggerSetを取得（バージョンが変わっていればコンパイルし直す）。
+    バージョンは共有キャッシュに置くので、どのワーカー・sweep_triggersでの変更もコミット直後に反映される。
+    キャッシュがプロセス内（LocMemCache）の場合は他プロセスの無効化が届かないため、毎回DBから組み立てる。
+    """
+    if not is_shared_cache():
+        return compile_trigger_set(user_id, 0)
+    version = _current_version(user_id)
+    key = _SET_KEY.format(user_id=user_id, version=version)
+    trigger_set = cache.get(key)
+    if trigger_set is None:
+        trigger_set = compile_trigger_set(user_id, version)
+        cache.set(key, trigger_set, TRIGGER_SET_TIMEOUT)
+    return trigger_set
+
+
+def invalidate_trigger_set(user_id):
+    """ユーザーのTriggerSetのバージョンを進め、次回参照時に再コンパイルさせる"""
+    key = _VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def nearest_store_distance(user_location, store_type, max_distance):
+    """max_distance以内で最も近い店舗までの距離（メートル）を返す。なければNone"""
+    # geopyはパッケージ読み込み時に全ジオコーダーをimportして重いので初回利用時に読み込む
+    from geopy.distance import geodesic
+
+    latitude, longitude = user_location
+    lat_range = max_distance / 111000.0  # 緯度1度 ≈ 111km
+    lng_range = max_distance / (111000.0 * max(cos(radians(latitude)), 0.01))
+
+    candidates = (
+        Store.objects
+        .filter(
+            store_type=store_type,
+            latitude__range=(latitude - lat_range, latitude + lat_range),
+            longitude__range=(longitude - lng_range, longitude + lng_range),
+        )
+        .values_list('latitude', 'longitude')
+    )
+
+    min_distance: Optional[float] = None
+    for store_latitude, store_longitude in candidates:
+        distance = geodesic(user_location, (float(store_latitude), float(store_longitude))).meters
+        if min_distance is None or distance < min_distance:
+            min_distance = distance
+
+    if min_distance is not None and min_distance <= max_distance:
+        return min_distance
+    return None
@@ -2,11 +2,17 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
 from django.utils import timezone
-from geopy.distance import geodesic
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from subscriptions.entitlements import get_entitlements
 from .models import Reminder, ReminderLog
 from .serializers import ReminderSerializer, ReminderLogSerializer
-from stores.models import Store
+from .counters import get_user_stats
+from .pagination import KeysetPagination
+from .rollups import daily_trigger_counts
+from .triggers import get_trigger_set, nearest_store_distance
 
 class ReminderViewSet(viewsets.ModelViewSet):
     serializer_class = ReminderSerializer
@@ -14,6 +20,19 @@ class ReminderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Reminder.objects.filter(user=self.request.user)
 
+    # 統計カウンタをリマインダーの変更と同じトランザクションで更新する
+    @transaction.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+
     @action(detail=False, methods=['post'])
     def check_triggers(self, request):
         """現在位置をチェックして、トリガーされるリマインダーを返す"""
@@ -28,73 +47,135 @@ class ReminderViewSet(viewsets.ModelViewSet):
         except ValueError:
             return Response({'error': '無効な緯度経度です'}, status=status.HTTP_400_BAD_REQUEST)
 
-        triggered_reminders = []
-        active_reminders = self.get_queryset().filter(is_active=True)
-
-        for reminder in active_reminders:
-            # 指定された店舗タイプの近くの店舗を検索
-            nearby_stores = Store.objects.filter(
-                store_type=reminder.store_type
-            )
-            
-            # 現在位置から最も近い店舗を見つける
-            closest_store = None
-            min_distance = float('inf')
-            
-            for store in nearby_stores:
-                store_location = (float(store.latitude), float(store.longitude))
-                distance = geodesic(user_location, store_location).meters
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    closest_store = store
+        # キャッシュ済みのトリガーセットで判定（変更がなければリマインダー行は読まない）
+        now = timezone.now()
+        entitlements = get_entitlements(request.user.pk)
+        full_trigger_set = get_trigger_set(request.user.pk)
+        limits = (entitlements.max_active_reminders, entitlements.max_trigger_distance)
+        trigger_set = full_trigger_set.limited(*limits)
+        due_entries = trigger_set.due_entries(now.timestamp())
 
+        # 店舗タイプごとに最寄り店舗までの距離を一度だけ計算
+        due_types = {entry.store_type for entry in due_entries}
+        nearest_distances = {
+            store_type: nearest_store_distance(user_location, store_type, max_distance)
+            for store_type, max_distance in trigger_set.max_distances
+            if store_type in due_types
+        }
+
+        hit_distances = {}
+        for entry in due_entries:
+            min_distance = nearest_distances.get(entry.store_type)
             # 最も近い店舗がトリガー距離内の場合
-            if closest_store and min_distance <= reminder.trigger_distance:
-                now = timezone.now()
-                if (not reminder.last_triggered or 
-                    (now - reminder.last_triggered).total_seconds() > 3600):  # 1時間
-                    
+            if min_distance is not None and min_distance <= entry.trigger_distance:
+                hit_distances[entry.reminder_id] = min_distance
+
+        triggered_reminders = []
+        if hit_distances:
+            for reminder in self.get_queryset().filter(pk__in=hit_distances, is_active=True):
+                with transaction.atomic():
                     # ログを記録
                     ReminderLog.objects.create(
                         reminder=reminder,
+                        user=request.user,
                         user_latitude=latitude,
                         user_longitude=longitude,
-                        distance_to_store=min_distance
+                        distance_to_store=hit_distances[reminder.pk]
                     )
-                    
+
                     # 最後のトリガー時間を更新し、リマインダーを無効化
                     reminder.last_triggered = now
                     reminder.is_active = False  # アラート後にリマインダーを無効化
                     reminder.save()
-                    
-                    triggered_reminders.append(reminder)
+
+                triggered_reminders.append(reminder)
 
         serializer = ReminderSerializer(triggered_reminders, many=True)
         return Response({
             'triggered_reminders': serializer.data,
-            'count': len(triggered_reminders)
+            'count': len(triggered_reminders),
+            # プランの上限で通知されない・距離を縮めて判定したリマインダー
+            'over_limit_reminders': list(full_trigger_set.over_limit(*limits)),
         })
 
     @action(detail=False, methods=['get'])
     def logs(self, request):
-        """リマインダーのトリガーログを取得"""
-        logs = ReminderLog.objects.filter(reminder__user=request.user)
-        serializer = ReminderLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        """リマインダーのトリガーログを取得（キーセットページネーション）"""
+        logs = (
+            ReminderLog.objects
+            .filter(user=request.user)
+            .select_related('reminder')
+            .only('id', 'reminder_id', 'triggered_at', 'distance_to_store',
+                  'reminder__title', 'reminder__store_type')
+        )
+
+        # 期間・リマインダーでの絞り込み（任意）
+        since = request.query_params.get('since')
+        until = request.query_params.get('until')
+        reminder_id = request.query_params.get('reminder')
+        try:
+            if since:
+                logs = logs.filter(triggered_at__gte=self._parse_log_bound(since))
+            if until:
+                logs = logs.filter(triggered_at__lt=self._parse_log_bound(until, end_of_day=True))
+            if reminder_id:
+                logs = logs.filter(reminder_id=int(reminder_id))
+        except ValueError:
+            return Response({'error': '無効な絞り込み条件です'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(logs, request, view=self)
+        serializer = ReminderLogSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def _parse_log_bound(value, end_of_day=False):
+        """日時（ISO 8601）または日付をタイムゾーン付き日時に変換"""
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            if end_of_day:
+                day += timedelta(days=1)
+            parsed = datetime.combine(day, time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        """リマインダーの統計情報を取得"""
-        from django.db.models import Count, Q
-        
-        # 一度のクエリで統計を取得
-        stats = Reminder.objects.filter(user=request.user).aggregate(
-            total_reminders=Count('id'),
-            active_reminders=Count('id', filter=Q(is_active=True))
-        )
+        """リマインダーの統計情報を取得（増分更新されたカウンタ行を読むだけ）"""
+        stats = get_user_stats(request.user.pk)
         
         return Response({
-            'total_reminders': stats['total_reminders'] or 0,
-            'active_reminders': stats['active_reminders'] or 0
-        })
\ No newline at end of file
+            'total_reminders': stats.total_reminders,
+            'active_reminders': stats.active_reminders,
+            'total_triggers': stats.total_triggers,
+            'triggers_today': stats.triggers_today,
+            'triggers_week': stats.triggers_week,
+            'triggers_month': stats.triggers_month,
+            'last_triggered_at': stats.last_triggered_at
+        })
+
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        """日別のトリガー集計を取得（タイムライン用）"""
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), 366)
+        except ValueError:
+            return Response({'error': '無効な日数です'}, status=status.HTTP_400_BAD_REQUEST)
+
+        since_date = timezone.localdate() - timedelta(days=days - 1)
+        return Response({
+            'days': [
+                {
+                    'date': entry['date'],
+                    'trigger_count': entry['trigger_count'],
+                    'distance_avg': entry['distance_sum'] / entry['trigger_count'] if entry['trigger_count'] else None,
+                    'distance_min': entry['distance_min'],
+                    'distance_max': entry['distance_max'],
+                }
+                for entry in daily_trigger_counts(request.user, since_date)
+            ]
+        })
@@ -1,5 +1,10 @@
 # stores/admin.py
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from .clustering import parse_bbox, store_map_data
 from .models import Store
 
 @admin.register(Store)
@@ -22,4 +27,38 @@ class StoreAdmin(admin.ModelAdmin):
         }),
     )
     
-    readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'updated_at')
+
+    def get_urls(self):
+        urls = [
+            path('map/', self.admin_site.admin_view(self.map_view), name='stores_store_map'),
+            path('map/data/', self.admin_site.admin_view(self.map_data_view), name='stores_store_map_data'),
+        ]
+        return urls + super().get_urls()
+
+    def map_view(self, request):
+        """店舗マップ（表示範囲のデータをmap/data/から読み込む）"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': '店舗マップ',
+            'store_types': Store.STORE_TYPES,
+            'store_type_labels': dict(Store.STORE_TYPES),
+        }
+        return TemplateResponse(request, 'admin/stores/store/map.html', context)
+
+    def map_data_view(self, request):
+        """表示範囲（bbox=south,west,north,east）とズームに応じた店舗または集計"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            bbox = parse_bbox(request.GET.get('bbox', ''))
+            zoom = min(max(int(request.GET.get('zoom', '')), 0), 22)
+        except ValueError:
+            return JsonResponse({'error': 'bboxとzoomを正しく指定してください'}, status=400)
+
+        active = request.GET.get('active', '')
+        is_active = {'1': True, '0': False}.get(active)
+        return JsonResponse(store_map_data(bbox, zoom, request.GET.get('type') or None, is_active))
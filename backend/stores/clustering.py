@@ -0,0 +1,175 @@
+# stores/clustering.py
+"""
+管理画面の店舗マップ用のデータ。
+
+- 表示範囲（bbox）内の店舗だけを (latitude, longitude) のインデックスで絞り込む
+- ズームが小さいときはDB側で格子に丸めて集計（GROUP BY）し、セルごとの件数と重心だけを返す
+- ズームが大きくても範囲内の店舗がSTORE_MAP_MAX_POINTSを超える場合は集計を返す
+- 集計はズームとタイル（TILE_CELLS×TILE_CELLSセル）ごとにキャッシュし、表示範囲はタイルから組み立てる
+  （パンしても表示範囲に残ったタイルはキャッシュから返る）
+"""
+import hashlib
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, FloatField
+from django.db.models.functions import Cast, Floor
+
+from .models import Store
+
+# 格子の1セルの大きさ（ピクセル）。ズームごとの経度幅に換算する
+CELL_PIXELS = 64
+
+# キャッシュの単位となるタイルの1辺のセル数（地図タイルと同じ256ピクセル）
+TILE_CELLS = 256 // CELL_PIXELS
+
+# 1回の表示でタイルごとにキャッシュする上限。これを超える範囲はキャッシュせずに集計する
+MAX_CACHED_TILES = 256
+
+# 集計結果のキャッシュ保持時間（秒）。店舗の修正は拡大表示（個別表示）ですぐに確認できる
+CLUSTER_CACHE_TIMEOUT = 300
+
+
+def parse_bbox(value):
+    """'south,west,north,east' を数値のタプルにする（不正ならValueError）"""
+    south, west, north, east = (float(part) for part in value.split(','))
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= east <= 180):
+        raise ValueError(value)
+    return south, west, north, east
+
+
+def cell_size(zoom):
+    """ズームレベルでの格子の1辺（度）"""
+    return 360.0 / (2 ** zoom) * CELL_PIXELS / 256
+
+
+def _stores_in(bbox, store_type=None, is_active=None):
+    south, west, north, east = bbox
+    stores = Store.objects.filter(latitude__range=(south, north), longitude__range=(west, east))
+    if store_type:
+        stores = stores.filter(store_type=store_type)
+    if is_active is not None:
+        stores = stores.filter(is_active=is_active)
+    return stores.order_by()
+
+
+def _cells_bbox(min_x, min_y, end_x, end_y, size):
+    """セル番号の範囲（終端は含まない）を緯度経度の範囲にする"""
+    return (
+        max(-90.0, min_y * size), max(-180.0, min_x * size),
+        min(90.0, end_y * size), min(180.0, end_x * size),
+    )
+
+
+def _aggregate(bbox, size, store_type, is_active):
+    """範囲内の店舗をDB側でセルごとに集計し、{(cell_x, cell_y): 集計} を返す"""
+    rows = (
+        _stores_in(bbox, store_type, is_active)
+        .annotate(
+            cell_x=Floor(Cast('longitude', FloatField()) / size),
+            cell_y=Floor(Cast('latitude', FloatField()) / size),
+        )
+        .values('cell_x', 'cell_y', 'store_type')
+        .annotate(count=Count('id'), lat=Avg(Cast('latitude', FloatField())), lng=Avg(Cast('longitude', FloatField())))
+    )
+    cells = {}
+    for row in rows:
+        cell = cells.setdefault(
+            (int(row['cell_x']), int(row['cell_y'])), {'count': 0, 'lat': 0.0, 'lng': 0.0, 'types': {}}
+        )
+        # 店舗タイプごとの重心を件数で重み付けして合成する
+        cell['lat'] += row['lat'] * row['count']
+        cell['lng'] += row['lng'] * row['count']
+        cell['count'] += row['count']
+        cell['types'][row['store_type']] = row['count']
+
+    return {
+        key: {
+            'lat': round(cell['lat'] / cell['count'], 6),
+            'lng': round(cell['lng'] / cell['count'], 6),
+            'count': cell['count'],
+            'types': cell['types'],
+        }
+        for key, cell in cells.items()
+    }
+
+
+def _tile_key(zoom, tile, store_type, is_active):
+    filters = hashlib.sha256(repr((store_type, is_active)).encode()).hexdigest()[:16]
+    return f'stores:map_tile:{zoom}:{tile[0]}:{tile[1]}:{filters}'
+
+
+def _cached_cells(tiles, zoom, size, store_type, is_active):
+    """タイルごとのセル集計をキャッシュから取り、足りないタイルはまとめて集計してキャッシュする"""
+    keys = {_tile_key(zoom, tile, store_type, is_active): tile for tile in tiles}
+    cells = {}
+    cached = cache.get_many(keys)
+    for tile_cells in cached.values():
+        cells.update(tile_cells)
+
+    missing = [tile for key, tile in keys.items() if key not in cached]
+    if not missing:
+        return cells
+
+    # 足りないタイルを囲む範囲を1回で集計し、タイルに振り分ける（店舗のないタイルも空でキャッシュする）
+    min_x = min(tile_x for tile_x, _ in missing)
+    min_y = min(tile_y for _, tile_y in missing)
+    end_x = max(tile_x for tile_x, _ in missing) + 1
+    end_y = max(tile_y for _, tile_y in missing) + 1
+    bbox = _cells_bbox(min_x * TILE_CELLS, min_y * TILE_CELLS, end_x * TILE_CELLS, end_y * TILE_CELLS, size)
+    by_tile = {tile: {} for tile in missing}
+    for (cell_x, cell_y), cluster in _aggregate(bbox, size, store_type, is_active).items():
+        tile_cells = by_tile.get((cell_x // TILE_CELLS, cell_y // TILE_CELLS))
+        if tile_cells is not None:
+            tile_cells[(cell_x, cell_y)] = cluster
+    cache.set_many(
+        {key: by_tile[tile] for key, tile in keys.items() if tile in by_tile}, CLUSTER_CACHE_TIMEOUT
+    )
+    for tile_cells in by_tile.values():
+        cells.update(tile_cells)
+    return cells
+
+
+def cluster_stores(bbox, zoom, store_type=None, is_active=None):
+    """範囲内の店舗を格子ごとに集計する（件数・重心・店舗タイプ別の件数）"""
+    size = cell_size(zoom)
+    # 範囲をセル単位に広げる
+    south, west, north, east = bbox
+    min_x, min_y = math.floor(west / size), math.floor(south / size)
+    max_x, max_y = math.floor(east / size), math.floor(north / size)
+
+    tiles = [
+        (tile_x, tile_y)
+        for tile_x in range(min_x // TILE_CELLS, max_x // TILE_CELLS + 1)
+        for tile_y in range(min_y // TILE_CELLS, max_y // TILE_CELLS + 1)
+    ]
+    if len(tiles) > MAX_CACHED_TILES:
+        cells = _aggregate(_cells_bbox(min_x, min_y, max_x + 1, max_y + 1, size), size, store_type, is_active)
+    else:
+        cells = _cached_cells(tiles, zoom, size, store_type, is_active)
+
+    return [
+        cluster
+        for (cell_x, cell_y), cluster in cells.items()
+        if min_x <= cell_x <= max_x and min_y <= cell_y <= max_y
+    ]
+
+
+def store_map_data(bbox, zoom, store_type=None, is_active=None):
+    """マップに表示するデータ（個別の店舗または集計）"""
+    if zoom >= settings.STORE_MAP_CLUSTER_MAX_ZOOM:
+        limit = settings.STORE_MAP_MAX_POINTS
+        stores = list(
+            _stores_in(bbox, store_type, is_active)
+            .values('id', 'name', 'store_type', 'chain_name', 'latitude', 'longitude', 'is_active')[:limit + 1]
+        )
+        if len(stores) <= limit:
+            return {
+                'mode': 'stores',
+                'stores': [
+                    {**store, 'latitude': float(store['latitude']), 'longitude': float(store['longitude'])}
+                    for store in stores
+                ],
+            }
+    return {'mode': 'clusters', 'cell_size': cell_size(zoom), 'clusters': cluster_stores(bbox, zoom, store_type, is_active)}
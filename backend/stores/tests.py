@@ -1,3 +1,120 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from .clustering import cell_size, cluster_stores
+from .models import Store
+
+
+@override_settings(STORE_MAP_CLUSTER_MAX_ZOOM=14, STORE_MAP_MAX_POINTS=50)
+class StoreMapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        stores = []
+        # 東京駅付近に10×10、大阪駅付近に1店舗
+        for i in range(10):
+            for j in range(10):
+                stores.append(Store(name=f'東京{i}-{j}', store_type='convenience' if j % 2 else 'pharmacy',
+                                    address='東京都', latitude=35.68 + i * 0.0005, longitude=139.76 + j * 0.0005))
+        stores.append(Store(name='大阪', store_type='convenience', address='大阪府',
+                            latitude=34.70, longitude=135.49, is_active=False))
+        Store.objects.bulk_create(stores)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def get_data(self, **params):
+        response = self.client.get('/admin/stores/store/map/data/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_low_zoom_returns_clusters(self):
+        data = self.get_data(bbox='30,128,46,146', zoom=5)
+        self.assertEqual(data['mode'], 'clusters')
+        counts = sorted(cluster['count'] for cluster in data['clusters'])
+        self.assertEqual(counts, [1, 100])
+        tokyo = max(data['clusters'], key=lambda cluster: cluster['count'])
+        self.assertEqual(tokyo['types'], {'convenience': 50, 'pharmacy': 50})
+        self.assertAlmostEqual(tokyo['lat'], 35.68225, places=4)
+
+    def test_high_zoom_returns_stores(self):
+        # 4×4店舗の範囲のうち薬局は半分
+        data = self.get_data(bbox='35.6795,139.7595,35.6816,139.7616', zoom=17, type='pharmacy')
+        self.assertEqual(data['mode'], 'stores')
+        self.assertEqual(len(data['stores']), 8)
+        self.assertTrue(all(store['store_type'] == 'pharmacy' for store in data['stores']))
+
+    def test_high_zoom_with_too_many_stores_falls_back_to_clusters(self):
+        data = self.get_data(bbox='35.6,139.7,35.8,139.8', zoom=15)
+        self.assertEqual(data['mode'], 'clusters')
+        self.assertEqual(sum(cluster['count'] for cluster in data['clusters']), 100)
+
+    def test_filters_and_validation(self):
+        data = self.get_data(bbox='30,128,46,146', zoom=5, active='0')
+        self.assertEqual([cluster['count'] for cluster in data['clusters']], [1])
+        response = self.client.get('/admin/stores/store/map/data/', {'bbox': '1,2,3', 'zoom': 5})
+        self.assertEqual(response.status_code, 400)
+
+    def test_map_page(self):
+        response = self.client.get('/admin/stores/store/map/')
+        self.assertContains(response, '/admin/stores/store/map/data/')
+
+    def store_queries(self, bbox, zoom, **filters):
+        with CaptureQueriesContext(connection) as queries:
+            clusters = cluster_stores(bbox, zoom, **filters)
+        return clusters, len([query for query in queries if 'stores_store' in query['sql']])
+
+    def fresh(self, bbox, zoom, **filters):
+        cache.clear()
+        return cluster_stores(bbox, zoom, **filters)
+
+    def test_panning_reuses_cached_tiles(self):
+        # ズーム8のタイル（約1.4度四方、経度139.22〜140.63・緯度35.16〜36.56）の中で表示範囲を動かす
+        zoom = 8
+        first = (35.60, 139.70, 35.75, 139.85)
+        panned = (35.62, 139.75, 35.77, 140.15)  # セルの境界（経度139.92）をまたぐ
+        further = (35.62, 140.50, 35.77, 140.70)
+
+        clusters, queries = self.store_queries(first, zoom)
+        self.assertEqual(queries, 1)
+        clusters, queries = self.store_queries(panned, zoom)
+        self.assertEqual(queries, 0)
+        # 隣のタイルにかかったら、そのタイルの分だけ集計する
+        self.assertEqual(self.store_queries(further, zoom)[1], 1)
+        self.assertEqual(self.store_queries(further, zoom)[1], 0)
+
+        expected = self.fresh(panned, zoom)
+        self.assertEqual(sorted(clusters, key=lambda c: (c['lat'], c['lng'])),
+                         sorted(expected, key=lambda c: (c['lat'], c['lng'])))
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 100)
+
+    def test_tiles_are_cached_per_zoom_and_filter(self):
+        bbox = (35.6, 139.7, 35.8, 139.9)
+        self.assertEqual(self.store_queries(bbox, 12)[1], 1)
+        self.assertEqual(self.store_queries(bbox, 13)[1], 1)
+        clusters, queries = self.store_queries(bbox, 12, store_type='pharmacy')
+        self.assertEqual(queries, 1)
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 50)
+
+    def test_viewport_only_contains_cells_in_range(self):
+        # 1セル分だけの範囲は、キャッシュしたタイルの他のセルを返さない
+        zoom = 15
+        size = cell_size(zoom)
+        cell_y, cell_x = 35.68 // size, 139.76 // size
+        bbox = (cell_y * size + size * 0.1, cell_x * size + size * 0.1,
+                cell_y * size + size * 0.9, cell_x * size + size * 0.9)
+        self.assertEqual(cluster_stores(bbox, zoom), self.fresh(bbox, zoom))
+        self.assertEqual(len(cluster_stores(bbox, zoom)), 1)
+
+    def test_huge_viewport_is_aggregated_without_tile_cache(self):
+        with mock.patch('stores.clustering.MAX_CACHED_TILES', 1):
+            clusters = cluster_stores((30, 128, 46, 146), 10)
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 101)
+        self.assertEqual(sorted(cluster['count'] for cluster in clusters),
+                         sorted(cluster['count'] for cluster in self.fresh((30, 128, 46, 146), 10)))
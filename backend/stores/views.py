@@ -4,7 +4,6 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.db.models import Q
-from geopy.distance import geodesic
 from .models import Store
 from .serializers import StoreSerializer
 import logging
@@ -14,6 +13,9 @@ logger = logging.getLogger(__name__)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def nearby_stores(request):
+    # geopyはパッケージ読み込み時に全ジオコーダーをimportして重いので初回利用時に読み込む
+    from geopy.distance import geodesic
+
     latitude = request.GET.get('lat')
     longitude = request.GET.get('lng')
     store_type = request.GET.get('type', '')  # 'convenience' or 'pharmacy'
@@ -1,10 +1,17 @@
 # subscriptions/admin.py
+from datetime import timedelta
+
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Subscription, Payment
+from location_reminder.csv_export import CsvExportMixin
+from location_reminder.paginators import EstimatedCountPaginator
+from .models import Subscription, Payment, RevenueRollup, StripeEvent
+from .revenue import revenue_series
 
 @admin.register(Subscription)
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'user_display',
         'plan_type_display',
@@ -27,6 +34,25 @@ class SubscriptionAdmin(admin.ModelAdmin):
     )
     
     ordering = ('-created_at',)
+
+    # 一覧の行ごとにユーザーを読まない、全件のCOUNT(*)をしない
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    csv_export_columns = (
+        ('ID', 'id'),
+        ('ユーザーID', 'user_id'),
+        ('ユーザー名', 'user__username'),
+        ('メールアドレス', 'user__email'),
+        ('プラン', 'plan_type'),
+        ('ステータス', 'status'),
+        ('期間開始', 'current_period_start'),
+        ('期間終了', 'current_period_end'),
+        ('キャンセル日時', 'canceled_at'),
+        ('Stripe購読ID', 'stripe_subscription_id'),
+        ('作成日時', 'created_at'),
+    )
     
     readonly_fields = (
         'stripe_subscription_id',
@@ -110,7 +136,7 @@ class SubscriptionAdmin(admin.ModelAdmin):
     stripe_dashboard_link.short_description = 'Stripe'
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'user_display',
         'amount_display',
@@ -131,6 +157,23 @@ class PaymentAdmin(admin.ModelAdmin):
     )
     
     ordering = ('-created_at',)
+
+    # 一覧の行ごとにユーザーを読まない、全件のCOUNT(*)をしない
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    csv_export_columns = (
+        ('ID', 'id'),
+        ('作成日時', 'created_at'),
+        ('ユーザーID', 'user_id'),
+        ('ユーザー名', 'user__username'),
+        ('メールアドレス', 'user__email'),
+        ('金額', 'amount'),
+        ('通貨', 'currency'),
+        ('ステータス', 'status'),
+        ('Stripe PaymentIntent ID', 'stripe_payment_intent_id'),
+    )
     
     readonly_fields = (
         'stripe_payment_intent_id',
@@ -157,9 +200,10 @@ class PaymentAdmin(admin.ModelAdmin):
     
     def amount_display(self, obj):
         """金額を表示"""
+        # format_htmlは引数をエスケープ済み文字列にするので、桁区切りは先に付ける
         return format_html(
-            '<strong>¥{:,}</strong>',
-            int(obj.amount)
+            '<strong>¥{}</strong>',
+            f'{int(obj.amount):,}'
         )
     amount_display.short_description = '金額'
     
@@ -188,9 +232,69 @@ class PaymentAdmin(admin.ModelAdmin):
         return 'Stripe ID未設定'
     stripe_dashboard_link.short_description = 'Stripe'
 
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'created', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id',)
+    ordering = ('-created',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ('event_id', 'event_type', 'created', 'payload', 'attempts', 'last_error',
+                       'received_at', 'processed_at')
+
+@admin.register(RevenueRollup)
+class RevenueRollupAdmin(admin.ModelAdmin):
+    """売上ダッシュボード（日次・月次の集計行だけを読む）"""
+    list_display = ('period', 'period_start', 'currency', 'status', 'amount', 'payment_count', 'updated_at')
+    list_filter = ('period', 'currency', 'status')
+    ordering = ('-period_start',)
+
+    def has_add_permission(self, request):
+        """集計は決済から自動で更新されるため追加不可"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """集計は変更不可"""
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """集計の修復はrebuild_revenue_rollupsコマンドで行う"""
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        # 絞り込み条件付きなら通常の一覧を表示
+        if request.GET:
+            return super().changelist_view(request, extra_context)
+
+        today = timezone.localdate()
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': '売上ダッシュボード',
+            'monthly': self._pivot(revenue_series('month', since=today.replace(day=1) - timedelta(days=365))),
+            'daily': self._pivot(revenue_series('day', since=today - timedelta(days=30))),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/subscriptions/revenuerollup/dashboard.html', context)
+
+    @staticmethod
+    def _pivot(rows):
+        """(期間, 通貨) ごとに成功・失敗の金額と件数をまとめる"""
+        table = {}
+        for row in rows:
+            entry = table.setdefault((row['period_start'], row['currency']), {
+                'period_start': row['period_start'], 'currency': row['currency'],
+                'succeeded_amount': 0, 'succeeded_count': 0, 'failed_amount': 0, 'failed_count': 0,
+            })
+            prefix = 'succeeded' if row['status'] == 'succeeded' else 'failed' if row['status'] == 'failed' else None
+            if prefix:
+                entry[f'{prefix}_amount'] += row['amount']
+                entry[f'{prefix}_count'] += row['payment_count']
+        return list(table.values())
+
 # Django Admin のカスタマイズ
 from django.contrib.admin import AdminSite
-from django.template.response import TemplateResponse
 
 class LocationReminderAdminSite(AdminSite):
     site_header = '位置情報リマインダー 管理画面'
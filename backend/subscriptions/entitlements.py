@@ -0,0 +1,216 @@
+# subscriptions/entitlements.py
+"""
+ユーザーのプランと利用上限（エンタイトルメント）の解決とキャッシュ。
+
+- User.is_premium と Subscription（status・current_period_end）からプランを一度だけ解決し、
+  プロセス内キャッシュ（ENTITLEMENT_LOCAL_TTL秒）とDjangoキャッシュに持つ
+- Subscription・Userの変更時（Webhookの反映を含む）にユーザーごとのバージョンを進めて無効化する
+- 他プロセスのプロセス内キャッシュに残った古い値はENTITLEMENT_LOCAL_TTL秒で消える
+  （無効化が全ワーカーに届くのはDjangoキャッシュが共有されている場合だけ。
+  LocMemCacheの場合はキャッシュせず毎回DBから解決する）
+- プランの上限はsettings.PLAN_LIMITS（0は無制限）。値を変えると解決結果のキャッシュキーも変わる
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from location_reminder.caches import is_shared_cache
+from .models import Subscription
+from .serializers import SubscriptionSerializer
+
+# プレミアムとして扱う購読ステータス（支払い遅延中はStripeが再請求している間プレミアムを維持する）
+PREMIUM_STATUSES = ('active', 'past_due')
+
+# 更新のWebhookが遅れても期間終了直後にプランを落とさない猶予（秒）
+PERIOD_GRACE_SECONDS = 3 * 24 * 60 * 60
+
+# 解決結果のキャッシュ保持時間（秒）
+ENTITLEMENTS_TIMEOUT = 60 * 60
+
+_VERSION_KEY = 'subscriptions:entitlements_version:{user_id}'
+_ENTITLEMENTS_KEY = 'subscriptions:entitlements:{limits}:{user_id}:{version}'
+
+
+def plan_limits(plan):
+    """プランの上限（Noneは無制限）"""
+    limits = settings.PLAN_LIMITS[plan]
+    return {name: value or None for name, value in limits.items()}
+
+
+def _limits_digest():
+    # 上限の設定を変えたら古い解決結果を使わない
+    return hashlib.sha256(json.dumps(settings.PLAN_LIMITS, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class Entitlements(NamedTuple):
+    user_id: int
+    plan: str  # 'free' / 'premium'
+    max_active_reminders: Optional[int]  # Noneは無制限
+    max_trigger_distance: Optional[int]
+    subscription: Optional[dict]  # SubscriptionSerializerの出力（購読がなければNone）
+    valid_until: Optional[float]  # プレミアムが失効するUNIXタイムスタンプ（期限なしはNone）
+
+    @property
+    def is_premium(self):
+        return self.plan == 'premium'
+
+    @property
+    def limits(self):
+        return {
+            'max_active_reminders': self.max_active_reminders,
+            'max_trigger_distance': self.max_trigger_distance,
+        }
+
+    def is_current(self, now_ts):
+        """期間終了を過ぎたプレミアムの解決結果は使わない"""
+        return self.valid_until is None or now_ts < self.valid_until
+
+
+def _build(user, subscription, now_ts):
+    plan, valid_until = 'free', None
+    if subscription is not None:
+        if subscription.plan_type == 'premium' and subscription.status in PREMIUM_STATUSES:
+            period_end = subscription.current_period_end
+            if period_end is None:
+                plan = 'premium'
+            elif period_end.timestamp() + PERIOD_GRACE_SECONDS > now_ts:
+                plan, valid_until = 'premium', period_end.timestamp() + PERIOD_GRACE_SECONDS
+    elif user.is_premium:
+        # 購読を伴わない付与（管理画面から設定したもの）
+        plan = 'premium'
+
+    limits = plan_limits(plan)
+    return Entitlements(
+        user_id=user.pk,
+        plan=plan,
+        max_active_reminders=limits['max_active_reminders'],
+        max_trigger_distance=limits['max_trigger_distance'],
+        subscription=dict(SubscriptionSerializer(subscription).data) if subscription is not None else None,
+        valid_until=valid_until,
+    )
+
+
+def resolve_entitlements_many(user_ids):
+    """DBからまとめて解決する（キャッシュは使わない）。存在しないユーザーは含まれない"""
+    now_ts = time.time()
+    users = get_user_model().objects.filter(pk__in=user_ids).only('id', 'is_premium')
+    subscriptions = {sub.user_id: sub for sub in Subscription.objects.filter(user_id__in=user_ids)}
+    return {user.pk: _build(user, subscriptions.get(user.pk), now_ts) for user in users}
+
+
+class _LocalEntitlementCache:
+    """プロセス内のTTL付きキャッシュ（ユーザーID -> Entitlements）"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, entitlements = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            return entitlements
+
+    def set(self, user_id, entitlements):
+        with self._lock:
+            if len(self._entries) >= settings.ENTITLEMENT_LOCAL_SIZE:
+                # 上限に達したら期限切れを掃除し、それでも多ければ全て捨てる
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= settings.ENTITLEMENT_LOCAL_SIZE:
+                    self._entries.clear()
+            self._entries[user_id] = (time.monotonic() + settings.ENTITLEMENT_LOCAL_TTL, entitlements)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_entitlement_cache = _LocalEntitlementCache()
+
+
+def _current_versions(user_ids):
+    keys = {_VERSION_KEY.format(user_id=user_id): user_id for user_id in user_ids}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, user_id in keys.items():
+        if user_id not in versions:
+            # キーが追い出された場合でも古い解決結果を復活させないよう時刻ベースで初期化
+            cache.add(key, time.time_ns(), None)
+            versions[user_id] = cache.get(key)
+    return versions
+
+
+def get_entitlements_many(user_ids):
+    """複数ユーザーのエンタイトルメントを取得（プロセス内 → Djangoキャッシュ → DBの順）"""
+    if not is_shared_cache():
+        # 無効化が他のワーカーに届かないのでキャッシュしない
+        return resolve_entitlements_many(set(user_ids))
+    now_ts = time.time()
+    result = {}
+    missing = []
+    for user_id in set(user_ids):
+        entitlements = local_entitlement_cache.get(user_id)
+        if entitlements is not None and entitlements.is_current(now_ts):
+            result[user_id] = entitlements
+        else:
+            missing.append(user_id)
+    if not missing:
+        return result
+
+    versions = _current_versions(missing)
+    limits = _limits_digest()
+    keys = {
+        _ENTITLEMENTS_KEY.format(limits=limits, user_id=user_id, version=versions[user_id]): user_id
+        for user_id in missing
+    }
+    for key, entitlements in cache.get_many(keys).items():
+        if entitlements.is_current(now_ts):
+            result[keys[key]] = entitlements
+
+    unresolved = [user_id for user_id in missing if user_id not in result]
+    if unresolved:
+        resolved = resolve_entitlements_many(unresolved)
+        cache.set_many({
+            _ENTITLEMENTS_KEY.format(limits=limits, user_id=user_id, version=versions[user_id]): entitlements
+            for user_id, entitlements in resolved.items()
+        }, ENTITLEMENTS_TIMEOUT)
+        result.update(resolved)
+
+    for user_id in missing:
+        if user_id in result:
+            local_entitlement_cache.set(user_id, result[user_id])
+    return result
+
+
+def get_entitlements(user_id):
+    """ユーザーのエンタイトルメントを取得（キャッシュに当たればクエリを発行しない）"""
+    entitlements = get_entitlements_many([user_id]).get(user_id)
+    if entitlements is None:
+        raise get_user_model().DoesNotExist(f'ユーザー {user_id} が見つかりません')
+    return entitlements
+
+
+def invalidate_entitlements(user_id):
+    """ユーザーのエンタイトルメントのバージョンを進め、次回参照時に解決し直させる"""
+    local_entitlement_cache.delete(user_id)
+    key = _VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
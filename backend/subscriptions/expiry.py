@@ -0,0 +1,85 @@
+# subscriptions/expiry.py
+"""
+期間終了を過ぎても更新されなかった購読の失効処理。
+
+- (status, current_period_end) のインデックスをステータスごとに期間終了順に辿るので、
+  走査量は購読テーブル全体ではなく期限切れの行数に比例する
+- (current_period_end, id) のキーセットでチャンクに分け、チャンクごとに
+  Subscription.status と User.is_premium をまとめて更新する
+- update() はシグナルを発火しないので、エンタイトルメントと認証キャッシュはコミット後に明示的に破棄する
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import invalidate_token
+from .entitlements import PERIOD_GRACE_SECONDS, PREMIUM_STATUSES, invalidate_entitlements
+from .models import Subscription
+
+# 失効後のステータス
+EXPIRED_STATUS = 'inactive'
+
+
+def expiry_cutoff(now=None):
+    """この時刻より前に期間が終わった購読を失効させる（更新Webhookの遅れを猶予する）"""
+    return (now or timezone.now()) - timedelta(seconds=PERIOD_GRACE_SECONDS)
+
+
+def _invalidate_caches(user_ids):
+    for user_id in user_ids:
+        invalidate_entitlements(user_id)
+    for key in Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+def expire_batch(status, cutoff, after=None, batch_size=500, dry_run=False):
+    """
+    指定ステータスの期限切れ購読を (current_period_end, id) 順に最大batch_size件失効させる。
+    after は前回のチャンクの最後のキー。(処理件数, 最後のキー) を返し、なければ (0, None)。
+    """
+    with transaction.atomic():
+        rows = (
+            Subscription.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=status, current_period_end__lt=cutoff)
+        )
+        if after is not None:
+            period_end, pk = after
+            rows = rows.filter(Q(current_period_end__gt=period_end) | Q(current_period_end=period_end, pk__gt=pk))
+        rows = list(rows.order_by('current_period_end', 'id').values_list('id', 'user_id', 'current_period_end')[:batch_size])
+        if not rows:
+            return 0, None
+
+        last_key = (rows[-1][2], rows[-1][0])
+        if dry_run:
+            return len(rows), last_key
+
+        now = timezone.now()
+        subscription_ids = [pk for pk, _, _ in rows]
+        user_ids = [user_id for _, user_id, _ in rows]
+        Subscription.objects.filter(pk__in=subscription_ids).update(status=EXPIRED_STATUS, updated_at=now)
+        get_user_model().objects.filter(pk__in=user_ids, is_premium=True).update(is_premium=False)
+        transaction.on_commit(lambda: _invalidate_caches(user_ids))
+    return len(rows), last_key
+
+
+def expire_subscriptions(cutoff=None, batch_size=500, max_batches=None, dry_run=False, on_batch=None):
+    """期限切れの購読をすべて失効させ、失効させた件数を返す"""
+    cutoff = cutoff or expiry_cutoff()
+    total = 0
+    batches = 0
+    for status in PREMIUM_STATUSES:
+        after = None
+        while max_batches is None or batches < max_batches:
+            processed, after = expire_batch(status, cutoff, after, batch_size, dry_run)
+            if not processed:
+                break
+            total += processed
+            batches += 1
+            if on_batch:
+                on_batch(status, processed)
+    return total
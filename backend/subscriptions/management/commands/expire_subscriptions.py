@@ -0,0 +1,41 @@
+# subscriptions/management/commands/expire_subscriptions.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from subscriptions.expiry import expire_subscriptions, expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = '期間終了（＋猶予）を過ぎても更新されていない購読を失効させ、プレミアムを解除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='1トランザクションで処理する購読数')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='1回の実行で処理するバッチ数の上限')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='バッチ間の待機秒数（DB負荷の平準化用）')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='対象件数を数えるだけで更新しない')
+
+    def handle(self, *args, **options):
+        cutoff = expiry_cutoff()
+
+        def on_batch(status, processed):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {status}: {processed}件')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        total = expire_subscriptions(
+            cutoff=cutoff,
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            dry_run=options['dry_run'],
+            on_batch=on_batch,
+        )
+        verb = '失効対象です（dry-run）' if options['dry_run'] else '失効させました'
+        self.stdout.write(self.style.SUCCESS(
+            f'{cutoff:%Y-%m-%d %H:%M}より前に期間が終わった購読{total}件を{verb}'
+        ))
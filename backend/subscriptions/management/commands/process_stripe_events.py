@@ -0,0 +1,31 @@
+# subscriptions/management/commands/process_stripe_events.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from subscriptions.webhooks import process_batch
+
+
+class Command(BaseCommand):
+    help = '受信したStripe Webhookイベントを発生順にまとめて購読・決済情報へ反映する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='1トランザクションで処理するイベント数')
+        parser.add_argument('--loop', action='store_true',
+                            help='終了せずに新しいイベントを待ち続ける')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='--loop時、未処理イベントがないときの待機秒数')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_batch(options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件のイベントを処理しました'))
@@ -0,0 +1,12 @@
+# subscriptions/management/commands/rebuild_revenue_rollups.py
+from django.core.management.base import BaseCommand
+
+from subscriptions.revenue import rebuild_revenue_rollups
+
+
+class Command(BaseCommand):
+    help = '売上の日次・月次集計をPaymentテーブルから作り直す'
+
+    def handle(self, *args, **options):
+        days = rebuild_revenue_rollups()
+        self.stdout.write(self.style.SUCCESS(f'売上集計を再構築しました（日次{days}行）'))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0003_subscription_status_period_end_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', '日次'), ('month', '月次')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('status', models.CharField(max_length=50)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payment_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-period_start', 'currency', 'status'],
+                'unique_together': {('period', 'period_start', 'currency', 'status')},
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 # subscriptions/models.py
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class Subscription(models.Model):
     PLAN_TYPES = [
@@ -22,19 +23,82 @@ class Subscription(models.Model):
     current_period_start = models.DateTimeField(null=True, blank=True)
     current_period_end = models.DateTimeField(null=True, blank=True)
     canceled_at = models.DateTimeField(null=True, blank=True)
+    # 最後に反映したStripeイベントの発生時刻（これより古いイベントは反映しない）
+    last_event_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 期限切れの購読を期間終了順に拾うためのインデックス（expire_subscriptionsコマンド）
+            models.Index(fields=['status', 'current_period_end']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.get_plan_type_display()}"
 
 class Payment(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    stripe_payment_intent_id = models.CharField(max_length=255)
+    stripe_payment_intent_id = models.CharField(max_length=255, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='jpy')
     status = models.CharField(max_length=50)
+    # 最後に反映したStripeイベントの発生時刻
+    last_event_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.user.username} - ¥{self.amount}"
\ No newline at end of file
+        return f"{self.user.username} - ¥{self.amount}"
+
+
+class StripeEvent(models.Model):
+    """Stripe Webhookの受信箱（イベントIDで一意。ワーカーが順に処理する）"""
+    STATUS_CHOICES = [
+        ('pending', '未処理'),
+        ('processed', '処理済み'),
+        ('ignored', '対象外'),
+        ('failed', '処理失敗'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    created = models.DateTimeField()  # Stripe側のイベント発生時刻
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            # ワーカーが未処理のイベントを発生順に拾うためのインデックス
+            models.Index(fields=['status', 'created', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+class RevenueRollup(models.Model):
+    """Paymentの日次・月次集計（通貨×ステータスごと。決済の記録と同じトランザクションで増分更新）"""
+    PERIOD_CHOICES = [
+        ('day', '日次'),
+        ('month', '月次'),
+    ]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # TIME_ZONE基準の日付（月次は月初日）
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=50)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payment_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-period_start', 'currency', 'status']
+        unique_together = ('period', 'period_start', 'currency', 'status')
+
+    def __str__(self):
+        return f"{self.period} {self.period_start} {self.currency} {self.status} ({self.payment_count}件)"
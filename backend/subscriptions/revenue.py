@@ -0,0 +1,122 @@
+# subscriptions/revenue.py
+"""
+売上集計（RevenueRollup）の増分更新と読み出し。
+
+- Paymentの保存・削除時（Webhookの反映を含む）に、変更前後の寄与の差分だけを
+  日次・月次の集計行に加算する（同じトランザクション内）
+- 集計はPaymentの作成日（TIME_ZONE基準）・通貨・ステータスごと
+- レポートは集計行だけを読み、Paymentテーブル全体は集計しない
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Payment, RevenueRollup
+
+PERIODS = ('day', 'month')
+
+
+def _period_start(period, day):
+    return day if period == 'day' else day.replace(day=1)
+
+
+def payment_contribution(payment):
+    """集計への寄与 (日付, 通貨, ステータス, 金額)。未保存ならNone"""
+    # 遅延読み込みのフィールドがあっても追加クエリを発生させない
+    values = payment.__dict__
+    created_at = values.get('created_at')
+    if payment.pk is None or created_at is None or 'amount' not in values or 'status' not in values:
+        return None
+    return (
+        timezone.localdate(created_at),
+        values.get('currency') or 'jpy',
+        values['status'],
+        Decimal(values['amount'] or 0),
+    )
+
+
+def _apply_deltas(deltas):
+    now = timezone.now()
+    # ロック順を揃えてデッドロックを避ける
+    for key in sorted(deltas):
+        amount, count = deltas[key]
+        if not amount and not count:
+            continue
+        period, period_start, currency, status = key
+        rows = RevenueRollup.objects.filter(period=period, period_start=period_start, currency=currency, status=status)
+        if rows.update(amount=F('amount') + amount, payment_count=F('payment_count') + count, updated_at=now):
+            continue
+        try:
+            with transaction.atomic():
+                RevenueRollup.objects.create(period=period, period_start=period_start, currency=currency,
+                                             status=status, amount=amount, payment_count=count)
+        except IntegrityError:
+            # 同時に作成された場合は加算し直す
+            rows.update(amount=F('amount') + amount, payment_count=F('payment_count') + count, updated_at=now)
+
+
+def record_payment_change(before, after):
+    """Paymentの寄与の変化（payment_contributionの値、なければNone）を集計に反映（呼び出し元のトランザクション内）"""
+    if before == after:
+        return
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for contribution, sign in ((before, -1), (after, 1)):
+        if contribution is None:
+            continue
+        day, currency, status, amount = contribution
+        for period in PERIODS:
+            delta = deltas[(period, _period_start(period, day), currency, status)]
+            delta[0] += sign * amount
+            delta[1] += sign
+    _apply_deltas(deltas)
+
+
+@transaction.atomic
+def rebuild_revenue_rollups(batch_size=1000):
+    """Paymentテーブルから集計を作り直す（集計のずれの修復用。作成した日次集計の行数を返す）"""
+    daily = (
+        Payment.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'currency', 'status')
+        .annotate(amount_sum=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    rows = defaultdict(lambda: [Decimal(0), 0])
+    for row in daily.iterator():
+        for period in PERIODS:
+            entry = rows[(period, _period_start(period, row['day']), row['currency'], row['status'])]
+            entry[0] += row['amount_sum'] or 0
+            entry[1] += row['count']
+
+    RevenueRollup.objects.all().delete()
+    RevenueRollup.objects.bulk_create(
+        [
+            RevenueRollup(period=period, period_start=period_start, currency=currency, status=status,
+                          amount=amount, payment_count=count)
+            for (period, period_start, currency, status), (amount, count) in rows.items()
+        ],
+        batch_size=batch_size,
+    )
+    return sum(1 for key in rows if key[0] == 'day')
+
+
+def revenue_series(period, since=None, until=None, currency=None, status=None):
+    """集計行を期間の新しい順に返す（since・untilは期間の開始日で絞り込む。両端を含む）"""
+    rollups = RevenueRollup.objects.filter(period=period)
+    if since:
+        rollups = rollups.filter(period_start__gte=_period_start(period, since))
+    if until:
+        rollups = rollups.filter(period_start__lte=until)
+    if currency:
+        rollups = rollups.filter(currency=currency.lower())
+    if status:
+        rollups = rollups.filter(status=status)
+    return list(
+        rollups
+        .order_by('-period_start', 'currency', 'status')
+        .values('period_start', 'currency', 'status', 'amount', 'payment_count')
+    )
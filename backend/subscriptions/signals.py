@@ -0,0 +1,46 @@
+# subscriptions/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .entitlements import invalidate_entitlements
+from .models import Payment, Subscription
+from .revenue import payment_contribution, record_payment_change
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_entitlements(sender, instance, **kwargs):
+    """購読の変更（Webhookの反映・解約を含む）時にエンタイトルメントを無効化（コミット後）"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_entitlements(user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_entitlements(sender, instance, created, update_fields=None, **kwargs):
+    """is_premiumの変更に備えてユーザーの保存時にも無効化（last_loginだけの更新などは除く）"""
+    if created or (update_fields is not None and 'is_premium' not in update_fields):
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_entitlements(user_id))
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_contribution(sender, instance, **kwargs):
+    """売上集計の差分計算用に、読み込み時の寄与を覚えておく"""
+    instance._revenue_contribution = payment_contribution(instance)
+
+
+@receiver(post_save, sender=Payment)
+def count_payment_save(sender, instance, **kwargs):
+    """決済の記録・ステータス変更を売上集計に反映"""
+    contribution = payment_contribution(instance)
+    record_payment_change(instance._revenue_contribution, contribution)
+    instance._revenue_contribution = contribution
+
+
+@receiver(post_delete, sender=Payment)
+def count_payment_delete(sender, instance, **kwargs):
+    """決済の削除を売上集計に反映"""
+    record_payment_change(instance._revenue_contribution, None)
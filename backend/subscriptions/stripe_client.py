@@ -0,0 +1,318 @@
+# subscriptions/stripe_client.py
+"""
+Stripe APIの薄いクライアント。
+
+- HTTP接続はプロセス内で使い回す（requests.Sessionのコネクションプール）
+- 1回の呼び出しには全体の期限（STRIPE_DEADLINE秒）があり、各試行のタイムアウトは残り時間以内に収める
+- POSTには冪等キーを付け、再試行でも同じキーを使う（二重作成を防ぐ）
+- ネットワークエラー・429・5xxはジッター付き指数バックオフで再試行する
+- 失敗が続いたらサーキットブレーカーを開き、しばらくStripeを呼ばずに即座に失敗させる
+- 通信部分（バックエンド）はSTRIPE_BACKENDで差し替えられる（FakeStripeBackendはネットワーク不要）
+"""
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class StripeError(Exception):
+    """Stripe APIの呼び出しに失敗した"""
+
+    def __init__(self, message, status=None, code=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+class StripeUnavailable(StripeError):
+    """Stripeに接続できない（タイムアウト・サーキットブレーカーが開いている等）"""
+
+
+class TransientError(Exception):
+    """バックエンドが送出する再試行可能なエラー（ネットワークエラー・タイムアウト）"""
+
+
+def encode_params(params, prefix=None):
+    """Stripe形式のフォームパラメータ（items[0][price]=...）に変換"""
+    pairs = []
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f'{prefix}[{key}]' if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            pairs.extend(encode_params(value, name))
+        elif value is None:
+            continue
+        elif isinstance(value, bool):
+            pairs.append((name, 'true' if value else 'false'))
+        else:
+            pairs.append((name, str(value)))
+    return pairs
+
+
+class CircuitBreaker:
+    """連続failure_threshold回失敗したらreset_timeout秒間は呼び出しを止める（その後1回だけ試す）"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            # 半開状態: 1回だけ試す
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class HttpBackend:
+    """requestsのコネクションプールでStripe APIを呼ぶバックエンド"""
+
+    def __init__(self, api_key=None, base_url=None, pool_size=None):
+        # requestsは起動時間短縮のため初回利用時に読み込む
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._requests = requests
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY
+        self.base_url = (base_url or settings.STRIPE_API_BASE).rstrip('/')
+        pool_size = pool_size or settings.STRIPE_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, path, params, idempotency_key, timeout):
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        data = encode_params(params or {})
+        try:
+            response = self.session.request(
+                method, self.base_url + path, headers=headers,
+                data=data if method != 'GET' else None,
+                params=data if method == 'GET' else None,
+                timeout=timeout,
+            )
+        except self._requests.RequestException as e:
+            raise TransientError(str(e))
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+
+class FakeStripeBackend:
+    """
+    プロセス内で動く偽のStripe（テスト・負荷試験用）。
+    latency秒の遅延、failure_rateの確率での一時障害、fail_next()での障害注入ができる。
+    冪等キーが同じリクエストには最初の応答を返す。
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.customers = {}
+        self.subscriptions = {}
+        self.requests = []
+        self._responses = {}
+        self._failures = []
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def fail_next(self, count=1, status=None):
+        """次のcount回の呼び出しを失敗させる（statusなしならネットワークエラー）"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _new_id(self, prefix):
+        return f'{prefix}_fake{next(self._ids)}'
+
+    def request(self, method, path, params, idempotency_key, timeout):
+        with self._lock:
+            self.requests.append((method, path, idempotency_key))
+            failure = self._failures.pop(0) if self._failures else False
+            if failure is False and self.failure_rate and self._random.random() < self.failure_rate:
+                failure = None
+        if self.latency:
+            if self.latency > timeout:
+                time.sleep(timeout)
+                raise TransientError('timed out')
+            time.sleep(self.latency)
+        if failure is not False:
+            if failure is None:
+                raise TransientError('connection reset')
+            return failure, {'error': {'message': 'injected failure', 'type': 'api_error'}}
+
+        with self._lock:
+            if idempotency_key and idempotency_key in self._responses:
+                return self._responses[idempotency_key]
+            response = self._handle(method, path, params or {})
+            if idempotency_key:
+                self._responses[idempotency_key] = response
+            return response
+
+    def _handle(self, method, path, params):
+        parts = path.strip('/').split('/')
+        if method == 'POST' and parts == ['v1', 'customers']:
+            customer = {'id': self._new_id('cus'), 'object': 'customer',
+                        'email': params.get('email'), 'name': params.get('name')}
+            self.customers[customer['id']] = customer
+            return 200, customer
+        if method == 'POST' and parts == ['v1', 'subscriptions']:
+            if params.get('customer') not in self.customers:
+                return 404, {'error': {'message': 'No such customer', 'code': 'resource_missing'}}
+            subscription = {
+                'id': self._new_id('sub'), 'object': 'subscription', 'customer': params['customer'],
+                'status': 'incomplete', 'items': {'data': params.get('items', [])},
+                'latest_invoice': {
+                    'id': self._new_id('in'),
+                    'payment_intent': {'id': self._new_id('pi'), 'client_secret': self._new_id('pi_secret')},
+                },
+            }
+            self.subscriptions[subscription['id']] = subscription
+            return 200, subscription
+        if method == 'GET' and len(parts) == 3 and parts[:2] == ['v1', 'subscriptions']:
+            subscription = self.subscriptions.get(parts[2])
+            if subscription is None:
+                return 404, {'error': {'message': 'No such subscription', 'code': 'resource_missing'}}
+            return 200, subscription
+        if method == 'DELETE' and len(parts) == 3 and parts[:2] == ['v1', 'subscriptions']:
+            subscription = self.subscriptions.get(parts[2])
+            if subscription is None:
+                return 404, {'error': {'message': 'No such subscription', 'code': 'resource_missing'}}
+            subscription['status'] = 'canceled'
+            return 200, subscription
+        return 404, {'error': {'message': f'Unrecognized request URL ({method} {path})'}}
+
+
+class StripeClient:
+    def __init__(self, backend, timeout=None, deadline=None, max_retries=None, breaker=None):
+        self.backend = backend
+        self.timeout = settings.STRIPE_TIMEOUT if timeout is None else timeout
+        self.deadline = settings.STRIPE_DEADLINE if deadline is None else deadline
+        self.max_retries = settings.STRIPE_MAX_RETRIES if max_retries is None else max_retries
+        self.breaker = breaker or CircuitBreaker(settings.STRIPE_CIRCUIT_FAILURES, settings.STRIPE_CIRCUIT_RESET)
+
+    def _backoff(self, attempt):
+        # フルジッター（0〜基準値のランダム）
+        return random.uniform(0, min(settings.STRIPE_RETRY_MAX_DELAY, settings.STRIPE_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def request(self, method, path, params=None, idempotency_key=None):
+        if not self.breaker.allow():
+            raise StripeUnavailable('Stripeへの接続を一時停止しています（障害検知中）')
+
+        if method == 'POST' and not idempotency_key:
+            idempotency_key = str(uuid.uuid4())
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                status, body = self.backend.request(
+                    method, path, params, idempotency_key, timeout=min(self.timeout, remaining)
+                )
+            except TransientError as e:
+                last_error = StripeUnavailable(f'Stripeへの接続に失敗しました: {e}')
+            else:
+                if status < 400:
+                    self.breaker.record_success()
+                    return body
+                error = (body or {}).get('error') or {}
+                last_error = StripeError(error.get('message', f'Stripe APIエラー（{status}）'),
+                                         status=status, code=error.get('code'))
+                if status != 429 and status < 500:
+                    # リクエスト自体の誤りは再試行しない（Stripeは正常に応答している）
+                    self.breaker.record_success()
+                    raise last_error
+
+            delay = self._backoff(attempt)
+            if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+
+        self.breaker.record_failure()
+        if isinstance(last_error, StripeUnavailable):
+            raise last_error
+        raise StripeUnavailable(str(last_error or 'Stripeの応答が期限内にありませんでした'),
+                                status=getattr(last_error, 'status', None))
+
+    @staticmethod
+    def idempotency_key(prefix, params):
+        """同じ内容の操作に同じキーを振る（クライアントの二重送信で二重作成しない）"""
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:32]
+        return f'{prefix}-{digest}'
+
+    def create_customer(self, email, name, idempotency_key=None):
+        params = {'email': email, 'name': name}
+        return self.request('POST', '/v1/customers', params, idempotency_key)
+
+    def create_subscription(self, customer, price, idempotency_key=None):
+        params = {
+            'customer': customer,
+            'items': [{'price': price}],
+            'payment_behavior': 'default_incomplete',
+            'expand': ['latest_invoice.payment_intent'],
+        }
+        return self.request('POST', '/v1/subscriptions', params, idempotency_key)
+
+    def retrieve_subscription(self, subscription_id):
+        return self.request('GET', f'/v1/subscriptions/{subscription_id}')
+
+    def cancel_subscription(self, subscription_id):
+        return self.request('DELETE', f'/v1/subscriptions/{subscription_id}')
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_stripe_client():
+    """プロセス共通のクライアント（初回呼び出し時にSTRIPE_BACKENDのバックエンドで作成）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = StripeClient(import_string(settings.STRIPE_BACKEND)())
+    return _client
+
+
+def reset_stripe_client():
+    """設定変更後にクライアントを作り直す（テスト用）"""
+    global _client
+    with _client_lock:
+        _client = None
@@ -1,3 +1,532 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import random
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.authentication import local_token_cache
+from accounts.models import User
+from reminders.models import Reminder
+from .entitlements import _LocalEntitlementCache, get_entitlements, local_entitlement_cache, plan_limits
+from .models import Payment, RevenueRollup, StripeEvent, Subscription
+from .revenue import rebuild_revenue_rollups
+from .stripe_client import (
+    CircuitBreaker, FakeStripeBackend, StripeClient, StripeError, StripeUnavailable, get_stripe_client,
+    reset_stripe_client,
+)
+
+WEBHOOK_SECRET = 'whsec_test'
+
+# 上限を設定した場合のプラン（既定は無制限）
+LIMITED_PLANS = {
+    'free': {'max_active_reminders': 2, 'max_trigger_distance': 100},
+    'premium': {'max_active_reminders': 0, 'max_trigger_distance': 0},
+}
+
+# 記録したイベント列（作成 → 初回請求 → 更新 → 支払い失敗 → 支払い成功 → 解約）
+BASE_TIME = 1760000000
+RECORDED_EVENTS = [
+    {
+        'id': 'evt_001', 'type': 'customer.subscription.created', 'created': BASE_TIME,
+        'data': {'object': {'id': 'sub_1', 'customer': 'cus_1', 'status': 'incomplete',
+                            'current_period_start': BASE_TIME, 'current_period_end': BASE_TIME + 2592000}},
+    },
+    {
+        'id': 'evt_002', 'type': 'invoice.paid', 'created': BASE_TIME + 10,
+        'data': {'object': {'id': 'in_1', 'customer': 'cus_1', 'payment_intent': 'pi_1',
+                            'amount_paid': 480, 'currency': 'jpy'}},
+    },
+    {
+        'id': 'evt_003', 'type': 'customer.subscription.updated', 'created': BASE_TIME + 11,
+        'data': {'object': {'id': 'sub_1', 'customer': 'cus_1', 'status': 'active',
+                            'current_period_start': BASE_TIME, 'current_period_end': BASE_TIME + 2592000}},
+    },
+    {
+        'id': 'evt_004', 'type': 'invoice.payment_failed', 'created': BASE_TIME + 2592000,
+        'data': {'object': {'id': 'in_2', 'customer': 'cus_1', 'payment_intent': 'pi_2',
+                            'amount_due': 480, 'currency': 'jpy'}},
+    },
+    {
+        'id': 'evt_005', 'type': 'invoice.paid', 'created': BASE_TIME + 2592100,
+        'data': {'object': {'id': 'in_2', 'customer': 'cus_1', 'payment_intent': 'pi_2',
+                            'amount_paid': 480, 'currency': 'jpy'}},
+    },
+    {
+        'id': 'evt_006', 'type': 'customer.subscription.deleted', 'created': BASE_TIME + 2600000,
+        'data': {'object': {'id': 'sub_1', 'customer': 'cus_1', 'status': 'canceled',
+                            'canceled_at': BASE_TIME + 2600000}},
+    },
+]
+
+
+def signed_headers(payload, secret=WEBHOOK_SECRET, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return {'HTTP_STRIPE_SIGNATURE': f't={timestamp},v1={signature}'}
+
+
+class WebhookReplayMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='stripe', email='stripe@example.com', password='password', stripe_customer_id='cus_1'
+        )
+
+    def deliver(self, event):
+        payload = json.dumps(event)
+        return self.client.post('/api/subscriptions/webhook/', payload,
+                                content_type='application/json', **signed_headers(payload))
+
+    def replay(self, events):
+        for event in events:
+            self.assertEqual(self.deliver(event).status_code, 200)
+        call_command('process_stripe_events', stdout=StringIO())
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(WebhookReplayMixin, TestCase):
+    def assert_final_state(self):
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual(subscription.status, 'canceled')
+        self.assertEqual(subscription.stripe_subscription_id, 'sub_1')
+        self.assertIsNotNone(subscription.canceled_at)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_premium)
+        payments = {p.stripe_payment_intent_id: p for p in Payment.objects.all()}
+        self.assertEqual(set(payments), {'pi_1', 'pi_2'})
+        self.assertEqual(payments['pi_2'].status, 'succeeded')
+        self.assertEqual(int(payments['pi_1'].amount), 480)
+
+    def test_rejects_invalid_signature(self):
+        payload = json.dumps(RECORDED_EVENTS[0])
+        response = self.client.post('/api/subscriptions/webhook/', payload, content_type='application/json',
+                                    **signed_headers(payload, secret='whsec_wrong'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_replay_in_order(self):
+        self.replay(RECORDED_EVENTS)
+        self.assert_final_state()
+        self.assertEqual(StripeEvent.objects.filter(status='processed').count(), len(RECORDED_EVENTS))
+
+    def test_duplicate_deliveries_are_stored_once(self):
+        self.replay(RECORDED_EVENTS + RECORDED_EVENTS[:3])
+        self.assertEqual(StripeEvent.objects.count(), len(RECORDED_EVENTS))
+        # 処理済みのイベントが再送されても状態は変わらない
+        self.replay(RECORDED_EVENTS)
+        self.assert_final_state()
+
+    def test_shuffled_deliveries_in_one_batch(self):
+        events = RECORDED_EVENTS[:]
+        random.Random(42).shuffle(events)
+        self.replay(events)
+        self.assert_final_state()
+
+    def test_out_of_order_deliveries_across_batches(self):
+        # 新しいイベントが先に反映され、古いイベントが後から届く
+        for event in reversed(RECORDED_EVENTS):
+            self.replay([event])
+        self.assert_final_state()
+        self.assertTrue(StripeEvent.objects.filter(status='ignored').exists())
+
+    def test_revenue_rollups_follow_payment_changes(self):
+        self.replay(RECORDED_EVENTS)
+
+        def snapshot():
+            return sorted(
+                RevenueRollup.objects.filter(payment_count__gt=0)
+                .values_list('period', 'period_start', 'currency', 'status', 'amount', 'payment_count')
+            )
+
+        incremental = snapshot()
+        # 失敗 → 成功に変わったpi_2は成功側にだけ数えられる
+        self.assertEqual([row[3:] for row in incremental if row[0] == 'month'], [('succeeded', 960, 2)])
+        rebuild_revenue_rollups()
+        self.assertEqual(snapshot(), incremental)
+
+    def test_event_for_unknown_customer_is_retried(self):
+        User.objects.filter(pk=self.user.pk).update(stripe_customer_id='')
+        self.replay(RECORDED_EVENTS[:1])
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.status, 'pending')
+        self.assertEqual(event.attempts, 1)
+
+        User.objects.filter(pk=self.user.pk).update(stripe_customer_id='cus_1')
+        StripeEvent.objects.update(next_attempt_at=event.received_at)
+        call_command('process_stripe_events', stdout=StringIO())
+        self.assertEqual(StripeEvent.objects.get().status, 'processed')
+        self.assertEqual(Subscription.objects.get(user=self.user).status, 'inactive')
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                   STRIPE_BACKEND='subscriptions.stripe_client.FakeStripeBackend',
+                   STRIPE_RETRY_BASE_DELAY=0, STRIPE_RETRY_MAX_DELAY=0, STRIPE_DEADLINE=1)
+class SameSecondWebhookTests(WebhookReplayMixin, TestCase):
+    """Stripeのcreatedは秒単位なので、同じ秒のイベントは受信順に関係なく状態で前後を決める"""
+    TIE = BASE_TIME + 20
+
+    def setUp(self):
+        super().setUp()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        self.replay(RECORDED_EVENTS[:3])
+
+    def subscription_event(self, event_id, event_type, status, period_end=BASE_TIME + 2592000):
+        return {
+            'id': event_id, 'type': event_type, 'created': self.TIE,
+            'data': {'object': {'id': 'sub_1', 'customer': 'cus_1', 'status': status,
+                                'current_period_start': BASE_TIME, 'current_period_end': period_end}},
+        }
+
+    def assert_subscription(self, status, is_premium):
+        self.assertEqual(Subscription.objects.get(user=self.user).status, status)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.is_premium, is_premium)
+
+    def test_update_after_cancel_in_same_second_does_not_resurrect(self):
+        deleted = self.subscription_event('evt_101', 'customer.subscription.deleted', 'canceled')
+        updated = self.subscription_event('evt_102', 'customer.subscription.updated', 'active')
+        # 同じバッチでも（受信箱のIDは解約が先）、別々のバッチでも解約が残る
+        self.replay([deleted, updated])
+        self.assert_subscription('canceled', False)
+        self.assertEqual(StripeEvent.objects.get(event_id='evt_102').status, 'ignored')
+
+        StripeEvent.objects.filter(event_id__in=['evt_101', 'evt_102']).delete()
+        self.replay([self.subscription_event('evt_103', 'customer.subscription.updated', 'active')])
+        self.assert_subscription('canceled', False)
+
+    def test_cancel_after_update_in_same_second_is_applied(self):
+        self.replay([self.subscription_event('evt_101', 'customer.subscription.updated', 'past_due')])
+        self.replay([self.subscription_event('evt_102', 'customer.subscription.deleted', 'canceled')])
+        self.assert_subscription('canceled', False)
+
+    def test_later_period_wins_in_same_second(self):
+        renewed = self.subscription_event('evt_101', 'customer.subscription.updated', 'active',
+                                          period_end=BASE_TIME + 2 * 2592000)
+        stale = self.subscription_event('evt_102', 'customer.subscription.updated', 'past_due')
+        self.replay([renewed, stale])
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual(subscription.status, 'active')
+        self.assertEqual(subscription.current_period_end.timestamp(), BASE_TIME + 2 * 2592000)
+
+    def test_ambiguous_same_second_state_is_fetched_from_stripe(self):
+        backend = get_stripe_client().backend
+        backend.subscriptions['sub_1'] = {
+            'id': 'sub_1', 'customer': 'cus_1', 'status': 'past_due',
+            'current_period_start': BASE_TIME, 'current_period_end': BASE_TIME + 2592000,
+        }
+        self.replay([self.subscription_event('evt_101', 'customer.subscription.updated', 'past_due'),
+                     self.subscription_event('evt_102', 'customer.subscription.updated', 'active')])
+        self.assert_subscription('past_due', True)
+        self.assertIn(('GET', '/v1/subscriptions/sub_1', None), backend.requests)
+
+    def test_ambiguous_same_second_state_waits_for_stripe(self):
+        get_stripe_client().backend.fail_next(10)
+        self.replay([self.subscription_event('evt_101', 'customer.subscription.updated', 'past_due'),
+                     self.subscription_event('evt_102', 'customer.subscription.updated', 'active')])
+        event = StripeEvent.objects.get(event_id='evt_102')
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertIn('sub_1', event.last_error)
+        self.assert_subscription('past_due', True)
+
+
+@override_settings(STRIPE_RETRY_BASE_DELAY=0, STRIPE_RETRY_MAX_DELAY=0)
+class StripeClientTests(TestCase):
+    def setUp(self):
+        self.backend = FakeStripeBackend()
+        self.client_ = StripeClient(self.backend, timeout=1, deadline=5, max_retries=2,
+                                    breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    def test_transient_failures_are_retried_with_same_idempotency_key(self):
+        self.backend.fail_next(1)
+        self.backend.fail_next(1, status=503)
+        customer = self.client_.create_customer('a@example.com', 'a')
+        self.assertIn(customer['id'], self.backend.customers)
+        keys = {key for _, _, key in self.backend.requests}
+        self.assertEqual(len(self.backend.requests), 3)
+        self.assertEqual(len(keys), 1)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(StripeError) as cm:
+            self.client_.create_subscription('cus_missing', 'price_x')
+        self.assertEqual(cm.exception.code, 'resource_missing')
+        self.assertNotIsInstance(cm.exception, StripeUnavailable)
+        self.assertEqual(len(self.backend.requests), 1)
+        self.assertFalse(self.client_.breaker.is_open)
+
+    def test_slow_backend_is_bounded_by_deadline(self):
+        self.backend.latency = 0.2
+        client = StripeClient(self.backend, timeout=0.05, deadline=0.12, max_retries=5)
+        started = time.monotonic()
+        with self.assertRaises(StripeUnavailable):
+            client.create_customer('a@example.com', 'a')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_breaker_opens_after_repeated_failures(self):
+        self.backend.fail_next(6)
+        for _ in range(2):
+            with self.assertRaises(StripeUnavailable):
+                self.client_.create_customer('a@example.com', 'a')
+        self.assertTrue(self.client_.breaker.is_open)
+        calls = len(self.backend.requests)
+        with self.assertRaises(StripeUnavailable):
+            self.client_.create_customer('a@example.com', 'a')
+        self.assertEqual(len(self.backend.requests), calls)
+
+
+@override_settings(STRIPE_BACKEND='subscriptions.stripe_client.FakeStripeBackend',
+                   STRIPE_RETRY_BASE_DELAY=0, STRIPE_RETRY_MAX_DELAY=0)
+class SubscriptionViewTests(TestCase):
+    def setUp(self):
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_repeated_create_reuses_stripe_subscription(self):
+        first = self.api.post('/api/subscriptions/create/')
+        second = self.api.post('/api/subscriptions/create/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data, second.data)
+        self.assertTrue(first.data['client_secret'])
+        backend = get_stripe_client().backend
+        self.assertEqual(len(backend.customers), 1)
+        self.assertEqual(len(backend.subscriptions), 1)
+
+    def test_cancel(self):
+        self.api.post('/api/subscriptions/create/')
+        response = self.api.post('/api/subscriptions/cancel/')
+        self.assertEqual(response.status_code, 200)
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual(subscription.status, 'canceled')
+        backend = get_stripe_client().backend
+        self.assertEqual(backend.subscriptions[subscription.stripe_subscription_id]['status'], 'canceled')
+
+    def test_resubscribe_after_cancel_creates_new_subscription(self):
+        first = self.api.post('/api/subscriptions/create/').data
+        self.api.post('/api/subscriptions/cancel/')
+        second = self.api.post('/api/subscriptions/create/').data
+        self.assertNotEqual(first['subscription_id'], second['subscription_id'])
+        self.assertEqual(Subscription.objects.get(user=self.user).stripe_subscription_id, second['subscription_id'])
+
+    def test_token_authenticated_writes_keep_other_fields(self):
+        # 認証キャッシュのスナップショットが古くても、他のフィールドを上書きしない
+        token = Token.objects.create(user=self.user)
+        local_token_cache.clear()
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(api.get('/api/auth/profile/').status_code, 200)
+        # シグナルを送らない更新なのでキャッシュ済みのスナップショットはそのまま
+        User.objects.filter(pk=self.user.pk).update(phone_number='09012345678', is_premium=True)
+
+        self.assertEqual(api.post('/api/subscriptions/create/').status_code, 200)
+        self.assertEqual(api.post('/api/subscriptions/cancel/').status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.phone_number, '09012345678')
+        self.assertTrue(user.stripe_customer_id)
+        self.assertFalse(user.is_premium)
+
+    def test_stripe_outage_returns_503(self):
+        get_stripe_client().backend.fail_next(10)
+        response = self.api.post('/api/subscriptions/create/')
+        self.assertEqual(response.status_code, 503)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                   STRIPE_BACKEND='subscriptions.stripe_client.FakeStripeBackend')
+class EntitlementTests(TestCase):
+    def setUp(self):
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        cache.clear()
+        local_entitlement_cache.clear()
+        self.user = User.objects.create_user(
+            username='member', email='member@example.com', password='password', stripe_customer_id='cus_1'
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_status_is_served_from_cache(self):
+        first = self.api.get('/api/subscriptions/status/')
+        self.assertEqual(first.data['plan'], 'free')
+        # 既定では上限なし
+        self.assertEqual(first.data['limits'], {'max_active_reminders': None, 'max_trigger_distance': None})
+        self.assertEqual(first.data['over_limit_reminders'], [])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.api.get('/api/subscriptions/status/')
+        self.assertFalse([q for q in queries if 'subscriptions_subscription' in q['sql']])
+        self.assertEqual(first.data, second.data)
+
+    def test_webhook_events_invalidate_entitlements(self):
+        self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+        # 記録したイベントの期間は過去なので、現在を含む期間に置き換える
+        period_end = int(time.time()) + 2592000
+        events = json.loads(json.dumps(RECORDED_EVENTS[:3]))
+        for event in events:
+            if event['type'].startswith('customer.subscription'):
+                event['data']['object']['current_period_end'] = period_end
+        with self.captureOnCommitCallbacks(execute=True):
+            for event in events:
+                payload = json.dumps(event)
+                self.client.post('/api/subscriptions/webhook/', payload,
+                                 content_type='application/json', **signed_headers(payload))
+            call_command('process_stripe_events', stdout=StringIO())
+        entitlements = get_entitlements(self.user.pk)
+        self.assertTrue(entitlements.is_premium)
+        self.assertEqual(entitlements.subscription['status'], 'active')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.api.post('/api/subscriptions/cancel/').status_code, 200)
+        self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+
+    def test_lapsed_period_falls_back_to_free(self):
+        Subscription.objects.create(user=self.user, plan_type='premium', status='active',
+                                    current_period_end=timezone.now() - timedelta(days=30))
+        self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+
+    def test_reminder_limits_are_enforced(self):
+        with override_settings(PLAN_LIMITS=LIMITED_PLANS):
+            limits = plan_limits('free')
+            response = self.api.post('/api/reminders/', {
+                'title': '遠すぎる', 'trigger_distance': limits['max_trigger_distance'] + 1,
+            }, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('trigger_distance', response.data)
+
+            for i in range(limits['max_active_reminders']):
+                response = self.api.post('/api/reminders/', {'title': f'買い物{i}'}, format='json')
+                self.assertEqual(response.status_code, 201)
+            response = self.api.post('/api/reminders/', {'title': '上限超え'}, format='json')
+            self.assertEqual(response.status_code, 400)
+            # 無効なリマインダーなら作成できる
+            response = self.api.post('/api/reminders/', {'title': '無効', 'is_active': False}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def test_no_limits_by_default(self):
+        for i in range(8):
+            response = self.api.post('/api/reminders/', {'title': f'買い物{i}', 'trigger_distance': 5000},
+                                     format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def test_reminders_over_limit_are_reported(self):
+        # 上限を下げる前に作られたリマインダーは消さずに、通知されないものとして示す
+        with self.captureOnCommitCallbacks(execute=True):
+            oldest = Reminder.objects.create(user=self.user, title='古い', trigger_distance=30)
+            far = Reminder.objects.create(user=self.user, title='遠い', trigger_distance=500)
+            Reminder.objects.create(user=self.user, title='新しい', trigger_distance=30)
+        with override_settings(PLAN_LIMITS=LIMITED_PLANS):
+            local_entitlement_cache.clear()
+            status_data = self.api.get('/api/subscriptions/status/').data
+            self.assertEqual(status_data['limits'], {'max_active_reminders': 2, 'max_trigger_distance': 100})
+            self.assertEqual(sorted(status_data['over_limit_reminders']), sorted([oldest.pk, far.pk]))
+
+            response = self.api.post('/api/reminders/check_triggers/', {'lat': 35.0, 'lng': 139.0}, format='json')
+            self.assertEqual(sorted(response.data['over_limit_reminders']), sorted([oldest.pk, far.pk]))
+        local_entitlement_cache.clear()
+
+    def test_invalidation_reaches_other_worker(self):
+        # 別プロセスのワーカー（プロセス内キャッシュは別物、Djangoキャッシュは同じ設定の別接続）
+        other_worker = mock.patch.multiple(
+            'subscriptions.entitlements', cache=caches.create_connection('default'),
+            local_entitlement_cache=_LocalEntitlementCache(),
+        )
+        with override_settings(ENTITLEMENT_LOCAL_TTL=0):
+            with other_worker:
+                self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+            with self.captureOnCommitCallbacks(execute=True):
+                Subscription.objects.create(user=self.user, plan_type='premium', status='active',
+                                            current_period_end=timezone.now() + timedelta(days=30))
+            with other_worker:
+                self.assertEqual(get_entitlements(self.user.pk).plan, 'premium')
+
+    def test_local_layer_is_stale_for_at_most_ttl(self):
+        worker_cache = _LocalEntitlementCache()
+        other_worker = mock.patch.multiple(
+            'subscriptions.entitlements', cache=caches.create_connection('default'),
+            local_entitlement_cache=worker_cache,
+        )
+        with other_worker:
+            self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(user=self.user, plan_type='premium', status='active')
+        with other_worker:
+            # ENTITLEMENT_LOCAL_TTL秒まではプロセス内の値を使う
+            self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+            with mock.patch('subscriptions.entitlements.time.monotonic',
+                            return_value=time.monotonic() + settings.ENTITLEMENT_LOCAL_TTL + 1):
+                self.assertEqual(get_entitlements(self.user.pk).plan, 'premium')
+
+    def test_process_local_cache_resolves_from_database(self):
+        self.assertEqual(get_entitlements(self.user.pk).plan, 'free')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            Subscription.objects.create(user=self.user, plan_type='premium', status='active')
+            self.assertEqual(get_entitlements(self.user.pk).plan, 'premium')
+            with self.assertNumQueries(2):
+                get_entitlements(self.user.pk)
+
+class SubscriptionExpiryTests(TestCase):
+    def test_expires_lapsed_subscriptions_in_chunks(self):
+        now = timezone.now()
+        lapsed = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'lapsed{i}', email=f'lapsed{i}@example.com',
+                                            password='password', is_premium=True)
+            Subscription.objects.create(user=user, plan_type='premium', status='active' if i % 2 else 'past_due',
+                                        current_period_end=now - timedelta(days=10, minutes=i))
+            lapsed.append(user)
+        current = User.objects.create_user(username='current', email='current@example.com',
+                                           password='password', is_premium=True)
+        Subscription.objects.create(user=current, plan_type='premium', status='active',
+                                    current_period_end=now + timedelta(days=10))
+
+        out = StringIO()
+        call_command('expire_subscriptions', batch_size=2, dry_run=True, stdout=out)
+        self.assertIn('5件', out.getvalue())
+        self.assertFalse(Subscription.objects.filter(status='inactive').exists())
+
+        call_command('expire_subscriptions', batch_size=2, stdout=StringIO())
+        self.assertEqual(Subscription.objects.filter(status='inactive').count(), 5)
+        self.assertFalse(User.objects.filter(pk__in=[u.pk for u in lapsed], is_premium=True).exists())
+        current.refresh_from_db()
+        self.assertTrue(current.is_premium)
+        self.assertEqual(Subscription.objects.get(user=current).status, 'active')
+
+
+class AdminChangelistQueryTests(TestCase):
+    """管理画面の一覧のクエリ数が行数に比例しないこと"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        for i in range(10):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password')
+            Subscription.objects.create(user=user, plan_type='premium', status='active')
+            Payment.objects.create(user=user, stripe_payment_intent_id=f'pi_{i}', amount=1480, status='succeeded')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_subscription_changelist(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/admin/subscriptions/subscription/')
+        self.assertContains(response, 'user9@example.com')
+
+    def test_payment_changelist(self):
+        # ステータス・通貨の絞り込み候補の分だけ多い
+        with self.assertNumQueries(7):
+            response = self.client.get('/admin/subscriptions/payment/')
+        self.assertContains(response, '¥1,480')
@@ -6,4 +6,6 @@ urlpatterns = [
     path('create/', views.create_subscription, name='create_subscription'),
     path('status/', views.subscription_status, name='subscription_status'),
     path('cancel/', views.cancel_subscription, name='cancel_subscription'),
+    path('webhook/', views.stripe_webhook, name='stripe_webhook'),
+    path('revenue/', views.revenue_report, name='revenue_report'),
 ]
\ No newline at end of file
@@ -1,63 +1,93 @@
 # subscriptions/views.py
-import stripe
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from reminders.triggers import get_trigger_set
+from .entitlements import get_entitlements
 from .models import Subscription
-from .serializers import SubscriptionSerializer
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from .revenue import revenue_series
+from .stripe_client import StripeError, StripeUnavailable, get_stripe_client
+from .webhooks import verify_and_store
 
 @api_view(['POST'])
 def create_subscription(request):
     """プレミアムプランの購読を開始"""
     try:
-        # Stripeで顧客を作成/取得
-        user = request.user
+        stripe = get_stripe_client()
+        # Stripeで顧客を作成/取得（request.userは認証キャッシュのスナップショットなのでDBから読み直す）
+        user = get_user_model().objects.get(pk=request.user.pk)
         if not user.stripe_customer_id:
-            customer = stripe.Customer.create(
+            customer = stripe.create_customer(
                 email=user.email,
-                name=user.username
+                name=user.username,
+                idempotency_key=stripe.idempotency_key('customer', {'user': user.pk}),
             )
-            user.stripe_customer_id = customer.id
-            user.save()
-        
-        # 購読を作成
-        subscription = stripe.Subscription.create(
+            user.stripe_customer_id = customer['id']
+            user.save(update_fields=['stripe_customer_id'])
+
+        # 購読を作成（二重送信で購読が2つできないよう冪等キーを付ける。解約後の再購読は別のキーになる）
+        existing = Subscription.objects.filter(user=user).first()
+        canceled_at = existing.canceled_at if existing else None
+        price = settings.STRIPE_PREMIUM_PRICE_ID
+        subscription = stripe.create_subscription(
             customer=user.stripe_customer_id,
-            items=[{'price': 'price_premium_monthly'}],  # Stripeで作成した価格ID
-            payment_behavior='default_incomplete',
-            expand=['latest_invoice.payment_intent'],
+            price=price,
+            idempotency_key=stripe.idempotency_key('subscription', {
+                'user': user.pk,
+                'customer': user.stripe_customer_id,
+                'price': price,
+                'canceled_at': canceled_at.isoformat() if canceled_at else '',
+            }),
         )
 
         # データベースに保存
         sub, created = Subscription.objects.get_or_create(
             user=user,
             defaults={
-                'stripe_subscription_id': subscription.id,
+                'stripe_subscription_id': subscription['id'],
                 'plan_type': 'premium',
                 'status': 'inactive'
             }
         )
+        if not created and sub.stripe_subscription_id != subscription['id']:
+            sub.stripe_subscription_id = subscription['id']
+            sub.plan_type = 'premium'
+            sub.status = 'inactive'
+            sub.save()
 
         return Response({
-            'subscription_id': subscription.id,
-            'client_secret': subscription.latest_invoice.payment_intent.client_secret
+            'subscription_id': subscription['id'],
+            'client_secret': subscription['latest_invoice']['payment_intent']['client_secret']
         })
 
+    except StripeUnavailable:
+        return Response({'error': '決済サービスに接続できません。しばらくしてから再度お試しください'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 def subscription_status(request):
-    """現在の購読状況を取得"""
-    try:
-        subscription = Subscription.objects.get(user=request.user)
-        serializer = SubscriptionSerializer(subscription)
-        return Response(serializer.data)
-    except Subscription.DoesNotExist:
-        return Response({'plan_type': 'free', 'status': 'active'})
+    """現在の購読状況とプランの利用上限を取得（キャッシュ済みのエンタイトルメントを返す）"""
+    entitlements = get_entitlements(request.user.pk)
+    data = dict(entitlements.subscription or {'plan_type': 'free', 'status': 'active'})
+    data['plan'] = entitlements.plan
+    data['limits'] = entitlements.limits
+    # 上限を超えているため通知されない・距離を縮めて判定しているリマインダー（プラン変更後など）
+    data['over_limit_reminders'] = list(get_trigger_set(request.user.pk).over_limit(
+        entitlements.max_active_reminders, entitlements.max_trigger_distance
+    ))
+    return Response(data)
 
 @api_view(['POST'])
 def cancel_subscription(request):
@@ -65,19 +95,81 @@ def cancel_subscription(request):
     try:
         subscription = Subscription.objects.get(user=request.user)
         if subscription.stripe_subscription_id:
-            stripe.Subscription.delete(subscription.stripe_subscription_id)
+            try:
+                get_stripe_client().cancel_subscription(subscription.stripe_subscription_id)
+            except StripeError as e:
+                # Stripe側で既に削除済みなら、こちらの状態だけ合わせる
+                if e.code != 'resource_missing':
+                    raise
         
         subscription.status = 'canceled'
         subscription.canceled_at = timezone.now()
         subscription.save()
 
+        # 古いスナップショットで他のフィールドを上書きしないよう、is_premiumだけを書き込む
         user = request.user
         user.is_premium = False
-        user.save()
+        user.save(update_fields=['is_premium'])
 
         return Response({'message': '購読がキャンセルされました'})
 
     except Subscription.DoesNotExist:
         return Response({'error': '購読が見つかりません'}, status=status.HTTP_404_NOT_FOUND)
+    except StripeUnavailable:
+        return Response({'error': '決済サービスに接続できません。しばらくしてから再度お試しください'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Stripe Webhookの受信（署名を検証して受信箱に保存するだけ。反映はprocess_stripe_eventsコマンド）"""
+    try:
+        verify_and_store(request.body, request.META.get('HTTP_STRIPE_SIGNATURE'))
+    except ValueError:
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
+
+
+@api_view(['GET'])
+# 管理画面のダッシュボードからも開けるようセッション認証も受け付ける
+@authentication_classes([*api_settings.DEFAULT_AUTHENTICATION_CLASSES, SessionAuthentication])
+@permission_classes([IsAdminUser])
+def revenue_report(request):
+    """売上の日次・月次集計（管理者用。集計テーブルだけを読む）"""
+    period = request.query_params.get('period', 'day')
+    if period not in ('day', 'month'):
+        return Response({'error': 'periodはdayまたはmonthを指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.query_params.get(name)
+        if value:
+            try:
+                bounds[name] = parse_date(value)
+            except ValueError:
+                bounds[name] = None
+            if bounds[name] is None:
+                return Response({'error': f'無効な日付です: {name}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = revenue_series(
+        period,
+        since=bounds.get('since'),
+        until=bounds.get('until'),
+        currency=request.query_params.get('currency'),
+        status=request.query_params.get('status'),
+    )
+    return Response({
+        'period': period,
+        'results': [
+            {
+                'period_start': row['period_start'],
+                'currency': row['currency'],
+                'status': row['status'],
+                'amount': str(row['amount']),
+                'payment_count': row['payment_count'],
+            }
+            for row in rows
+        ],
+    })
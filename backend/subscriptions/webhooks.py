@@ -0,0 +1,262 @@
+# subscriptions/webhooks.py
+"""
+Stripe Webhookイベントの取り込みと反映。
+
+- 受信時は署名を検証してStripeEventに保存するだけ（イベントIDで一意なので再送は無視される）
+- process_batch() が未処理のイベントを発生時刻順にまとめて取り出し、
+  Subscription・Payment・User.is_premium に反映する
+- 各行のlast_event_atより古いイベントは反映しない（順不同の配送でも最新の状態が残る）
+- Stripeのcreatedは秒単位なので、last_event_atと同じ秒のイベントは購読の状態（解約済みか・期間）で
+  前後を判定し、それでも決まらなければStripeから購読を取り直して反映する
+"""
+import json
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Payment, StripeEvent, Subscription
+from .stripe_client import StripeError, get_stripe_client
+
+logger = logging.getLogger(__name__)
+
+# Stripeの購読ステータス -> Subscription.status
+SUBSCRIPTION_STATUS_MAP = {
+    'active': 'active',
+    'trialing': 'active',
+    'past_due': 'past_due',
+    'unpaid': 'past_due',
+    'canceled': 'canceled',
+    'incomplete_expired': 'canceled',
+    'incomplete': 'inactive',
+    'paused': 'inactive',
+}
+
+# 最小単位が1の通貨（金額を100で割らない）
+ZERO_DECIMAL_CURRENCIES = {'jpy', 'krw', 'vnd', 'clp', 'pyg', 'xaf', 'xof', 'bif', 'djf', 'gnf', 'kmf', 'mga',
+                           'rwf', 'ugx', 'vuv', 'xpf'}
+
+
+class RetryLater(Exception):
+    """今は反映できないが後で再試行すべきイベント（ユーザー未作成など）"""
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def verify_and_store(payload, signature_header):
+    """
+    署名を検証してイベントを受信箱に保存する。
+    署名が不正な場合はValueErrorを送出する。新規に保存した場合はTrueを返す。
+    """
+    import stripe
+
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload, signature_header, settings.STRIPE_WEBHOOK_SECRET,
+            tolerance=settings.STRIPE_WEBHOOK_TOLERANCE,
+        )
+        event = json.loads(payload)
+    except (stripe.SignatureVerificationError, ValueError) as e:
+        raise ValueError(str(e))
+
+    if not isinstance(event, dict) or not event.get('id') or not event.get('type'):
+        raise ValueError('イベントの形式が不正です')
+
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'created': _timestamp(event.get('created')) or timezone.now(),
+            'payload': event,
+        },
+    )
+    return created
+
+
+# --- 反映処理 ---
+
+def _user_for_customer(customer_id):
+    User = get_user_model()
+    user = User.objects.filter(stripe_customer_id=customer_id).first() if customer_id else None
+    if user is None:
+        # create_subscriptionのコミット前に届いた可能性があるので後で再試行する
+        raise RetryLater(f'顧客 {customer_id} のユーザーが見つかりません')
+    return user
+
+
+def _period(obj):
+    # 新しいAPIバージョンでは期間が購読アイテム側にある
+    start, end = obj.get('current_period_start'), obj.get('current_period_end')
+    if start is None or end is None:
+        items = (obj.get('items') or {}).get('data') or []
+        if items:
+            start = items[0].get('current_period_start', start)
+            end = items[0].get('current_period_end', end)
+    return _timestamp(start), _timestamp(end)
+
+
+def _subscription_status(event_type, obj):
+    if event_type == 'customer.subscription.deleted':
+        return 'canceled'
+    return SUBSCRIPTION_STATUS_MAP.get(obj.get('status'), 'inactive')
+
+
+def _is_newer_state(subscription, subscription_id, status, period_end):
+    """
+    最後に反映したイベントと同じ秒のイベントについて、その状態が新しいかを判定する。
+    判定できない場合はNoneを返す。
+    """
+    if subscription_id != subscription.stripe_subscription_id:
+        # 解約済みの購読より、新しく作られた購読を優先する
+        return status != 'canceled'
+    if subscription.status == 'canceled' or status == 'canceled':
+        # Stripeで解約された購読は再開されないので、解約が常に後
+        return status == 'canceled'
+    if period_end and subscription.current_period_end and period_end != subscription.current_period_end:
+        return period_end > subscription.current_period_end
+    if status == subscription.status:
+        return True
+    return None
+
+
+def _fetch_subscription(subscription_id):
+    try:
+        return get_stripe_client().retrieve_subscription(subscription_id)
+    except StripeError as e:
+        raise RetryLater(f'購読 {subscription_id} をStripeから取得できません: {e}')
+
+
+def _apply_subscription(event, obj, event_at):
+    user = _user_for_customer(obj.get('customer'))
+    subscription, _ = Subscription.objects.select_for_update().get_or_create(user=user)
+    if subscription.last_event_at and event_at < subscription.last_event_at:
+        return False
+
+    status = _subscription_status(event['type'], obj)
+    period_start, period_end = _period(obj)
+    if subscription.last_event_at == event_at:
+        # 同じ秒のイベントは受信順では前後が分からない
+        newer = _is_newer_state(subscription, obj.get('id'), status, period_end)
+        if newer is None:
+            obj = _fetch_subscription(obj['id'])
+            status = _subscription_status(None, obj)
+            period_start, period_end = _period(obj)
+        elif not newer:
+            return False
+
+    subscription.stripe_subscription_id = obj.get('id', subscription.stripe_subscription_id)
+    subscription.plan_type = 'premium' if status in ('active', 'past_due') else subscription.plan_type
+    subscription.status = status
+    subscription.current_period_start = period_start or subscription.current_period_start
+    subscription.current_period_end = period_end or subscription.current_period_end
+    if status == 'canceled':
+        subscription.canceled_at = _timestamp(obj.get('canceled_at') or obj.get('ended_at')) or event_at
+    subscription.last_event_at = event_at
+    subscription.save()
+
+    # 支払い遅延中（Stripeが再請求している間）はプレミアムを維持する
+    is_premium = status in ('active', 'past_due')
+    if user.is_premium != is_premium:
+        user.is_premium = is_premium
+        user.save(update_fields=['is_premium'])
+    return True
+
+
+def _apply_invoice(event, obj, event_at):
+    payment_intent = obj.get('payment_intent')
+    if isinstance(payment_intent, dict):
+        payment_intent = payment_intent.get('id')
+    if not payment_intent:
+        # 0円の請求など決済を伴わないもの
+        return False
+
+    user = _user_for_customer(obj.get('customer'))
+    currency = (obj.get('currency') or 'jpy').lower()
+    if event['type'] == 'invoice.paid':
+        amount, status = obj.get('amount_paid') or 0, 'succeeded'
+    else:
+        amount, status = obj.get('amount_due') or 0, 'failed'
+    amount = Decimal(amount) if currency in ZERO_DECIMAL_CURRENCIES else Decimal(amount) / 100
+
+    payment = (
+        Payment.objects.select_for_update()
+        .filter(stripe_payment_intent_id=payment_intent)
+        .first()
+    )
+    if payment is None:
+        payment = Payment(user=user, stripe_payment_intent_id=payment_intent)
+    elif payment.last_event_at and event_at < payment.last_event_at:
+        return False
+    payment.amount = amount
+    payment.currency = currency
+    payment.status = status
+    payment.last_event_at = event_at
+    payment.save()
+    return True
+
+
+HANDLERS = {
+    'customer.subscription.created': _apply_subscription,
+    'customer.subscription.updated': _apply_subscription,
+    'customer.subscription.deleted': _apply_subscription,
+    'invoice.paid': _apply_invoice,
+    'invoice.payment_failed': _apply_invoice,
+}
+
+
+def apply_event(event):
+    """
+    イベント1件を反映する。反映したらTrue、古い・対象外のイベントならFalse。
+    呼び出し側のトランザクション内で呼ぶこと。
+    """
+    handler = HANDLERS.get(event['type'])
+    if handler is None:
+        return False
+    obj = (event.get('data') or {}).get('object') or {}
+    return handler(event, obj, _timestamp(event.get('created')) or timezone.now())
+
+
+def process_batch(batch_size=100):
+    """
+    未処理のイベントを発生時刻順に取り出して反映する。
+    イベントごとにセーブポイントを切るので、1件の失敗がバッチ全体を巻き戻さない。
+    処理した件数を返す。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('created', 'id')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    applied = apply_event(event.payload)
+            except Exception as e:
+                if isinstance(e, RetryLater):
+                    event.last_error = str(e)
+                else:
+                    logger.exception(f'Stripeイベントの反映に失敗しました: {event.event_id}')
+                    event.last_error = f'{type(e).__name__}: {e}'
+                if event.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+                    event.status = 'failed'
+                else:
+                    event.next_attempt_at = now + timedelta(seconds=30 * 2 ** (event.attempts - 1))
+                continue
+            event.status = 'processed' if applied else 'ignored'
+            event.last_error = ''
+            event.processed_at = now
+
+        StripeEvent.objects.bulk_update(events, ['status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at'])
+    return len(events)
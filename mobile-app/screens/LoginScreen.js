@@ -26,7 +26,7 @@ const LoginScreen = ({ navigation }) => {
 
   // Google認証の設定
   const googleConfig = GoogleAuthService.getAuthConfig();
-  const [request, response, promptAsync] = Google.useAuthRequest(googleConfig);
+  const [request, response, promptAsync] = Google.useIdTokenAuthRequest(googleConfig);
 
   // Google認証レスポンスの処理
   useEffect(() => {
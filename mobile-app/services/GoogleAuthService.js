@@ -31,6 +31,7 @@ class GoogleAuthService {
 
   /**
    * Google認証リクエストの設定を作成（Hookなので関数内で使用する必要があります）
+   * Google.useIdTokenAuthRequestに渡し、レスポンスのparams.id_tokenを受け取る
    */
   getAuthConfig() {
     return {
@@ -66,10 +67,11 @@ class GoogleAuthService {
 
   /**
    * バックエンドでGoogle認証を処理
+   * ユーザー情報はバックエンドがIDトークンの検証結果から取り出すため、IDトークンだけを送る
    */
-  async authenticateWithBackend(googleUserInfo, accessToken) {
+  async authenticateWithBackend(idToken) {
     try {
-      console.log('バックエンドGoogle認証開始:', googleUserInfo.email);
+      console.log('バックエンドGoogle認証開始');
       
       const response = await fetch(`${this.API_BASE_URL}/auth/google/`, {
         method: 'POST',
@@ -77,12 +79,7 @@ class GoogleAuthService {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          access_token: accessToken,
-          email: googleUserInfo.email,
-          first_name: googleUserInfo.given_name || '',
-          last_name: googleUserInfo.family_name || '',
-          google_id: googleUserInfo.id,
-          picture: googleUserInfo.picture || '',
+          id_token: idToken,
         }),
       });
 
@@ -92,7 +89,7 @@ class GoogleAuthService {
         throw new Error(data.error || 'バックエンド認証に失敗しました');
       }
 
-      console.log('バックエンドGoogle認証成功:', data);
+      console.log('バックエンドGoogle認証成功:', data.user?.email);
       return data;
     } catch (error) {
       console.error('バックエンドGoogle認証エラー:', error);
@@ -118,20 +115,16 @@ class GoogleAuthService {
         throw new Error('認証に失敗しました');
       }
 
-      const { access_token } = result.params;
+      const { id_token } = result.params;
       
-      if (!access_token) {
-        throw new Error('アクセストークンが取得できませんでした');
+      if (!id_token) {
+        throw new Error('IDトークンが取得できませんでした');
       }
 
-      console.log('Googleアクセストークン取得成功');
+      console.log('GoogleのIDトークン取得成功');
 
-      // Googleからユーザー情報を取得
-      const googleUserInfo = await this.getUserInfo(access_token);
-      console.log('Googleユーザー情報取得成功:', googleUserInfo.email);
-
-      // バックエンドで認証処理
-      const backendResponse = await this.authenticateWithBackend(googleUserInfo, access_token);
+      // バックエンドでIDトークンを検証して認証処理
+      const backendResponse = await this.authenticateWithBackend(id_token);
 
       // 認証トークンを保存
       if (backendResponse.token) {